@@ -1,41 +1,172 @@
 import logging
-from logging.handlers import SMTPHandler, RotatingFileHandler
+from logging.handlers import RotatingFileHandler
 import os
-from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
+import threading
+import time
+from flask import Flask, current_app, has_app_context
+from flask_sqlalchemy import SQLAlchemy, SignallingSession, get_state
+from sqlalchemy import orm
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
 from flask_marshmallow import Marshmallow
-from flask_migrate import Migrate
 from flask_login import LoginManager
 
 # from flask_admin import Admin
 from flask_mail import Mail
 from flask_cors import CORS
-from flask_babel import lazy_gettext as _l
 from config import Config
+from app import log, metrics, slow_queries, timing
 
 
-db = SQLAlchemy()
+class Session(SignallingSession):
+    """
+    Session whose commits can be deferred, so several view functions can run
+    inside one transaction (see the batch endpoint). While ``deferred_commit``
+    is set in ``session.info`` a commit only flushes.
+    """
+
+    def commit(self):
+        if self.info.get("deferred_commit"):
+            self.flush()
+        else:
+            super(Session, self).commit()
+
+    def get_bind(self, mapper=None, clause=None):
+        # While ``replica`` is set in ``session.info`` (GET requests to the
+        # API) the data tables are read from the replica, if one is configured
+        if (
+            self.info.get("replica")
+            and mapper is not None
+            and not self._flushing
+            and getattr(mapper.persist_selectable, "name", None) in REPLICA_TABLES
+            and "replica" in (self.app.config["SQLALCHEMY_BINDS"] or ())
+        ):
+            return get_state(self.app).db.get_engine(self.app, bind="replica")
+        return super(Session, self).get_bind(mapper, clause)
+
+
+# Tables that may be read from the replica. Users, jobs and idempotency keys
+# are read back right after they are written, so they stay on the primary.
+REPLICA_TABLES = ("groups", "organizations", "violence", "nonviolence", "tombstones")
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waits for a connection."""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super(TimedQueuePool, self)._do_get()
+        except Exception:
+            metrics.inc("db_pool_checkout_errors_total", pool=self.logging_name)
+            raise
+        finally:
+            metrics.observe(
+                "db_pool_checkout_seconds",
+                time.perf_counter() - start,
+                pool=self.logging_name,
+            )
+
+
+class Database(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=Session, db=self, **options)
+
+    def apply_driver_hacks(self, app, sa_url, options):
+        replica = (app.config["SQLALCHEMY_BINDS"] or {}).get("replica")
+        name = "replica" if replica and make_url(replica) == sa_url else "primary"
+        sa_url, options = super(Database, self).apply_driver_hacks(app, sa_url, options)
+        # Time checkouts wherever SQLAlchemy would use its default QueuePool
+        if "poolclass" not in options and not sa_url.drivername.startswith("sqlite"):
+            options["poolclass"] = TimedQueuePool
+        options["pool_logging_name"] = name
+        return sa_url, options
+
+
+db = Database()
+
+
+@metrics.collector
+def pool_gauges():
+    if not has_app_context():
+        return
+    app = current_app._get_current_object()
+    for bind in [None, *(app.config["SQLALCHEMY_BINDS"] or ())]:
+        pool = db.get_engine(app, bind).pool
+        if isinstance(pool, QueuePool):
+            labels = {"pool": pool.logging_name}
+            yield "db_pool_size", labels, pool.size()
+            yield "db_pool_checked_out", labels, pool.checkedout()
+            yield "db_pool_overflow", labels, pool.overflow()
+
+
+metrics.describe(
+    "db_pool_checkout_seconds", "histogram", "Time spent waiting for a connection"
+)
+metrics.describe(
+    "db_pool_checkout_errors_total", "counter", "Checkouts that timed out or failed"
+)
+metrics.describe("db_pool_size", "gauge", "Connections the pool keeps open")
+metrics.describe("db_pool_checked_out", "gauge", "Connections in use")
+metrics.describe("db_pool_overflow", "gauge", "Connections opened past the pool size")
 ma = Marshmallow()
-migrate = Migrate()
 login = LoginManager()
 login.login_view = "auth.login"
-login.login_message = _l("Please log in to access this page.")
 mail = Mail()
 cors = CORS()
 
 
+def init_migrate(app):
+    # Imports alembic, which only the `flask db` commands need
+    from flask_migrate import Migrate
+
+    Migrate(app, db)
+
+
+def init_login(app):
+    from flask_babel import lazy_gettext as _l
+
+    login.login_message = _l("Please log in to access this page.")
+    login.init_app(app)
+
+
+# Optional subsystems by the name they take in app.extensions. With
+# LAZY_EXTENSIONS they are set up by ensure_extension on first use instead of
+# in create_app.
+EXTENSIONS = {
+    "migrate": init_migrate,
+    "login_manager": init_login,
+    "mail": mail.init_app,
+}
+_extensions_lock = threading.Lock()
+
+
+def ensure_extension(name, app=None):
+    """Set up an optional subsystem for ``app`` if it is not yet."""
+    app = app or current_app._get_current_object()
+    if name not in app.extensions:
+        with _extensions_lock:
+            if name not in app.extensions:
+                EXTENSIONS[name](app)
+                # flask_login keeps itself on app.login_manager
+                app.extensions.setdefault(name, True)
+
+
 def create_app(config_class=Config):
     # Instantiate app
     app = Flask(__name__)
     app.config.from_object(config_class)
+    # For the processes that build an app of their own, e.g. job workers
+    app.config_class = config_class
 
     # Set up extensions
     db.init_app(app)
-    migrate.init_app(app, db)
     ma.init_app(app)
-    login.init_app(app)
-    mail.init_app(app)
     cors.init_app(app)
+    # The flask command line always sets everything up, so `flask db` works
+    if not app.config["LAZY_EXTENSIONS"] or os.environ.get("FLASK_RUN_FROM_CLI"):
+        for name in EXTENSIONS:
+            ensure_extension(name, app)
 
     # Register Blueprints
     from app.errors import bp as errors_bp
@@ -54,11 +185,17 @@ def create_app(config_class=Config):
     app.register_blueprint(main_bp)
     app.register_blueprint(api_bp, url_prefix="/api", cli_group=None)
     app.register_blueprint(swagger_bp, url_prefix=SWAGGER_URL)
+    # Metrics first, so requests turned away by the limits are counted
+    metrics.init_app(app)
+    timing.init_app(app)
+    slow_queries.init_app(app)
+    limits.init_app(app, [api_bp])
     # app.register_blueprint(filter_bp)
     # app.register_blueprint(admin_bp)
 
     # Set up mail server and logging
     if not app.debug and not app.testing:
+        handlers = []
         if app.config["MAIL_SERVER"]:
             auth = None
             if app.config["MAIL_USERNAME"] or app.config["MAIL_PASSWORD"]:
@@ -66,26 +203,30 @@ def create_app(config_class=Config):
             secure = None
             if app.config["MAIL_USE_TLS"]:
                 secure = ()
-            mail_handler = SMTPHandler(
+            mail_handler = log.ErrorMailHandler(
                 mailhost=(app.config["MAIL_SERVER"], app.config["MAIL_PORT"]),
                 fromaddr="no-reply@" + app.config["MAIL_SERVER"],
                 toaddrs=app.config["ADMIN_EMAIL"],
                 subject="SRDP Database Failure",
                 credentials=auth,
                 secure=secure,
+                interval=app.config["MAIL_ERRORS_INTERVAL"],
+                limit=app.config["MAIL_ERRORS_LIMIT"],
             )
             mail_handler.setLevel(logging.ERROR)
-            app.logger.addHandler(mail_handler)
+            handlers.append(mail_handler)
 
         if app.config["LOG_TO_STDOUT"]:
             stream_handler = logging.StreamHandler()
             stream_handler.setLevel(logging.INFO)
-            app.logger.addHandler(stream_handler)
+            handlers.append(stream_handler)
         else:
             if not os.path.exists("logs"):
                 os.mkdir("logs")
             file_handler = RotatingFileHandler(
-                "logs/SRDP.log", maxBytes=10240, backupCount=10
+                "logs/SRDP.log",
+                maxBytes=app.config["LOG_MAX_BYTES"],
+                backupCount=app.config["LOG_BACKUPS"],
             )
             file_handler.setFormatter(
                 logging.Formatter(
@@ -94,12 +235,37 @@ def create_app(config_class=Config):
                 )
             )
             file_handler.setLevel(logging.INFO)
-            app.logger.addHandler(file_handler)
+            handlers.append(file_handler)
 
+        # Handlers run on a listener thread, off the request path
+        log.init_app(app, handlers)
         app.logger.setLevel(logging.INFO)
         app.logger.info("SRDP DB Startup")
 
     return app
 
 
-from app import models
+def warm_up(app):
+    """
+    Build what every worker would otherwise build for itself, so that with a
+    preloaded app the workers share it copy-on-write.
+    """
+    from app.api.docs import openapi_document
+
+    orm.configure_mappers()
+    openapi_document(app)
+
+
+def after_fork(app):
+    """
+    Drop the database connections and session a forked worker inherited from
+    its parent, as each worker must open its own, and start its log listener.
+    """
+    log.after_fork(app)
+    with app.app_context():
+        db.session.remove()
+        for bind in [None, *(app.config.get("SQLALCHEMY_BINDS") or ())]:
+            db.get_engine(app, bind).dispose(close=False)
+
+
+from app import models, events, limits
@@ -1,8 +1,12 @@
-from flask import Blueprint
+import json
+import click
+from flask import Blueprint, g, request
 from config import Config
 from flask_swagger_ui import get_swaggerui_blueprint
 from app.models import User
 from app import db
+from app.dataset import TABLES, load_csv, load_csv_infile, sync_csv
+from app.jobs import run_workers
 
 SWAGGER_URL = "/api/docs"
 API_URL = "/api/swagger.json"
@@ -13,6 +17,19 @@ swagger_ui_blueprint = get_swaggerui_blueprint(
 
 bp = Blueprint("api", __name__, cli_group=None)
 
+
+# Read-replica routing
+@bp.before_request
+def route_reads():
+    # Not inside a batch, whose reads must see the batch's own writes
+    db.session.info["replica"] = request.method == "GET" and not g.get("batch")
+
+
+@bp.teardown_request
+def end_route_reads(exc):
+    db.session.info.pop("replica", None)
+
+
 # Create admin command
 @bp.cli.command("create-admin")
 def create_admin():
@@ -36,6 +53,85 @@ def create_admin():
     print(f"Admin <username: {uname}, email: {email}> successfully created.")
 
 
+# Bulk load command
+@bp.cli.command("load-csv")
+@click.argument("table", type=click.Choice(list(TABLES)))
+@click.argument("file", type=click.Path(exists=True, dir_okay=False))
+@click.option("--chunk-size", default=5000, help="Rows read and validated at a time.")
+@click.option(
+    "--local-infile",
+    is_flag=True,
+    help="Load with MySQL LOAD DATA LOCAL INFILE after validating the file.",
+)
+def load_csv_command(table, file, chunk_size, local_infile):
+    """Validate a dataset csv and bulk insert it directly into TABLE."""
+    try:
+        if local_infile:
+            loaded = load_csv_infile(table, file, chunk_size=chunk_size)
+        else:
+            loaded = load_csv(table, file, chunk_size=chunk_size)
+    except ValueError as e:
+        raise click.ClickException(f"{file}: {e}")
+    print(f"Loaded {loaded} rows from {file} into {table}.")
+
+
+# Release sync command
+@bp.cli.command("sync-csv")
+@click.argument("table", type=click.Choice(list(TABLES)))
+@click.argument("file", type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "--dry-run", is_flag=True, help="Report the changes without applying them."
+)
+@click.option(
+    "--report",
+    type=click.Path(dir_okay=False),
+    help="Write the full change report to this json file.",
+)
+def sync_csv_command(table, file, dry_run, report):
+    """Make TABLE match a full release csv, writing only the changed rows."""
+    try:
+        result = sync_csv(table, file, dry_run=dry_run)
+    except ValueError as e:
+        raise click.ClickException(f"{file}: {e}")
+    if report:
+        with open(report, "w") as f:
+            json.dump(result, f, indent=2)
+    action = "Would apply" if dry_run else "Applied"
+    print(
+        f"{action} {result['inserted']} inserts, {result['updated']} updates and "
+        f"{result['deleted']} deletes to {table} ({result['unchanged']} unchanged)."
+    )
+
+
+# Background jobs worker
+@bp.cli.command("jobs-worker")
+@click.option("--processes", default=2, help="Number of worker processes.")
+@click.option("--burst", is_flag=True, help="Exit once the queue is empty.")
+def jobs_worker_command(processes, burst):
+    """Run queued background jobs."""
+    run_workers(processes, burst=burst)
+
+
+# OpenAPI document command
+@bp.cli.command("openapi")
+@click.option(
+    "--output",
+    type=click.Path(dir_okay=False),
+    help="File to write, defaults to OPENAPI_JSON.",
+)
+def openapi_command(output):
+    """Write the OpenAPI document served at /api/swagger.json."""
+    from flask import current_app
+    from app.api.docs import build_openapi
+
+    output = output or current_app.config["OPENAPI_JSON"]
+    if not output:
+        raise click.ClickException("pass --output or set OPENAPI_JSON")
+    with open(output, "wb") as f:
+        f.write(build_openapi(current_app))
+    print(f"Wrote the OpenAPI document to {output}.")
+
+
 from app.api import (
     users,
     errors,
@@ -44,4 +140,12 @@ from app.api import (
     organizations,
     violent_tactics,
     nonviolent_tactics,
+    changes,
+    stream,
+    batch,
+    jobs,
+    sync,
+    bulk,
+    docs,
+    profiling,
 )
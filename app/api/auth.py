@@ -1,12 +1,15 @@
+from flask import g
 from flask_httpauth import HTTPBasicAuth, HTTPTokenAuth
 from app.models import User
 from app.api.errors import error_response
+from app.timing import timed
 
 basic_auth = HTTPBasicAuth()
 token_auth = HTTPTokenAuth()
 
 
 @basic_auth.verify_password
+@timed("auth")
 def verify_password(username, password):
     user = User.query.filter_by(username=username).first()
     if user and user.check_password(password):
@@ -19,8 +22,14 @@ def basic_auth_error(status):
 
 
 @token_auth.verify_token
+@timed("auth")
 def verify_token(token):
-    return User.check_token(token) if token else None
+    if not token:
+        return None
+    # Batched sub-requests reuse the user authenticated by the batch request
+    if g.get("batch") and g.batch_user[0] == token:
+        return g.batch_user[1]
+    return User.check_token(token)
 
 
 @token_auth.error_handler
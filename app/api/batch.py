@@ -0,0 +1,139 @@
+from flask import current_app, g, jsonify, request
+from app import db
+from app.api import bp
+from app.api.auth import token_auth
+from app.api.errors import bad_request, error_response
+
+
+BATCH_METHODS = ("GET", "POST", "PUT", "PATCH", "DELETE")
+# Endpoints that cannot run inside a batch
+NON_BATCHABLE = ("api.batch", "api.stream_events")
+
+
+def dispatch(sub_request, authorization):
+    """Run one sub-request through the regular view functions."""
+    headers = dict(sub_request.get("headers") or {})
+    if authorization:
+        headers["Authorization"] = authorization
+    kwargs = {}
+    if sub_request.get("body") is not None:
+        kwargs["json"] = sub_request["body"]
+    with current_app.test_request_context(
+        sub_request["path"],
+        method=sub_request.get("method", "GET").upper(),
+        headers=headers,
+        **kwargs,
+    ):
+        if request.endpoint in NON_BATCHABLE:
+            return bad_request(f"{request.path} cannot be called inside a batch.")
+        try:
+            return current_app.full_dispatch_request()
+        except Exception:
+            current_app.logger.exception(f"Batch sub-request {request.path} failed")
+            return error_response(500)
+
+
+def serialize(response):
+    body = response.get_json(silent=True)
+    if body is None:
+        body = response.get_data(as_text=True) or None
+    data = {"status": response.status_code, "body": body}
+    if "Location" in response.headers:
+        data["headers"] = {"Location": response.headers["Location"]}
+    return data
+
+
+@bp.route("/batch", methods=["POST"])
+@token_auth.login_required
+def batch():
+    """
+    ---
+    post:
+      summary: Run several API calls in one request
+      description: >
+        Dispatches a list of sub-requests to the regular endpoints, reusing the
+        caller's authentication, and returns every response together. With
+        `atomic` set, all sub-requests share one transaction that is committed
+        only if every sub-request succeeds; processing stops at the first
+        failure and nothing is written.
+      security:
+        - BasicAuth: []
+        - BearerAuth: []
+      requestBody:
+        required: true
+        content:
+          application/json:
+            schema:
+              type: object
+              properties:
+                atomic:
+                  type: boolean
+                requests:
+                  type: array
+                  items:
+                    type: object
+                    properties:
+                      method:
+                        type: string
+                      path:
+                        type: string
+                      body: {}
+                      headers:
+                        type: object
+      responses:
+        '200':
+          description: call successful
+        '400':
+          description: Malformed batch
+        '401':
+          description: Not authenticated
+      tags:
+        - Batch
+    """
+    data = request.get_json() or {}
+    if isinstance(data, list):
+        data = {"requests": data}
+    sub_requests = data.get("requests")
+    atomic = bool(data.get("atomic", False))
+    if not isinstance(sub_requests, list) or not sub_requests:
+        return bad_request("must include a non-empty requests list")
+    max_requests = current_app.config["BATCH_MAX_REQUESTS"]
+    if len(sub_requests) > max_requests:
+        return bad_request(f"a batch may contain at most {max_requests} requests")
+    for i, sub_request in enumerate(sub_requests):
+        if (
+            not isinstance(sub_request, dict)
+            or not isinstance(sub_request.get("path"), str)
+            or not sub_request["path"].startswith("/api/")
+            or sub_request.get("method", "GET").upper() not in BATCH_METHODS
+        ):
+            return bad_request(
+                f"request {i} must have an /api/ path and one of the methods "
+                f"{', '.join(BATCH_METHODS)}"
+            )
+
+    authorization = request.headers.get("Authorization")
+    responses = []
+    committed = True
+    g.batch = True
+    g.batch_user = (token_auth.get_auth().token, token_auth.current_user())
+    if atomic:
+        db.session.info["deferred_commit"] = True
+    try:
+        for sub_request in sub_requests:
+            response = dispatch(sub_request, authorization)
+            responses.append(serialize(response))
+            if response.status_code >= 400:
+                if atomic:
+                    committed = False
+                    break
+                db.session.rollback()
+    finally:
+        db.session.info.pop("deferred_commit", None)
+        g.batch = False
+    if atomic:
+        if committed:
+            db.session.commit()
+        else:
+            db.session.rollback()
+    return jsonify({"responses": responses, "committed": committed})
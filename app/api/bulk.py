@@ -0,0 +1,164 @@
+from flask import jsonify, request
+from app import db
+from app.api import bp
+from app.api.auth import token_auth
+from app.api.errors import bad_request
+from app.api.jobs import accepted, wants_async
+from app.dataset import TABLES, delete_rows, update_each, update_rows
+from app.jobs import submit
+
+COLLECTIONS = "any(" + ", ".join(TABLES) + ")"
+
+
+def selected_keys(model):
+    """
+    Primary keys selected by a bulk request: the ``ids`` listed in the body,
+    or the rows matching the collection filters given as query arguments.
+    Raises ValueError when neither is given, so a bare request never
+    touches a whole table.
+    """
+    data = request.get_json(silent=True) or {}
+    ids = data.get("ids")
+    filters = model.parse_filters(request.args)
+    filters.pop("sort", None)
+    if ids is not None:
+        if filters:
+            raise ValueError("pass either ids or filters, not both")
+        if not isinstance(ids, list) or not all(isinstance(i, int) for i in ids):
+            raise ValueError("ids must be a list of integers")
+        return ids
+    if not filters:
+        raise ValueError("must include ids or at least one filter")
+    pk = model.__mapper__.primary_key[0]
+    query = model.filter_query(model.query, filters).with_entities(pk)
+    return [key for (key,) in query]
+
+
+@bp.route(f"/<{COLLECTIONS}:table>", methods=["DELETE"])
+@token_auth.login_required
+def delete_collection(table):
+    """
+    ---
+    delete:
+      summary: Delete many rows at once
+      description: >
+        Deletes the rows of a collection listed by primary key in `ids`, or
+        matching the collection's filters given as query arguments, together
+        with their dependent rows (organizations of a group, tactics of an
+        organization). Runs as a few set-based statements. Send
+        `Prefer: respond-async` to run it as a background job.
+      security:
+        - BasicAuth: []
+        - BearerAuth: []
+      parameters:
+        - in: path
+          name: table
+          schema:
+            type: string
+            enum: [groups, organizations, violent_tactics, nonviolent_tactics]
+          required: true
+          description: collection to delete from
+      requestBody:
+        required: false
+        content:
+          application/json:
+            schema:
+              type: object
+              properties:
+                ids:
+                  type: array
+                  items:
+                    type: integer
+      responses:
+        '200':
+          description: number of rows deleted per table
+        '202':
+          description: Delete queued as a background job
+        '400':
+          description: Missing or malformed ids or filters
+        '401':
+          description: Not authenticated
+      tags:
+        - Bulk
+    """
+    model, _ = TABLES[table]
+    try:
+        keys = selected_keys(model)
+    except ValueError as e:
+        return bad_request(str(e))
+    if wants_async():
+        params = {"table": table, "keys": keys}
+        return accepted(submit("delete", params, user=token_auth.current_user()))
+    counts = delete_rows(table, keys)
+    db.session.commit()
+    return jsonify({"deleted": counts})
+
+
+@bp.route(f"/<{COLLECTIONS}:table>", methods=["PATCH"])
+@token_auth.login_required
+def update_collection(table):
+    """
+    ---
+    patch:
+      summary: Update many rows at once
+      description: >
+        Applies partial updates to many rows. Either send a list of
+        `{"id": ..., "changes": {...}}` objects, naming each row by primary
+        key or by natural key (`facId` and `year` for tactics), or send one
+        `changes` object together with `ids` or with the collection's filters
+        as query arguments. Runs as executemany or set-based UPDATE statements
+        and returns only the number of rows matched.
+      security:
+        - BasicAuth: []
+        - BearerAuth: []
+      parameters:
+        - in: path
+          name: table
+          schema:
+            type: string
+            enum: [groups, organizations, violent_tactics, nonviolent_tactics]
+          required: true
+          description: collection to update
+      requestBody:
+        required: true
+        content:
+          application/json:
+            schema:
+              oneOf:
+                - type: array
+                  items:
+                    type: object
+                    properties:
+                      changes:
+                        type: object
+                - type: object
+                  properties:
+                    ids:
+                      type: array
+                      items:
+                        type: integer
+                    changes:
+                      type: object
+      responses:
+        '200':
+          description: number of rows matched
+        '400':
+          description: Malformed rows, ids, filters or changes
+        '401':
+          description: Not authenticated
+      tags:
+        - Bulk
+    """
+    model, _ = TABLES[table]
+    data = request.get_json(silent=True)
+    try:
+        if isinstance(data, list):
+            updated = update_each(table, data)
+        else:
+            changes = (data or {}).get("changes")
+            updated = update_rows(table, selected_keys(model), changes)
+    except ValueError as e:
+        db.session.rollback()
+        return bad_request(str(e))
+    db.session.commit()
+    return jsonify({"updated": updated})
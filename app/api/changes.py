@@ -0,0 +1,220 @@
+import base64
+import json
+from datetime import timedelta, timezone
+from dateutil import parser
+from flask import current_app, jsonify, request, url_for
+from sqlalchemy import and_, or_, func
+from app import db
+from app.api import bp
+from app.api.auth import token_auth
+from app.api.errors import bad_request
+from app.api_spec import (
+    GroupSchema,
+    NonviolentTacticsSchema,
+    OrganizationSchema,
+    ViolentTacticsSchema,
+)
+from app.models import (
+    FeedHold,
+    Groups,
+    NonviolentTactics,
+    Organizations,
+    Tombstone,
+    ViolentTactics,
+)
+
+
+# Change feed sources: table name -> (model, timestamp attribute, schema)
+SOURCES = {
+    "groups": (Groups, "modified_at", GroupSchema),
+    "organizations": (Organizations, "modified_at", OrganizationSchema),
+    "violence": (ViolentTactics, "modified_at", ViolentTacticsSchema),
+    "nonviolence": (NonviolentTactics, "modified_at", NonviolentTacticsSchema),
+    "tombstones": (Tombstone, "deleted_at", None),
+}
+
+
+def encode_cursor(positions):
+    raw = json.dumps(positions, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("utf-8").rstrip("=")
+
+
+def decode_cursor(since):
+    """
+    Translate ``since`` into per-source positions. ``since`` is either a
+    cursor returned by a previous call or a timestamp. A position is
+    ``[timestamp, key]``: everything up to and including that row has been
+    consumed, and a key of None means the timestamp itself is included.
+    """
+    if not since:
+        return {}
+    try:
+        padded = since + "=" * (-len(since) % 4)
+        positions = json.loads(base64.urlsafe_b64decode(padded.encode("utf-8")))
+        if isinstance(positions, dict) and set(positions) <= set(SOURCES):
+            return {
+                name: [parser.isoparse(ts), key]
+                for name, (ts, key) in positions.items()
+            }
+    except (ValueError, TypeError):
+        pass
+    timestamp = parser.parse(since)
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return {name: [timestamp, None] for name in SOURCES}
+
+
+def changed_since(name, position, tables, settled):
+    """Keyset query of a source's rows ordered by (timestamp, primary key)."""
+    model, timestamp, _ = SOURCES[name]
+    ts_col = getattr(model, timestamp)
+    key_col = model.__mapper__.primary_key[0]
+    query = model.query.filter(ts_col.isnot(None), ts_col <= settled)
+    if name == "tombstones":
+        query = query.filter(Tombstone.tableName.in_(tables))
+    if position:
+        ts, key = position
+        if key is None:
+            query = query.filter(ts_col >= ts)
+        else:
+            query = query.filter(or_(ts_col > ts, and_(ts_col == ts, key_col > key)))
+    return query.order_by(ts_col, key_col)
+
+
+@bp.route("/changes", methods=["GET"])
+@token_auth.login_required
+def get_changes():
+    """
+    ---
+    get:
+      summary: Get changes since a point in time
+      description: >
+        Incremental change feed across groups, organizations, violent and
+        non-violent tactics. Returns inserted and updated rows in full and
+        deleted rows as delete operations, ordered by modification time.
+        Pass the returned cursor as `since` on the next call to resume.
+        Changes are listed once they have settled, 30 seconds after they were
+        made by default, and not before a running bulk load or sync is done.
+      security:
+        - BasicAuth: []
+        - BearerAuth: []
+      parameters:
+        - in: query
+          name: since
+          schema:
+            type: string
+          required: false
+          description: ISO-8601 timestamp or a cursor from a previous response; omit for a full sync
+        - in: query
+          name: tables
+          schema:
+            type: string
+          required: false
+          description: Comma separated tables to include (groups, organizations, violence, nonviolence)
+        - in: query
+          name: limit
+          schema:
+            type: integer
+          required: false
+          description: Maximum number of changes to return (default 100, max 1000)
+      responses:
+        '200':
+          description: call successful
+        '400':
+          description: Malformed since or unknown table
+        '401':
+          description: Not authenticated
+      tags:
+        - Changes
+    """
+    limit = max(min(request.args.get("limit", 100, type=int), 1000), 1)
+    tables = request.args.get("tables")
+    data_tables = [name for name in SOURCES if name != "tombstones"]
+    if tables:
+        tables = tables.split(",")
+        unknown = sorted(set(tables) - set(data_tables))
+        if unknown:
+            return bad_request(
+                f"unknown tables {', '.join(unknown)}; "
+                f"tables are {', '.join(data_tables)}."
+            )
+    else:
+        tables = data_tables
+    try:
+        positions = decode_cursor(request.args.get("since"))
+    except (ValueError, OverflowError):
+        return bad_request("since must be an ISO-8601 timestamp or a change cursor.")
+
+    # Rows are stamped when they are written but only become visible when
+    # their transaction commits. Rows of the last CHANGE_FEED_SETTLE_SECONDS
+    # are held back for transactions up to that long (and for timestamps of
+    # one second resolution); longer writers hold the feed back while they
+    # run, unless they have run for over CHANGE_FEED_HOLD_SECONDS.
+    now = db.session.query(func.now()).scalar()
+    settled = now - timedelta(seconds=current_app.config["CHANGE_FEED_SETTLE_SECONDS"])
+    held = (
+        db.session.query(func.min(FeedHold.started_at))
+        .filter(
+            FeedHold.started_at
+            > now - timedelta(seconds=current_app.config["CHANGE_FEED_HOLD_SECONDS"])
+        )
+        .scalar()
+    )
+    if held is not None:
+        settled = min(settled, held - timedelta(seconds=1))
+
+    # Fetch up to `limit` rows per source and keep the oldest `limit` overall
+    candidates, truncated = [], False
+    for order, name in enumerate(tables + ["tombstones"]):
+        model, timestamp, _ = SOURCES[name]
+        query = changed_since(name, positions.get(name), tables, settled)
+        rows = query.limit(limit + 1).all()
+        truncated = truncated or len(rows) > limit
+        for row in rows[:limit]:
+            key = model.__mapper__.primary_key_from_instance(row)[0]
+            candidates.append((getattr(row, timestamp), order, key, name, row))
+    candidates.sort(key=lambda candidate: candidate[:3])
+    page = candidates[:limit]
+
+    schemas = {}
+    changes = []
+    for ts, _, key, name, row in page:
+        positions[name] = [ts, key]
+        if name == "tombstones":
+            changes.append(
+                {
+                    "table": row.tableName,
+                    "operation": "delete",
+                    "key": row.rowId,
+                    "modified_at": ts.isoformat(),
+                }
+            )
+            continue
+        if name not in schemas:
+            schemas[name] = SOURCES[name][2]()
+        changes.append(
+            {
+                "table": name,
+                "operation": "upsert",
+                "key": key,
+                "modified_at": ts.isoformat(),
+                "data": schemas[name].dump(row),
+            }
+        )
+
+    cursor = encode_cursor(
+        {name: [ts.isoformat(), key] for name, (ts, key) in positions.items()}
+    )
+    args = {"since": cursor, "limit": limit}
+    if request.args.get("tables"):
+        args["tables"] = ",".join(tables)
+    return jsonify(
+        {
+            "changes": changes,
+            "_meta": {
+                "cursor": cursor,
+                "has_more": truncated or len(candidates) > limit,
+            },
+            "_links": {"next": url_for("api.get_changes", **args)},
+        }
+    )
@@ -0,0 +1,52 @@
+import hashlib
+import json
+import os
+import threading
+from flask import current_app, request
+from app import metrics
+from app.api import bp
+from app.api_spec import create_spec
+
+_lock = threading.Lock()
+
+
+def build_openapi(app):
+    """Serialize the OpenAPI document of ``app``."""
+    with app.test_request_context():
+        return json.dumps(create_spec(app).to_dict()).encode("utf-8")
+
+
+def openapi_document(app):
+    """
+    The OpenAPI document as ``(bytes, etag)``, built once per app and cached.
+    Read from ``OPENAPI_JSON`` instead when that file was written at build
+    time with ``flask openapi``.
+    """
+    cached = app.extensions.get("openapi")
+    metrics.inc(
+        "cache_requests_total",
+        cache="openapi",
+        result="miss" if cached is None else "hit",
+    )
+    if cached is None:
+        with _lock:
+            cached = app.extensions.get("openapi")
+            if cached is None:
+                path = app.config["OPENAPI_JSON"]
+                if path and os.path.exists(path):
+                    with open(path, "rb") as f:
+                        body = f.read()
+                else:
+                    body = build_openapi(app)
+                cached = (body, hashlib.sha1(body).hexdigest())
+                app.extensions["openapi"] = cached
+    return cached
+
+
+@bp.route("/swagger.json", methods=["GET"])
+def swagger_json():
+    body, etag = openapi_document(current_app._get_current_object())
+    response = current_app.response_class(body, mimetype="application/json")
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
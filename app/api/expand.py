@@ -0,0 +1,90 @@
+from flask import request
+from sqlalchemy.orm import selectinload
+from app.api_spec import (
+    GroupSchema,
+    NonviolentTacticsSchema,
+    OrganizationSchema,
+    ViolentTacticsSchema,
+)
+from app.models import Groups, NonviolentTactics, Organizations, ViolentTactics
+
+
+# Expandable relationships per model: expand name -> (relationship attribute, schema)
+EXPANSIONS = {
+    Groups: {
+        "organizations": ("organizations", OrganizationSchema),
+    },
+    Organizations: {
+        "group": ("Group", GroupSchema),
+        "violentTactics": ("violentTactics", ViolentTacticsSchema),
+        "nonviolentTactics": ("nonviolentTactics", NonviolentTacticsSchema),
+    },
+    ViolentTactics: {},
+    NonviolentTactics: {},
+}
+
+
+def parse_expand(allowed):
+    """
+    Parse the comma separated ``expand`` query argument.
+
+    Returns the set of requested paths, including implied parents (e.g.
+    ``organizations.violentTactics`` implies ``organizations``). Raises
+    ValueError if a path is not in ``allowed``.
+    """
+    raw = request.args.get("expand", "")
+    paths = {path.strip() for path in raw.split(",") if path.strip()}
+    unknown = sorted(paths - set(allowed))
+    if unknown:
+        raise ValueError(
+            f"cannot expand {', '.join(unknown)}; "
+            f"expandable fields are {', '.join(allowed)}."
+        )
+    for path in list(paths):
+        parts = path.split(".")
+        for i in range(1, len(parts)):
+            paths.add(".".join(parts[:i]))
+    return paths
+
+
+def expand_options(model, paths):
+    """
+    Build loader options that fetch every expanded level with one
+    ``selectinload`` query, so the cost of an expansion is a fixed number of
+    queries regardless of how many children are returned.
+    """
+    options = []
+    for path in paths:
+        cls = model
+        option = None
+        for name in path.split("."):
+            attr = getattr(cls, EXPANSIONS[cls][name][0])
+            option = selectinload(attr) if option is None else option.selectinload(attr)
+            cls = attr.property.mapper.class_
+        # Parents are already in the identity map; skip the joined backref loads
+        options.append(option.lazyload("*"))
+    return options
+
+
+def dump_expanded(obj, schema, paths):
+    """Serialize ``obj`` with ``schema`` and nest the expanded relationships."""
+    data = schema().dump(obj)
+    children = {}
+    for path in paths:
+        head, _, rest = path.partition(".")
+        children.setdefault(head, set())
+        if rest:
+            children[head].add(rest)
+    for name, sub_paths in children.items():
+        attr, child_schema = EXPANSIONS[type(obj)][name]
+        value = getattr(obj, attr)
+        if value is None:
+            data[name] = None
+        elif isinstance(value, list):
+            if sub_paths:
+                data[name] = [dump_expanded(v, child_schema, sub_paths) for v in value]
+            else:
+                data[name] = child_schema(many=True).dump(value)
+        else:
+            data[name] = dump_expanded(value, child_schema, sub_paths)
+    return data
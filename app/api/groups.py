@@ -3,10 +3,22 @@ from app import db
 from app.api import bp
 from app.api.auth import token_auth
 from app.api.errors import bad_request
+from app.api.idempotency import idempotent
+from app.api.jobs import accepted, wants_async
+from app.api.expand import dump_expanded, expand_options, parse_expand
+from app.dataset import delete_rows
+from app.jobs import submit
 from app.api_spec import GroupSchema, OrganizationSchema
 from app.models import Groups, Organizations, Organizations
 
 
+GROUP_EXPANSIONS = (
+    "organizations",
+    "organizations.violentTactics",
+    "organizations.nonviolentTactics",
+)
+
+
 @bp.route("/groups", methods=["GET"])
 @token_auth.login_required
 def get_groups():
@@ -18,12 +30,31 @@ def get_groups():
       security:
         - BasicAuth: []
         - BearerAuth: []
+      parameters:
+        - in: query
+          name: sort
+          schema:
+            type: string
+          required: false
+          description: Comma separated fields to sort by (kgcId, groupName, country); prefix with - for descending
+        - in: query
+          name: filters
+          schema:
+            type: object
+            additionalProperties:
+              type: string
+          style: form
+          explode: true
+          required: false
+          description: Filters on indexed fields (kgcId and country)
       responses:
         '200':
           description: call successful
           content:
             application/json:
               schema: GroupSchema
+        '400':
+          description: Unknown filter or sort field
         '401':
           description: Not authenticated
       tags:
@@ -31,8 +62,17 @@ def get_groups():
     """
     page = request.args.get("page", 1, type=int)
     per_page = min(request.args.get("per_page", 10, type=int), 100)
+    try:
+        filters = Groups.parse_filters(request.args)
+    except ValueError as e:
+        return bad_request(str(e))
     data = Groups.to_collection_dict(
-        Groups.query, page, per_page, GroupSchema, "api.get_groups"
+        Groups.filter_query(Groups.query, filters),
+        page,
+        per_page,
+        GroupSchema,
+        "api.get_groups",
+        **filters,
     )
     return jsonify(data)
 
@@ -55,19 +95,37 @@ def get_group(kgcId):
             type: integer
           required: true
           description: Numeric kgcId of the group to retrieve
+        - in: query
+          name: expand
+          schema:
+            type: string
+          required: false
+          description: >
+            Comma separated relationships to nest in the response; any of
+            organizations, organizations.violentTactics, organizations.nonviolentTactics
       responses:
         '200':
           description: call successful
           content:
             application/json:
               schema: GroupSchema
+        '400':
+          description: Unknown expand field
         '401':
           description: Not authenticated
       tags:
         - Groups
     """
-    group = Groups.query.filter_by(kgcId=kgcId).first_or_404()
-    return GroupSchema().dump(group)
+    try:
+        paths = parse_expand(GROUP_EXPANSIONS)
+    except ValueError as e:
+        return bad_request(str(e))
+    group = (
+        Groups.query.options(*expand_options(Groups, paths))
+        .filter_by(kgcId=kgcId)
+        .first_or_404()
+    )
+    return dump_expanded(group, GroupSchema, paths)
 
 
 @bp.route("/groups/<int:kgcId>/organizations", methods=["GET"])
@@ -115,6 +173,7 @@ def get_group_organizations(kgcId):
 
 @bp.route("/groups", methods=["POST"])
 @token_auth.login_required
+@idempotent
 def create_groups():
     """
     ---
@@ -124,6 +183,13 @@ def create_groups():
       security:
         - BasicAuth: []
         - BearerAuth: []
+      parameters:
+        - in: header
+          name: Idempotency-Key
+          schema:
+            type: string
+          required: false
+          description: Unique key that makes retries of this request safe
       requestBody:
         required: true
         content:
@@ -137,6 +203,10 @@ def create_groups():
               schema: GroupSchema
         '401':
           description: Not authenticated
+        '409':
+          description: Request with the same Idempotency-Key in progress
+        '422':
+          description: Idempotency-Key reused with a different request
       tags:
         - Groups
     """
@@ -237,7 +307,7 @@ def delete_group(kgcId):
     ---
     delete:
       summary: Delete a group
-      description: delete group by authorized user
+      description: delete a group with its organizations and their tactics
       security:
         - BasicAuth: []
         - BearerAuth: []
@@ -249,6 +319,8 @@ def delete_group(kgcId):
           required: true
           description: kgcId of the group to be deleted
       responses:
+        '202':
+          description: Delete queued as a background job (send Prefer respond-async)
         '401':
           description: Not authenticated
         '204':
@@ -256,7 +328,14 @@ def delete_group(kgcId):
       tags:
         - Groups
     """
-    group = Groups.query.filter_by(kgcId=kgcId).first_or_404()
-    db.session.delete(group)
+    Groups.query.filter_by(kgcId=kgcId).first_or_404()
+    if wants_async():
+        job = submit(
+            "delete",
+            {"table": "groups", "keys": [kgcId]},
+            user=token_auth.current_user(),
+        )
+        return accepted(job)
+    delete_rows("groups", [kgcId])
     db.session.commit()
     return "", 204
@@ -0,0 +1,134 @@
+from datetime import datetime, timedelta
+from functools import wraps
+from hashlib import sha256
+from flask import current_app, request
+from sqlalchemy.exc import IntegrityError
+from app import db, metrics
+from app.api.auth import token_auth
+from app.api.errors import bad_request, error_response
+from app.models import IdempotencyKey
+
+
+def fingerprint():
+    """Digest identifying the request a key was first used with."""
+    digest = sha256(f"{request.method} {request.path}\n".encode("utf-8"))
+    digest.update(request.get_data())
+    return digest.hexdigest()
+
+
+def replay(record):
+    response = current_app.response_class(
+        record.body, status=record.status, mimetype="application/json"
+    )
+    if record.location:
+        response.headers["Location"] = record.location
+    response.headers["Idempotent-Replayed"] = "true"
+    return response
+
+
+def reserve(scope, key):
+    """
+    Claim ``key`` for the current request. Returns the new reservation, or
+    None together with the response to send instead: the stored response of
+    a completed request, or an error for a key in use or reused.
+    """
+    ttl = timedelta(seconds=current_app.config["IDEMPOTENCY_KEY_TTL"])
+    IdempotencyKey.query.filter(
+        IdempotencyKey.created_at < datetime.utcnow() - ttl
+    ).delete(synchronize_session=False)
+    digest = fingerprint()
+    record = IdempotencyKey.query.filter_by(scope=scope, key=key).first()
+    metrics.inc(
+        "cache_requests_total",
+        cache="idempotency",
+        result="miss" if record is None else "hit",
+    )
+    if record is None:
+        record = IdempotencyKey(scope=scope, key=key, fingerprint=digest)
+        try:
+            # In a savepoint, so losing the race leaves the rest of an atomic
+            # batch's transaction alone
+            with db.session.begin_nested():
+                db.session.add(record)
+            db.session.commit()
+            return record, None
+        except IntegrityError:
+            # A concurrent request claimed the key first
+            record = IdempotencyKey.query.filter_by(scope=scope, key=key).first()
+    if record.fingerprint != digest:
+        return None, error_response(
+            422, "Idempotency-Key was already used with a different request."
+        )
+    if record.status is None and record.created_at < datetime.utcnow() - timedelta(
+        seconds=current_app.config["IDEMPOTENCY_INFLIGHT_TIMEOUT"]
+    ):
+        # The request holding the key died without releasing it; take over
+        # unless another retry just did
+        taken = IdempotencyKey.query.filter_by(
+            id=record.id, status=None, created_at=record.created_at
+        ).update({"created_at": datetime.utcnow()}, synchronize_session=False)
+        db.session.commit()
+        if taken:
+            return record, None
+    if record.status is None:
+        response = error_response(
+            409, "A request with this Idempotency-Key is still in progress."
+        )
+        response.headers["Retry-After"] = "1"
+        return None, response
+    return None, replay(record)
+
+
+def in_atomic_batch():
+    # The batch owns the transaction and rolls all of it back on any failure
+    return db.session.info.get("deferred_commit", False)
+
+
+def release(record):
+    """Drop a reservation so the request can be retried."""
+    if in_atomic_batch():
+        return
+    db.session.rollback()
+    IdempotencyKey.query.filter_by(id=record.id).delete()
+    db.session.commit()
+
+
+def idempotent(view):
+    """
+    Make a create endpoint safe to retry. A request carrying an
+    ``Idempotency-Key`` header runs once; repeating it with the same key
+    returns the stored response instead of creating the rows again. Server
+    errors are not stored, so those requests can be retried.
+    """
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get("Idempotency-Key")
+        if key is None:
+            return view(*args, **kwargs)
+        if not key or len(key) > 255:
+            return bad_request("Idempotency-Key must be 1 to 255 characters long.")
+        user = token_auth.current_user()
+        scope = f"user:{user.id}" if user else "anonymous"
+        record, response = reserve(scope, key)
+        if response is not None:
+            return response
+
+        try:
+            response = current_app.make_response(view(*args, **kwargs))
+        except Exception:
+            release(record)
+            raise
+        if response.status_code >= 500:
+            release(record)
+            return response
+        if response.status_code >= 400 and not in_atomic_batch():
+            # Leave nothing the view staged before rejecting the request
+            db.session.rollback()
+        record.status = response.status_code
+        record.body = response.get_data(as_text=True)
+        record.location = response.headers.get("Location")
+        db.session.commit()
+        return response
+
+    return wrapper
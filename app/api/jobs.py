@@ -0,0 +1,269 @@
+import json
+import uuid
+from flask import abort, jsonify, request, send_file, url_for
+from app import db
+from app.api import bp
+from app.api.auth import token_auth
+from app.api.errors import bad_request, error_response
+from app.api_spec import JobSchema
+from app.dataset import TABLES
+from app.jobs import cancel, job_path, submit
+from app.models import Job
+
+
+def wants_async():
+    """Whether the client asked for a 202 with ``Prefer: respond-async``."""
+    return "respond-async" in request.headers.get("Prefer", "")
+
+
+def accepted(job):
+    response = jsonify(JobSchema().dump(job))
+    response.status_code = 202
+    response.headers["Location"] = url_for("api.get_job", id=job.id)
+    return response
+
+
+def job_params(kind, params):
+    """Validate the params of a job submitted through the API."""
+    if kind == "export":
+        if params.get("table") not in TABLES:
+            raise ValueError(f"table must be one of {', '.join(TABLES)}")
+        return {
+            "table": params["table"],
+            "path": job_path(f"export-{uuid.uuid4().hex}.csv"),
+        }
+    if kind == "delete":
+        keys = params.get("keys")
+        if (
+            params.get("table") not in TABLES
+            or not isinstance(keys, list)
+            or not all(isinstance(key, int) for key in keys)
+        ):
+            raise ValueError(
+                f"delete needs a table ({', '.join(TABLES)}) and a list of "
+                "integer keys"
+            )
+        return {"table": params["table"], "keys": keys}
+    raise ValueError("kind must be export or delete")
+
+
+def get_own_job(id):
+    job = Job.query.get_or_404(id)
+    user = token_auth.current_user()
+    if job.userId != user.id and not user.is_admin:
+        abort(403)
+    return job
+
+
+def dump_job(job):
+    data = JobSchema().dump(job)
+    if job.kind == "export" and job.status == "succeeded":
+        data["_links"]["download"] = url_for("api.download_job", id=job.id)
+    return data
+
+
+@bp.route("/jobs", methods=["GET"])
+@token_auth.login_required
+def get_jobs():
+    """
+    ---
+    get:
+      summary: Get background jobs
+      description: Jobs submitted by the user, newest first; admins see all jobs
+      security:
+        - BasicAuth: []
+        - BearerAuth: []
+      parameters:
+        - in: query
+          name: page
+          schema:
+            type: integer
+          required: false
+          description: Page number
+        - in: query
+          name: per_page
+          schema:
+            type: integer
+          required: false
+          description: Number of jobs per page (max 100)
+      responses:
+        '200':
+          description: call successful
+          content:
+            application/json:
+              schema: JobSchema
+        '401':
+          description: Not authenticated
+      tags:
+        - Job
+    """
+    page = request.args.get("page", 1, type=int)
+    per_page = min(request.args.get("per_page", 10, type=int), 100)
+    user = token_auth.current_user()
+    jobs = Job.query.order_by(Job.id.desc())
+    if not user.is_admin:
+        jobs = jobs.filter_by(userId=user.id)
+    data = Job.to_collection_dict(jobs, page, per_page, JobSchema, "api.get_jobs")
+    return jsonify(data)
+
+
+@bp.route("/jobs", methods=["POST"])
+@token_auth.login_required
+def create_job():
+    """
+    ---
+    post:
+      summary: Submit a background job
+      description: >
+        Queues an export of a table to csv, or the delete of rows by primary
+        key with all of their dependent rows, and returns 202 straight away.
+        Poll the job's Location for its status and progress.
+      security:
+        - BasicAuth: []
+        - BearerAuth: []
+      requestBody:
+        required: true
+        content:
+          application/json:
+            schema:
+              type: object
+              properties:
+                kind:
+                  type: string
+                  enum: [export, delete]
+                params:
+                  type: object
+      responses:
+        '202':
+          description: job queued
+          content:
+            application/json:
+              schema: JobSchema
+        '400':
+          description: Unknown kind or invalid params
+        '401':
+          description: Not authenticated
+      tags:
+        - Job
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        params = job_params(data.get("kind"), data.get("params") or {})
+    except ValueError as e:
+        return bad_request(str(e))
+    job = submit(data["kind"], params, user=token_auth.current_user())
+    return accepted(job)
+
+
+@bp.route("/jobs/<int:id>", methods=["GET"])
+@token_auth.login_required
+def get_job(id):
+    """
+    ---
+    get:
+      summary: Get a background job
+      description: status, progress and, once finished, the result or error of a job
+      security:
+        - BasicAuth: []
+        - BearerAuth: []
+      parameters:
+        - in: path
+          name: id
+          schema:
+            type: integer
+          required: true
+          description: job id
+      responses:
+        '200':
+          description: call successful
+          content:
+            application/json:
+              schema: JobSchema
+        '401':
+          description: Not authenticated
+        '403':
+          description: Job belongs to another user
+        '404':
+          description: Job not found
+      tags:
+        - Job
+    """
+    return jsonify(dump_job(get_own_job(id)))
+
+
+@bp.route("/jobs/<int:id>", methods=["DELETE"])
+@token_auth.login_required
+def cancel_job(id):
+    """
+    ---
+    delete:
+      summary: Cancel a background job
+      description: cancel a job that has not started yet
+      security:
+        - BasicAuth: []
+        - BearerAuth: []
+      parameters:
+        - in: path
+          name: id
+          schema:
+            type: integer
+          required: true
+          description: job id
+      responses:
+        '200':
+          description: job cancelled
+        '401':
+          description: Not authenticated
+        '409':
+          description: Job already started
+      tags:
+        - Job
+    """
+    job = get_own_job(id)
+    if not cancel(job):
+        return error_response(409, f"job {id} has already started.")
+    db.session.refresh(job)
+    return jsonify(dump_job(job))
+
+
+@bp.route("/jobs/<int:id>/download", methods=["GET"])
+@token_auth.login_required
+def download_job(id):
+    """
+    ---
+    get:
+      summary: Download the csv written by an export job
+      security:
+        - BasicAuth: []
+        - BearerAuth: []
+      parameters:
+        - in: path
+          name: id
+          schema:
+            type: integer
+          required: true
+          description: job id
+      responses:
+        '200':
+          description: call successful
+          content:
+            text/csv:
+              schema:
+                type: string
+        '401':
+          description: Not authenticated
+        '404':
+          description: No export is available for this job, or it has expired
+      tags:
+        - Job
+    """
+    job = get_own_job(id)
+    if job.kind != "export" or job.status != "succeeded":
+        abort(404)
+    params = json.loads(job.params)
+    return send_file(
+        params["path"],
+        mimetype="text/csv",
+        as_attachment=True,
+        download_name=f"{params['table']}-{job.id}.csv",
+    )
@@ -4,6 +4,11 @@ from app.api import bp
 from app.api.groups import get_group
 from app.api.auth import token_auth
 from app.api.errors import bad_request
+from app.api.idempotency import idempotent
+from app.api.jobs import accepted, wants_async
+from app.api.expand import dump_expanded, expand_options, parse_expand
+from app.dataset import delete_rows
+from app.jobs import submit
 from app.api_spec import (
     NonviolentTacticsSchema,
     OrganizationSchema,
@@ -12,6 +17,9 @@ from app.api_spec import (
 from app.models import NonviolentTactics, Organizations, ViolentTactics
 
 
+ORGANIZATION_EXPANSIONS = ("group", "violentTactics", "nonviolentTactics")
+
+
 @bp.route("/organizations", methods=["GET"])
 @token_auth.login_required
 def get_organizations():
@@ -23,12 +31,31 @@ def get_organizations():
       security:
         - BasicAuth: []
         - BearerAuth: []
+      parameters:
+        - in: query
+          name: sort
+          schema:
+            type: string
+          required: false
+          description: Comma separated fields to sort by (facId, kgcId); prefix with - for descending
+        - in: query
+          name: filters
+          schema:
+            type: object
+            additionalProperties:
+              type: string
+          style: form
+          explode: true
+          required: false
+          description: Filters on indexed fields (facId, kgcId and country)
       responses:
         '200':
           description: call successful
           content:
             application/json:
               schema: OrganizationSchema
+        '400':
+          description: Unknown filter or sort field
         '401':
           description: Not authenticated
       tags:
@@ -36,8 +63,17 @@ def get_organizations():
     """
     page = request.args.get("page", 1, type=int)
     per_page = min(request.args.get("per_page", 10, type=int), 100)
+    try:
+        filters = Organizations.parse_filters(request.args)
+    except ValueError as e:
+        return bad_request(str(e))
     data = Organizations.to_collection_dict(
-        Organizations.query, page, per_page, OrganizationSchema, "api.get_organizations"
+        Organizations.filter_query(Organizations.query, filters),
+        page,
+        per_page,
+        OrganizationSchema,
+        "api.get_organizations",
+        **filters,
     )
     return jsonify(data)
 
@@ -60,19 +96,37 @@ def get_organization(facId):
             type: integer
           required: true
           description: Numeric facId of the organization to retrieve
+        - in: query
+          name: expand
+          schema:
+            type: string
+          required: false
+          description: >
+            Comma separated relationships to nest in the response; any of
+            group, violentTactics, nonviolentTactics
       responses:
         '200':
           description: call successful
           content:
             application/json:
               schema: OrganizationSchema
+        '400':
+          description: Unknown expand field
         '401':
           description: Not authenticated
       tags:
         - Organizations
     """
-    organization = Organizations.query.filter_by(facId=facId).first_or_404()
-    return OrganizationSchema().dump(organization)
+    try:
+        paths = parse_expand(ORGANIZATION_EXPANSIONS)
+    except ValueError as e:
+        return bad_request(str(e))
+    organization = (
+        Organizations.query.options(*expand_options(Organizations, paths))
+        .filter_by(facId=facId)
+        .first_or_404()
+    )
+    return dump_expanded(organization, OrganizationSchema, paths)
 
 
 @bp.route("/organizations/<int:facId>/group", methods=["GET"])
@@ -182,6 +236,7 @@ def get_org_violent_tactics(facId):
 
 @bp.route("/organizations", methods=["POST"])
 @token_auth.login_required
+@idempotent
 def create_orgs():
     """
     ---
@@ -191,6 +246,13 @@ def create_orgs():
       security:
         - BasicAuth: []
         - BearerAuth: []
+      parameters:
+        - in: header
+          name: Idempotency-Key
+          schema:
+            type: string
+          required: false
+          description: Unique key that makes retries of this request safe
       requestBody:
         required: true
         content:
@@ -204,6 +266,10 @@ def create_orgs():
               schema: OrganizationSchema
         '401':
           description: Not authenticated
+        '409':
+          description: Request with the same Idempotency-Key in progress
+        '422':
+          description: Idempotency-Key reused with a different request
       tags:
         - Organizations
     """
@@ -304,7 +370,7 @@ def delete_org(facId):
     ---
     delete:
       summary: Delete an organization
-      description: delete organization by authorized user
+      description: delete an organization with its violent and non-violent tactics
       security:
         - BasicAuth: []
         - BearerAuth: []
@@ -316,6 +382,8 @@ def delete_org(facId):
           required: true
           description: facId of the organization to be deleted
       responses:
+        '202':
+          description: Delete queued as a background job (send Prefer respond-async)
         '401':
           description: Not authenticated
         '204':
@@ -323,7 +391,14 @@ def delete_org(facId):
       tags:
         - Organizations
     """
-    organization = Organizations.query.filter_by(facId=facId).first_or_404()
-    db.session.delete(organization)
+    Organizations.query.filter_by(facId=facId).first_or_404()
+    if wants_async():
+        job = submit(
+            "delete",
+            {"table": "organizations", "keys": [facId]},
+            user=token_auth.current_user(),
+        )
+        return accepted(job)
+    delete_rows("organizations", [facId])
     db.session.commit()
     return "", 204
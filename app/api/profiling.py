@@ -0,0 +1,104 @@
+"""
+On-demand profiling of API requests.
+
+An admin can add ``_profile=1`` to the query string of any ``/api`` request
+to get a cProfile report of it, followed by the SQL statements it ran with
+their parameters and timings, in place of the normal body. Other callers'
+``_profile`` is ignored; requests without it only pay for the query string
+lookup.
+"""
+import cProfile
+import io
+import pstats
+import time
+from flask import g, has_app_context, make_response, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from app.api import bp
+from app.api.auth import basic_auth, token_auth
+
+# Functions listed in the report, by cumulative time
+PROFILE_LINES = 60
+
+# Requests being profiled in this process; the statement listener does
+# nothing while there are none
+_profiling = [0]
+
+
+def profiling_user():
+    for auth in (token_auth, basic_auth):
+        credentials = auth.get_auth()
+        if credentials is not None:
+            return auth.authenticate(credentials, None)
+    return None
+
+
+@bp.before_request
+def start_profile():
+    if "_profile" not in request.args or g.get("batch"):
+        return
+    user = profiling_user()
+    if not user or not user.is_admin:
+        return
+    g.profile_statements = []
+    g.profile = cProfile.Profile()
+    g.profile_start = time.perf_counter()
+    _profiling[0] += 1
+    g.profile.enable()
+
+
+@bp.after_request
+def profile_report(response):
+    profile = g.pop("profile", None)
+    if profile is None:
+        return response
+    profile.disable()
+    _profiling[0] -= 1
+    elapsed = time.perf_counter() - g.pop("profile_start")
+    statements = g.pop("profile_statements")
+    report = io.StringIO()
+    report.write(
+        f"{request.method} {request.full_path} -> {response.status}"
+        f" in {elapsed * 1000:.1f} ms\n\n"
+    )
+    pstats.Stats(profile, stream=report).sort_stats("cumulative").print_stats(
+        PROFILE_LINES
+    )
+    report.write(
+        f"{len(statements)} SQL statements in"
+        f" {sum(seconds for _, _, seconds in statements) * 1000:.1f} ms\n\n"
+    )
+    for statement, parameters, seconds in statements:
+        report.write(f"{seconds * 1000:.2f} ms  {statement}\n  {parameters!r}\n\n")
+    profiled = make_response(report.getvalue(), 200)
+    profiled.mimetype = "text/plain"
+    return profiled
+
+
+@bp.teardown_request
+def end_profile(exc):
+    # The request failed before its report was made
+    profile = g.pop("profile", None)
+    if profile is not None:
+        profile.disable()
+        _profiling[0] -= 1
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def start_profiled_statement(conn, cursor, statement, parameters, context, executemany):
+    if _profiling[0]:
+        conn.info["profile_start"] = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def end_profiled_statement(conn, cursor, statement, parameters, context, executemany):
+    if _profiling[0] and "profile_start" in conn.info and has_app_context():
+        statements = g.get("profile_statements")
+        if statements is not None:
+            statements.append(
+                (
+                    statement,
+                    parameters,
+                    time.perf_counter() - conn.info.pop("profile_start"),
+                )
+            )
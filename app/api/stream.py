@@ -0,0 +1,73 @@
+import json
+from flask import Response, current_app, request, stream_with_context
+from app.api import bp
+from app.api.auth import token_auth
+from app.events import follow
+
+
+@bp.route("/events", methods=["GET"])
+@token_auth.login_required
+def stream_events():
+    """
+    ---
+    get:
+      summary: Stream data change events
+      description: >
+        Server-Sent Events stream with one `change` event per created, updated
+        or deleted group, organization or tactic. Each event carries the table,
+        key, operation and a monotonically increasing generation, which is also
+        the SSE event id. The stream closes after a short interval and clients
+        reconnect with the Last-Event-ID header to resume. If events since
+        then are no longer kept, a `reset` event is sent in their place and
+        the client should resync from the change feed. Streams are limited
+        per host; when all are in use the request gets 503 with Retry-After.
+      security:
+        - BasicAuth: []
+        - BearerAuth: []
+      parameters:
+        - in: header
+          name: Last-Event-ID
+          schema:
+            type: integer
+          required: false
+          description: Resume after this generation; omit to receive only new events
+      responses:
+        '200':
+          description: event stream
+          content:
+            text/event-stream:
+              schema:
+                type: string
+        '401':
+          description: Not authenticated
+        '503':
+          description: Too many open streams
+      tags:
+        - Events
+    """
+    last_generation = request.headers.get("Last-Event-ID", type=int)
+    if last_generation is None:
+        last_generation = request.args.get("lastEventId", type=int)
+    config = current_app.config
+    events = follow(
+        config["EVENTS_LOG"],
+        last_generation=last_generation,
+        timeout=config["EVENTS_STREAM_TIMEOUT"],
+        poll_interval=config["EVENTS_POLL_INTERVAL"],
+    )
+
+    def generate():
+        yield f"retry: {int(config['EVENTS_POLL_INTERVAL'] * 1000)}\n\n"
+        for event in events:
+            if event is None:
+                yield ": keep-alive\n\n"
+                continue
+            kind = "reset" if event["op"] == "reset" else "change"
+            data = json.dumps(event, separators=(",", ":"))
+            yield f"id: {event['gen']}\nevent: {kind}\ndata: {data}\n\n"
+
+    response = Response(stream_with_context(generate()), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    # Stop nginx from buffering the stream
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
@@ -0,0 +1,90 @@
+import io
+import uuid
+from flask import abort, jsonify, request
+from app.api import bp
+from app.api.auth import token_auth
+from app.api.errors import bad_request
+from app.api.jobs import accepted, wants_async
+from app.dataset import TABLES, csv_chunks, json_chunks, sync_rows
+from app.jobs import job_path, submit
+
+
+def snapshot_chunks():
+    """Read the snapshot from a csv body or a json list of rows."""
+    if request.mimetype == "text/csv":
+        return csv_chunks(io.StringIO(request.get_data(as_text=True)))
+    return json_chunks(request.get_json(silent=True))
+
+
+@bp.route("/sync/<table>", methods=["POST"])
+@token_auth.login_required
+def sync_table(table):
+    """
+    ---
+    post:
+      summary: Sync a table with a full dataset release
+      description: >
+        Compares a complete snapshot of a table with the stored rows by natural
+        key and applies only the inserts, updates and deletes needed, in one
+        transaction. Unchanged rows are not rewritten. Returns a change report.
+        Admin only. Send `Prefer: respond-async` to run the sync as a background
+        job; the response is then 202 with the job to poll.
+      security:
+        - BasicAuth: []
+        - BearerAuth: []
+      parameters:
+        - in: path
+          name: table
+          schema:
+            type: string
+            enum: [groups, organizations, violent_tactics, nonviolent_tactics]
+          required: true
+          description: table to sync
+        - in: query
+          name: dry_run
+          schema:
+            type: boolean
+          required: false
+          description: Report the changes without applying them
+      requestBody:
+        required: true
+        content:
+          text/csv:
+            schema:
+              type: string
+          application/json:
+            schema:
+              type: array
+              items:
+                type: object
+      responses:
+        '200':
+          description: call successful
+        '202':
+          description: sync queued as a background job
+        '400':
+          description: Invalid snapshot
+        '401':
+          description: Not authenticated
+        '403':
+          description: Not an admin
+      tags:
+        - Sync
+    """
+    if not token_auth.current_user().is_admin:
+        abort(403)
+    if table not in TABLES:
+        abort(404)
+    dry_run = request.args.get("dry_run", "").lower() in ("1", "true", "yes")
+    if wants_async():
+        format = "csv" if request.mimetype == "text/csv" else "json"
+        path = job_path(f"sync-{uuid.uuid4().hex}.{format}")
+        with open(path, "wb") as f:
+            f.write(request.get_data())
+        params = {"table": table, "path": path, "format": format, "dry_run": dry_run}
+        return accepted(submit("sync", params, user=token_auth.current_user()))
+    try:
+        report = sync_rows(table, snapshot_chunks(), dry_run=dry_run)
+    except ValueError as e:
+        return bad_request(str(e))
+    return jsonify(report)
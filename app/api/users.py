@@ -4,6 +4,7 @@ from app.models import User
 from app.api import bp
 from app.api.auth import token_auth
 from app.api.errors import bad_request
+from app.api.idempotency import idempotent
 from app.api_spec import UserSchema
 
 
@@ -75,6 +76,7 @@ def get_users():
 
 
 @bp.route("/users", methods=["POST"])
+@idempotent
 def create_user():
     """
     ---
@@ -84,6 +86,13 @@ def create_user():
       security:
         - BasicAuth: []
         - BearerAuth: []
+      parameters:
+        - in: header
+          name: Idempotency-Key
+          schema:
+            type: string
+          required: false
+          description: Unique key that makes retries of this request safe
       requestBody:
         required: true
         content:
@@ -97,6 +106,10 @@ def create_user():
               schema: UserSchema
         '401':
           description: Not authenticated
+        '409':
+          description: Request with the same Idempotency-Key in progress
+        '422':
+          description: Idempotency-Key reused with a different request
       tags:
         - User
     """
@@ -3,6 +3,7 @@ from app import db
 from app.api import bp
 from app.api.auth import token_auth
 from app.api.errors import bad_request
+from app.api.idempotency import idempotent
 from app.api_spec import ViolentTacticsSchema
 from app.models import ViolentTactics
 
@@ -56,12 +57,31 @@ def get_violent_tactics():
       security:
         - BasicAuth: []
         - BearerAuth: []
+      parameters:
+        - in: query
+          name: sort
+          schema:
+            type: string
+          required: false
+          description: Comma separated fields to sort by (id, facId, year); prefix with - for descending
+        - in: query
+          name: filters
+          schema:
+            type: object
+            additionalProperties:
+              type: string
+          style: form
+          explode: true
+          required: false
+          description: Filters on indexed fields (facId, kgcId, year, year_gte, year_lte and <counter>_gt)
       responses:
         '200':
           description: call successful
           content:
             application/json:
               schema: ViolentTacticsSchema
+        '400':
+          description: Unknown filter or sort field
         '401':
           description: Not authenticated
       tags:
@@ -69,18 +89,24 @@ def get_violent_tactics():
     """
     page = request.args.get("page", 1, type=int)
     per_page = min(request.args.get("per_page", 10, type=int), 100)
+    try:
+        filters = ViolentTactics.parse_filters(request.args)
+    except ValueError as e:
+        return bad_request(str(e))
     data = ViolentTactics.to_collection_dict(
-        ViolentTactics.query,
+        ViolentTactics.filter_query(ViolentTactics.query, filters),
         page,
         per_page,
         ViolentTacticsSchema,
         "api.get_violent_tactics",
+        **filters,
     )
     return jsonify(data)
 
 
 @bp.route("/violent_tactics", methods=["POST"])
 @token_auth.login_required
+@idempotent
 def create_violent_tactics():
     """
     ---
@@ -90,6 +116,13 @@ def create_violent_tactics():
       security:
         - BasicAuth: []
         - BearerAuth: []
+      parameters:
+        - in: header
+          name: Idempotency-Key
+          schema:
+            type: string
+          required: false
+          description: Unique key that makes retries of this request safe
       requestBody:
         required: true
         content:
@@ -103,6 +136,10 @@ def create_violent_tactics():
               schema: ViolentTactics
         '401':
           description: Not authenticated
+        '409':
+          description: Request with the same Idempotency-Key in progress
+        '422':
+          description: Idempotency-Key reused with a different request
       tags:
         - ViolentTactics
     """
@@ -1,14 +1,17 @@
 """OpenAPI v3 Specification"""
 
+import json
 from apispec import APISpec
 from apispec.ext.marshmallow import MarshmallowPlugin
 from apispec_webframeworks.flask import FlaskPlugin
-from marshmallow import Schema, fields, pre_dump
+from marshmallow import Schema, ValidationError, fields, pre_dump, validates_schema
 from flask import url_for
 from config import Config
 from app import ma
+from app.timing import TimedDump
 from app.models import (
     Groups,
+    Job,
     User,
     ViolentTactics,
     NonviolentTactics,
@@ -17,14 +20,16 @@ from app.models import (
 )
 
 
-# Create an APISpec
-spec = APISpec(
-    title=Config.COVER_NAME,
-    version="0.1.0",
-    openapi_version="3.0.3",
-    plugins=[FlaskPlugin(), MarshmallowPlugin()],
-    info=dict(
-        description=f"An API for the Strategies of Resistance Data Project.\
+def validate_year_range(data):
+    """A period may not end before it starts."""
+    start, end = data.get("startYear"), data.get("endYear")
+    if start is not None and end is not None and start > end:
+        raise ValidationError("startYear must not be after endYear.", "endYear")
+
+
+# Title page of the OpenAPI document
+info = dict(
+    description=f"An API for the Strategies of Resistance Data Project.\
             \n\nWhen passing new data to the model, the order of creation must be `Groups` >\
             `Organizations` > (`NonviolentTactics` | `ViolentTactics` ), where the pipe '|' \
             indicates order indifference at the step. Users must be token-authorized to \
@@ -48,14 +53,8 @@ spec = APISpec(
             and pass that to the authorize form BearerAuth to begin a session on this page. From there,\
             you may perform example requests to generate the endpoint for those resources, see results, \
             and examine model input and output schemas."
-    ),
 )
 
-# security schema
-http_basic_scheme = {"type": "http", "scheme": "basic"}
-http_bearer_scheme = {"type": "http", "scheme": "bearer"}
-spec.components.security_scheme("BasicAuth", http_basic_scheme)
-spec.components.security_scheme("BearerAuth", http_bearer_scheme)
 
 # Null handler mix in
 class BasicSchema(Schema):
@@ -67,7 +66,7 @@ class BasicSchema(Schema):
 
 
 # Define Schemas
-class TokenSchema(Schema):
+class TokenSchema(TimedDump, Schema):
     token = fields.Str(
         description="User's authorization bearer token for further requests."
     )
@@ -76,7 +75,7 @@ class TokenSchema(Schema):
     )
 
 
-class ViolentTacticsSchema(ma.SQLAlchemyAutoSchema):
+class ViolentTacticsSchema(TimedDump, ma.SQLAlchemyAutoSchema):
     class Meta:
         type_ = "results"
         model = ViolentTactics
@@ -123,7 +122,7 @@ class ViolentTacticsInputSchema(Schema):
     againstOrg = fields.Int(
         description="Violent action taken against another organization."
     )
-    againstOrgViolent = fields.Int(
+    againstOrgFatal = fields.Int(
         description="Fatally violent action taken against another organization."
     )
     againstIngroup = fields.Int(
@@ -143,7 +142,7 @@ class ViolentTacticsInputSchema(Schema):
     modified_at = fields.DateTime(description="Time of most recent modification.")
 
 
-class NonviolentTacticsSchema(ma.SQLAlchemyAutoSchema):
+class NonviolentTacticsSchema(TimedDump, ma.SQLAlchemyAutoSchema):
     class Meta:
         type_ = "results"
         model = NonviolentTactics
@@ -191,7 +190,7 @@ class NonviolentTacticsInputSchema(Schema):
     modified_at = fields.DateTime(description="Time of most recent modification.")
 
 
-class OrganizationSchema(ma.SQLAlchemyAutoSchema):
+class OrganizationSchema(TimedDump, ma.SQLAlchemyAutoSchema):
     class Meta:
         type_ = "results"
         model = Organizations
@@ -241,8 +240,12 @@ class OrganizationInputSchema(Schema):
     created_at = fields.DateTime(description="Time of row creation.")
     modified_at = fields.DateTime(description="Time of most recent modification.")
 
+    @validates_schema
+    def validate_years(self, data, **kwargs):
+        validate_year_range(data)
+
 
-class GroupSchema(ma.SQLAlchemyAutoSchema):
+class GroupSchema(TimedDump, ma.SQLAlchemyAutoSchema):
     class Meta:
         type_ = "results"
         model = Groups
@@ -292,8 +295,12 @@ class GroupInputSchema(Schema):
     created_at = fields.DateTime(description="Time of row creation.")
     modified_at = fields.DateTime(description="Time of most recent modification.")
 
+    @validates_schema
+    def validate_years(self, data, **kwargs):
+        validate_year_range(data)
 
-class UserSchema(ma.SQLAlchemyAutoSchema):
+
+class UserSchema(TimedDump, ma.SQLAlchemyAutoSchema):
     class Meta:
         type_ = "results"
         model = User
@@ -327,6 +334,38 @@ class UserInputSchema(Schema):
     name = fields.String(description="User's name.", required=True)
 
 
+class JobSchema(TimedDump, ma.SQLAlchemyAutoSchema):
+    class Meta:
+        type_ = "results"
+        model = Job
+        fields = (
+            "id",
+            "kind",
+            "status",
+            "done",
+            "total",
+            "result",
+            "error",
+            "created_at",
+            "started_at",
+            "finished_at",
+            "_links",
+        )
+
+    result = fields.Method("load_result")
+
+    # Links
+    _links = ma.Hyperlinks(
+        {
+            "self": ma.URLFor("api.get_job", values=dict(id="<id>")),
+            "collection": ma.URLFor("api.get_jobs"),
+        }
+    )
+
+    def load_result(self, job):
+        return json.loads(job.result) if job.result else None
+
+
 # register schemas with spec
 names = [
     "NonviolentTactics",
@@ -339,6 +378,7 @@ names = [
     "OrganizationsInput",
     "User",
     "UserInput",
+    "Job",
 ]
 schemas = [
     NonviolentTacticsSchema,
@@ -351,17 +391,37 @@ schemas = [
     OrganizationInputSchema,
     UserSchema,
     UserInputSchema,
+    JobSchema,
 ]
-for name, schema in zip(names, schemas):
-    spec.components.schema(name, schema=schema)
 
 
-# add swagger tags for endpoint annotation
+# swagger tags for endpoint annotation
 tags = [
     {"name": name, "description": f"routes for {name} model I/O"}
     for name in names
     if not name.endswith("Input")
 ]
-for tag in tags:
-    print(f"Adding tag: {tag['name']}")
-    spec.tag(tag)
+
+
+def create_spec(app):
+    """
+    Build the OpenAPI document from the docstrings of the api blueprint's
+    views. Needs a request context for url_for in the schemas.
+    """
+    spec = APISpec(
+        title=Config.COVER_NAME,
+        version="0.1.0",
+        openapi_version="3.0.3",
+        plugins=[FlaskPlugin(), MarshmallowPlugin()],
+        info=info,
+    )
+    spec.components.security_scheme("BasicAuth", {"type": "http", "scheme": "basic"})
+    spec.components.security_scheme("BearerAuth", {"type": "http", "scheme": "bearer"})
+    for name, schema in zip(names, schemas):
+        spec.components.schema(name, schema=schema)
+    for tag in tags:
+        spec.tag(tag)
+    for endpoint, view in app.view_functions.items():
+        if endpoint.startswith("api.") and endpoint != "api.swagger_json":
+            spec.path(view=view)
+    return spec
@@ -1,5 +1,12 @@
 from flask import Blueprint
+from app import ensure_extension
 
 bp = Blueprint('auth', __name__)
 
+
+@bp.before_app_first_request
+def setup_login():
+    ensure_extension("login_manager")
+
+
 from app.auth import routes
@@ -0,0 +1,475 @@
+"""Bulk loading and syncing of the SRDP csv datasets straight into the database."""
+import csv
+import hashlib
+import json
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from marshmallow import ValidationError
+from sqlalchemy import and_, bindparam, create_engine, func, literal, select, text
+from app import db
+from app.api_spec import (
+    GroupInputSchema,
+    NonviolentTacticsInputSchema,
+    OrganizationInputSchema,
+    ViolentTacticsInputSchema,
+)
+from app.events import queue_event, queue_events
+from app.models import (
+    FeedHold,
+    Groups,
+    NonviolentTactics,
+    Organizations,
+    Tombstone,
+    ViolentTactics,
+)
+
+
+# Loadable tables, named after their API collections: (model, input schema)
+TABLES = {
+    "groups": (Groups, GroupInputSchema),
+    "organizations": (Organizations, OrganizationInputSchema),
+    "violent_tactics": (ViolentTactics, ViolentTacticsInputSchema),
+    "nonviolent_tactics": (NonviolentTactics, NonviolentTacticsInputSchema),
+}
+# Natural key of each table, used to match snapshot rows with stored rows
+NATURAL_KEYS = {
+    "groups": ("kgcId",),
+    "organizations": ("facId",),
+    "violent_tactics": ("facId", "year"),
+    "nonviolent_tactics": ("facId", "year"),
+}
+AUDIT_COLUMNS = ("created_at", "modified_at")
+# Dependent tables deleted along with their parent rows: (table, shared column)
+CASCADES = {
+    "groups": [("organizations", "kgcId")],
+    "organizations": [("violent_tactics", "facId"), ("nonviolent_tactics", "facId")],
+}
+
+
+@contextmanager
+def holding_feed():
+    """
+    Hold the change feed back at the current time while the block runs. The
+    block must end its transaction. Rows are stamped when they are written,
+    not when they are committed, so without a hold the feed could move past
+    the rows of a long transaction before they become visible.
+    """
+    table = FeedHold.__table__
+    # On connections of their own, so the feed sees the hold straight away
+    with db.engine.begin() as connection:
+        hold = connection.execute(
+            table.insert().values(started_at=func.now())
+        ).inserted_primary_key[0]
+    try:
+        yield
+    finally:
+        with db.engine.begin() as connection:
+            connection.execute(table.delete().where(table.c.id == hold))
+
+
+def csv_chunks(f, chunk_size=5000):
+    """Stream an open csv as lists of row dicts, leaving out empty cells."""
+    reader = csv.DictReader(f)
+    chunk = []
+    for row in reader:
+        chunk.append({key: value for key, value in row.items() if value != ""})
+        if len(chunk) >= chunk_size:
+            yield reader.fieldnames, chunk
+            chunk = []
+    if chunk:
+        yield reader.fieldnames, chunk
+
+
+def read_csv_chunks(path, chunk_size=5000):
+    with open(path, newline="", encoding="utf-8") as f:
+        yield from csv_chunks(f, chunk_size)
+
+
+def json_chunks(rows):
+    """Chunk a json list of row objects like a csv, dropping null values."""
+    if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+        raise ValueError("rows must be a list of objects")
+    fieldnames = sorted({field for row in rows for field in row})
+    rows = [{k: v for k, v in row.items() if v is not None} for row in rows]
+    return [(fieldnames, rows)] if rows else []
+
+
+def check_columns(schema, fieldnames):
+    unknown = set(fieldnames) - set(schema().fields)
+    if unknown:
+        raise ValueError(f"unknown columns {', '.join(sorted(unknown))}")
+
+
+def validate_chunk(schema, chunk, offset=0):
+    """
+    Load a chunk with the table's input schema. Raises ValueError naming the
+    first offending csv lines (counting the header as line 1).
+    """
+    try:
+        return schema(many=True).load(chunk)
+    except ValidationError as e:
+        errors = [
+            f"line {offset + index + 2}: {messages}"
+            for index, messages in sorted(e.messages.items())[:10]
+        ]
+        raise ValueError("invalid rows\n" + "\n".join(errors))
+
+
+def insert_rows(model, rows, fieldnames):
+    """
+    Complete rows so every row binds the same ``fieldnames`` columns and
+    insert them with one executemany. Empty cells fall back to the column's
+    scalar default, or the current time for the audit columns.
+    """
+    table = model.__table__
+    columns = [c for c in table.columns if c.name in fieldnames]
+    now = datetime.utcnow()
+    params = [complete_row(columns, row, now) for row in rows]
+    db.session.execute(table.insert(), params)
+
+
+def complete_row(columns, row, now=None):
+    values = {}
+    for column in columns:
+        if column.name in row:
+            values[column.name] = row[column.name]
+        elif column.name in AUDIT_COLUMNS:
+            values[column.name] = now
+        elif column.default is not None and column.default.is_scalar:
+            values[column.name] = column.default.arg
+        else:
+            values[column.name] = None
+    return values
+
+
+def load_csv(name, path, chunk_size=5000):
+    """
+    Validate and insert a csv with bulk core inserts, in one transaction: a
+    bad row anywhere in the file leaves the table as it was, so the fixed
+    file can simply be loaded again. Returns the number of rows loaded.
+    """
+    model, schema = TABLES[name]
+    loaded = 0
+    with holding_feed():
+        try:
+            for fieldnames, chunk in read_csv_chunks(path, chunk_size):
+                check_columns(schema, fieldnames)
+                rows = validate_chunk(schema, chunk, offset=loaded)
+                # Columns the csv does not carry are left to their defaults
+                insert_rows(model, rows, fieldnames)
+                loaded += len(rows)
+            queue_event(db.session, model.__tablename__, None, "bulk_insert")
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+    return loaded
+
+
+def load_csv_infile(name, path, chunk_size=5000):
+    """
+    Validate a csv and load it with MySQL's ``LOAD DATA LOCAL INFILE``, the
+    fastest path on MySQL. The server must allow ``local_infile``.
+    """
+    model, schema = TABLES[name]
+    fieldnames = None
+    validated = 0
+    for fieldnames, chunk in read_csv_chunks(path, chunk_size):
+        check_columns(schema, fieldnames)
+        validate_chunk(schema, chunk, offset=validated)
+        validated += len(chunk)
+    if fieldnames is None:
+        return 0
+    # Files written on Windows would otherwise keep a \r in their last column
+    with open(path, "rb") as f:
+        newline = "\\r\\n" if f.readline().endswith(b"\r\n") else "\\n"
+
+    table = model.__table__
+    variables, assignments = [], []
+    for field in fieldnames:
+        column = table.columns[field]
+        variables.append(f"@`{field}`")
+        value = f"NULLIF(@`{field}`, '')"
+        if column.default is not None and column.default.is_scalar:
+            value = f"COALESCE({value}, {int(column.default.arg)})"
+        assignments.append(f"`{field}` = {value}")
+    for field in AUDIT_COLUMNS:
+        if field not in fieldnames:
+            assignments.append(f"`{field}` = NOW()")
+    statement = text(
+        f"LOAD DATA LOCAL INFILE :path INTO TABLE `{table.name}` "
+        "CHARACTER SET utf8mb4 FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' "
+        f"LINES TERMINATED BY '{newline}' IGNORE 1 LINES "
+        f"({', '.join(variables)}) SET {', '.join(assignments)}"
+    )
+    engine = create_engine(db.engine.url, connect_args={"local_infile": True})
+    try:
+        with holding_feed(), engine.begin() as connection:
+            loaded = connection.execute(statement, {"path": path}).rowcount
+    finally:
+        engine.dispose()
+    queue_event(db.session, model.__tablename__, None, "bulk_insert")
+    db.session.commit()
+    return loaded
+
+
+def row_digest(values, columns):
+    raw = json.dumps([values[c.name] for c in columns], default=str)
+    return hashlib.sha1(raw.encode("utf-8")).digest()
+
+
+def diff_rows(name, fieldnames, rows):
+    """
+    Compare a full snapshot of validated ``rows`` with the stored table,
+    matching rows by natural key and comparing digests of the snapshot's
+    columns. Returns (inserts, updates, deletes): rows to insert, (primary
+    key, row) pairs to update and (primary key, natural key) pairs to delete.
+    """
+    model, _ = TABLES[name]
+    table = model.__table__
+    key_names = NATURAL_KEYS[name]
+    pk = table.primary_key.columns.values()[0]
+    columns = [
+        c for c in table.columns if c.name in fieldnames and c.name not in AUDIT_COLUMNS
+    ]
+
+    snapshot = {}
+    for row in rows:
+        values = complete_row(columns, row)
+        key = tuple(values[k] for k in key_names)
+        if key in snapshot:
+            raise ValueError(f"duplicate {', '.join(key_names)} {list(key)}")
+        snapshot[key] = values
+
+    inserts, updates, deletes = [], [], []
+    seen = set()
+    stored = db.session.execute(
+        select(pk.label("_pk"), *columns).order_by(pk)
+    ).mappings()
+    for record in stored:
+        key = tuple(record[k] for k in key_names)
+        if key not in snapshot or key in seen:
+            # Gone from the release, or a duplicate of an earlier stored row
+            deletes.append((record["_pk"], key))
+            continue
+        seen.add(key)
+        values = snapshot[key]
+        if row_digest(values, columns) != row_digest(record, columns):
+            updates.append((record["_pk"], values))
+    inserts = [values for key, values in snapshot.items() if key not in seen]
+    return inserts, updates, deletes
+
+
+def apply_diff(name, fieldnames, inserts, updates, deletes):
+    """Apply a diff with set-based statements; the caller commits."""
+    model, _ = TABLES[name]
+    table = model.__table__
+    pk = table.primary_key.columns.values()[0]
+    if deletes:
+        delete_rows(name, [key for key, _ in deletes])
+    if updates:
+        db.session.execute(
+            table.update().where(pk == bindparam("_pk")).values(modified_at=func.now()),
+            [
+                dict(
+                    {k: v for k, v in values.items() if k not in NATURAL_KEYS[name]},
+                    _pk=key,
+                )
+                for key, values in updates
+            ],
+        )
+        queue_events(db.session, table.name, [key for key, _ in updates], "update")
+    if inserts:
+        insert_rows(model, inserts, fieldnames)
+        queue_event(db.session, table.name, None, "bulk_insert")
+
+
+def delete_where(name, criterion, counts):
+    """
+    Delete the rows of a table matching ``criterion``, after their dependent
+    rows, recording tombstones with INSERT ... SELECT. Two statements per
+    table whatever the number of rows; deleted counts accumulate in ``counts``.
+    """
+    model, _ = TABLES[name]
+    table = model.__table__
+    pk = table.primary_key.columns.values()[0]
+    for child, column in CASCADES.get(name, []):
+        child_table = TABLES[child][0].__table__
+        parents = select(table.c[column]).where(criterion)
+        delete_where(child, child_table.c[column].in_(parents), counts)
+    db.session.execute(
+        Tombstone.__table__.insert().from_select(
+            ["tableName", "rowId", "deleted_at"],
+            select(literal(table.name), pk, func.now()).where(criterion),
+        )
+    )
+    deleted = db.session.execute(table.delete().where(criterion)).rowcount
+    counts[name] = counts.get(name, 0) + deleted
+
+
+def delete_rows(name, keys):
+    """
+    Delete rows by primary key together with their dependent rows; the caller
+    commits. Returns the number of rows deleted per table.
+    """
+    model, _ = TABLES[name]
+    table = model.__table__
+    pk = table.primary_key.columns.values()[0]
+    counts = {}
+    for start in range(0, len(keys), 1000):
+        delete_where(name, pk.in_(keys[start : start + 1000]), counts)
+    queue_events(db.session, table.name, keys, "delete")
+    # Dependent rows are not listed; their tombstones name them in the change feed
+    for child, deleted in counts.items():
+        if child != name and deleted:
+            queue_event(db.session, TABLES[child][0].__tablename__, None, "bulk_delete")
+    return counts
+
+
+def check_changes(name, changes):
+    """Validate a change set with the table's input schema and deserialize it."""
+    _, schema = TABLES[name]
+    if not isinstance(changes, dict) or not changes:
+        raise ValueError("changes must be a non-empty object")
+    locked = sorted((set(NATURAL_KEYS[name]) | set(AUDIT_COLUMNS)) & set(changes))
+    if locked:
+        raise ValueError(f"cannot change {', '.join(locked)}")
+    try:
+        return schema(partial=True).load(changes)
+    except ValidationError as e:
+        raise ValueError(f"invalid changes {e.messages}")
+
+
+def update_rows(name, keys, changes):
+    """
+    Apply one change set to rows by primary key, one UPDATE per 1000 keys;
+    the caller commits. Returns the number of rows matched.
+    """
+    values = check_changes(name, changes)
+    model, _ = TABLES[name]
+    table = model.__table__
+    pk = table.primary_key.columns.values()[0]
+    updated = 0
+    for start in range(0, len(keys), 1000):
+        statement = (
+            table.update()
+            .where(pk.in_(keys[start : start + 1000]))
+            .values(modified_at=func.now(), **values)
+        )
+        updated += db.session.execute(statement).rowcount
+    queue_events(db.session, table.name, keys, "update")
+    return updated
+
+
+def update_each(name, items):
+    """
+    Apply per-row change sets. Each item names its row by primary key or by
+    natural key and carries a ``changes`` object; items identified and
+    changed alike share one executemany. The caller commits. Returns the
+    number of rows matched.
+    """
+    model, _ = TABLES[name]
+    table = model.__table__
+    pk = table.primary_key.columns.values()[0]
+    statements = {}
+    for i, item in enumerate(items):
+        if not isinstance(item, dict):
+            raise ValueError(f"item {i} must be an object")
+        values = check_changes(name, item.get("changes"))
+        for by in [(pk.name,), NATURAL_KEYS[name]]:
+            if all(isinstance(item.get(k), int) for k in by):
+                break
+        else:
+            raise ValueError(
+                f"item {i} must name its row by {pk.name} or by "
+                f"{', '.join(NATURAL_KEYS[name])}"
+            )
+        params = dict(values, **{f"_{k}": item[k] for k in by})
+        statements.setdefault((by, tuple(sorted(values))), []).append(params)
+
+    updated = 0
+    for (by, _), params in statements.items():
+        criterion = and_(*[table.c[k] == bindparam(f"_{k}") for k in by])
+        statement = table.update().where(criterion).values(modified_at=func.now())
+        updated += db.session.execute(statement, params).rowcount
+        if by == (pk.name,):
+            keys = [p[f"_{pk.name}"] for p in params]
+            queue_events(db.session, table.name, keys, "update")
+        else:
+            queue_event(db.session, table.name, None, "bulk_update")
+    return updated
+
+
+def sync_rows(name, chunks, dry_run=False, progress=None):
+    """
+    Make a table match a full release snapshot given as (fieldnames, rows)
+    chunks, in one transaction. Only changed rows are written, so unchanged
+    rows keep their ``modified_at``. Returns a change report. ``progress``
+    is called with the number of rows processed before each write phase.
+    """
+    model, schema = TABLES[name]
+    fieldnames, rows = None, []
+    for fieldnames, chunk in chunks:
+        check_columns(schema, fieldnames)
+        rows.extend(validate_chunk(schema, chunk, offset=len(rows)))
+    if fieldnames is None:
+        raise ValueError("the snapshot is empty")
+    missing = set(NATURAL_KEYS[name]) - set(fieldnames)
+    if missing:
+        raise ValueError(f"missing key columns {', '.join(sorted(missing))}")
+
+    if progress:
+        progress(0, len(rows))
+    with nullcontext() if dry_run else holding_feed():
+        try:
+            inserts, updates, deletes = diff_rows(name, fieldnames, rows)
+            if progress:
+                progress(len(rows) - len(inserts) - len(updates), len(rows))
+            if not dry_run:
+                apply_diff(name, fieldnames, inserts, updates, deletes)
+                db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+    def natural_key(values):
+        key = [values[k] for k in NATURAL_KEYS[name]]
+        return key[0] if len(key) == 1 else key
+
+    return {
+        "table": name,
+        "dry_run": dry_run,
+        "inserted": len(inserts),
+        "updated": len(updates),
+        "deleted": len(deletes),
+        "unchanged": len(rows) - len(inserts) - len(updates),
+        "changes": {
+            "inserted": [natural_key(values) for values in inserts],
+            "updated": [natural_key(values) for _, values in updates],
+            "deleted": [key[0] if len(key) == 1 else list(key) for _, key in deletes],
+        },
+    }
+
+
+def sync_csv(name, path, dry_run=False, chunk_size=5000, progress=None):
+    chunks = read_csv_chunks(path, chunk_size)
+    return sync_rows(name, chunks, dry_run=dry_run, progress=progress)
+
+
+def export_csv(name, path):
+    """Write a table to a csv in the release format. Returns the row count."""
+    model, schema = TABLES[name]
+    table = model.__table__
+    fields = set(schema().fields) - set(AUDIT_COLUMNS)
+    columns = [c for c in table.columns if c.name in fields]
+    key_columns = [table.columns[k] for k in NATURAL_KEYS[name]]
+    query = select(*columns).order_by(*key_columns)
+    exported = 0
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow([c.name for c in columns])
+        result = db.session.execute(query.execution_options(yield_per=5000))
+        for row in result:
+            writer.writerow(row)
+            exported += 1
+    return exported
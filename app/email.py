@@ -1,16 +1,149 @@
-from threading import Thread
+"""
+Outgoing email.
+
+Messages are queued and sent by a few background threads per process
+(``MAIL_WORKERS``) rather than a thread per message. Each thread keeps its
+SMTP connection open while there is mail to send, sending up to
+``MAIL_BATCH_SIZE`` queued messages at a time, and closes it after
+``MAIL_IDLE_TIMEOUT`` seconds without any. The queue holds at most
+``MAIL_QUEUE_SIZE`` messages; beyond that messages are dropped and logged,
+so a burst of password resets cannot pile up threads or memory.
+"""
+import atexit
+import os
+import queue
+import smtplib
+import threading
 from flask import current_app
 from flask_mail import Message
-from app import mail
+from app import ensure_extension, mail, metrics
 
+_lock = threading.Lock()
 
-def send_async_email(app, msg):
-    with app.app_context():
-        mail.send(msg)
+
+class MailSender:
+    def __init__(self, app):
+        self.app = app
+        self.pid = os.getpid()
+        self.queue = queue.Queue(app.config["MAIL_QUEUE_SIZE"])
+        self.batch_size = app.config["MAIL_BATCH_SIZE"]
+        self.idle_timeout = app.config["MAIL_IDLE_TIMEOUT"]
+        self.threads = [
+            threading.Thread(target=self.run, name=f"mail-sender-{i}", daemon=True)
+            for i in range(app.config["MAIL_WORKERS"])
+        ]
+        for thread in self.threads:
+            thread.start()
+        atexit.register(self.stop)
+
+    def submit(self, msg):
+        """Queue ``msg``; returns False if the queue is full and it was dropped."""
+        try:
+            self.queue.put_nowait(msg)
+        except queue.Full:
+            metrics.inc("mail_messages_total", result="dropped")
+            self.app.logger.warning(
+                f"Mail queue full, dropped message to {', '.join(msg.send_to)}"
+            )
+            return False
+        return True
+
+    def join(self):
+        """Wait until every queued message has been sent or given up on."""
+        self.queue.join()
+
+    def stop(self, timeout=5):
+        """Send what is queued, then stop the threads."""
+        try:
+            for _ in self.threads:
+                self.queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        for thread in self.threads:
+            thread.join(timeout)
+
+    def run(self):
+        with self.app.app_context():
+            connection = None
+            while True:
+                try:
+                    msg = self.queue.get(
+                        timeout=self.idle_timeout if connection else None
+                    )
+                except queue.Empty:
+                    connection = self.close(connection)
+                    continue
+                batch = [msg]
+                while msg is not None and len(batch) < self.batch_size:
+                    try:
+                        batch.append(self.queue.get_nowait())
+                    except queue.Empty:
+                        break
+                    msg = batch[-1]
+                for msg in batch:
+                    if msg is not None:
+                        connection = self.send(connection, msg)
+                    self.queue.task_done()
+                if batch[-1] is None:
+                    self.close(connection)
+                    return
+
+    def send(self, connection, msg):
+        """Send ``msg`` over ``connection``, or a new one; returns the connection."""
+        # A kept connection may have been dropped by the server; reconnect once
+        for attempt in range(2):
+            try:
+                if connection is None:
+                    connection = mail.connect().__enter__()
+                connection.send(msg)
+                metrics.inc("mail_messages_total", result="sent")
+                return connection
+            except (smtplib.SMTPServerDisconnected, ConnectionError):
+                connection = self.close(connection)
+                if attempt:
+                    self.failed(msg)
+            except Exception:
+                connection = self.close(connection)
+                self.failed(msg)
+                break
+        return connection
+
+    def failed(self, msg):
+        # Called while handling the exception, so its traceback is logged
+        metrics.inc("mail_messages_total", result="failed")
+        self.app.logger.exception(f"Failed to send mail to {', '.join(msg.send_to)}")
+
+    @staticmethod
+    def close(connection):
+        if connection is not None:
+            try:
+                connection.__exit__(None, None, None)
+            except (smtplib.SMTPException, OSError):
+                pass
+        return None
+
+
+def get_sender(app=None):
+    """The app's sender in this process, started on first use (and after a fork)."""
+    app = app or current_app._get_current_object()
+    sender = app.extensions.get("mail_sender")
+    if sender is None or sender.pid != os.getpid():
+        with _lock:
+            sender = app.extensions.get("mail_sender")
+            if sender is None or sender.pid != os.getpid():
+                sender = app.extensions["mail_sender"] = MailSender(app)
+    return sender
+
+
+def stop_sender(app):
+    sender = app.extensions.pop("mail_sender", None)
+    if sender is not None and sender.pid == os.getpid():
+        sender.stop()
 
 
 def send_email(subject, sender, recipients, text_body, html_body,
                attachments=None, sync=False):
+    ensure_extension("mail")
     msg = Message(subject, sender=sender, recipients=recipients)
     msg.body = text_body
     msg.html = html_body
@@ -20,5 +153,7 @@ def send_email(subject, sender, recipients, text_body, html_body,
     if sync:
         mail.send(msg)
     else:
-        Thread(target=send_async_email,
-            args=(current_app._get_current_object(), msg)).start()
+        get_sender().submit(msg)
+
+
+metrics.describe("mail_messages_total", "counter", "Mail messages by result")
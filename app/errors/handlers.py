@@ -27,3 +27,12 @@ def internal_error(error):
     if wants_json_response():
         return api_error_response(500)
     return render_template('errors/500.html'), 500
+
+
+@bp.app_errorhandler(503)
+def service_unavailable(error):
+    db.session.rollback()
+    response = api_error_response(503, error.description)
+    if getattr(error, "retry_after", None):
+        response.headers["Retry-After"] = str(error.retry_after)
+    return response
@@ -0,0 +1,180 @@
+"""
+Data change notifications.
+
+Every commit that touches a data table appends compact events to a shared
+append-only log file. Gunicorn workers all write to (and tail) the same file,
+so a stream served by any worker sees changes committed by every other worker
+without an external broker. Writers serialise on an exclusive ``flock`` which
+also guards the generation counter kept next to the log.
+"""
+import fcntl
+import json
+import os
+import time
+from flask import current_app, has_app_context
+from sqlalchemy import event as sa_event, inspect
+from app import db
+
+# Tables whose changes are published
+DATA_TABLES = ("groups", "organizations", "violence", "nonviolence")
+
+
+def queue_event(session, table, key, operation):
+    """Stage an event to be published when ``session`` commits."""
+    session.info.setdefault("pending_events", []).append(
+        {"table": table, "key": key, "op": operation}
+    )
+
+
+def queue_events(session, table, keys, operation):
+    for key in keys:
+        queue_event(session, table, key, operation)
+
+
+@sa_event.listens_for(db.session, "after_flush")
+def collect_flushed_changes(session, flush_context):
+    for operation, instances in [
+        ("insert", session.new),
+        ("update", session.dirty),
+        ("delete", session.deleted),
+    ]:
+        for instance in instances:
+            mapper = inspect(instance).mapper
+            table = mapper.local_table.name
+            if table not in DATA_TABLES:
+                continue
+            if operation == "update" and not session.is_modified(instance):
+                continue
+            key = mapper.primary_key_from_instance(instance)[0]
+            queue_event(session, table, key, operation)
+
+
+@sa_event.listens_for(db.session, "after_commit")
+def publish_committed_changes(session):
+    events = session.info.pop("pending_events", None)
+    if events and has_app_context():
+        publish(events)
+
+
+@sa_event.listens_for(db.session, "after_rollback")
+def discard_rolled_back_changes(session):
+    session.info.pop("pending_events", None)
+
+
+def publish(events):
+    """Append ``events`` to the shared log, stamping each with a generation."""
+    path = current_app.config.get("EVENTS_LOG")
+    if not path:
+        return
+    fd = lock_log(path)
+    try:
+        # Rotate once the log passes its size limit; readers follow the new inode
+        if os.fstat(fd).st_size > current_app.config["EVENTS_LOG_MAX_BYTES"]:
+            os.replace(path, path + ".1")
+            os.close(fd)
+            fd = lock_log(path)
+        generation = read_generation(path)
+        lines = []
+        for event in events:
+            generation += 1
+            line = json.dumps(dict(event, gen=generation), separators=(",", ":"))
+            lines.append(line)
+        os.write(fd, ("\n".join(lines) + "\n").encode("utf-8"))
+        with open(path + ".gen", "w") as f:
+            f.write(str(generation))
+    finally:
+        os.close(fd)
+
+
+def lock_log(path):
+    """Open the log for appending and take its exclusive lock."""
+    while True:
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        # Another writer may have rotated the file while we waited for the lock
+        try:
+            if os.stat(path).st_ino == os.fstat(fd).st_ino:
+                return fd
+        except FileNotFoundError:
+            pass
+        os.close(fd)
+
+
+def read_generation(path):
+    try:
+        with open(path + ".gen") as f:
+            return int(f.read() or 0)
+    except (FileNotFoundError, ValueError):
+        return 0
+
+
+def read_events(path):
+    """The complete events in the log at ``path``, if it exists."""
+    try:
+        with open(path, "rb") as f:
+            lines = f.read().split(b"\n")[:-1]
+    except FileNotFoundError:
+        return []
+    return [json.loads(line) for line in lines]
+
+
+def follow(path, last_generation=None, timeout=25, poll_interval=0.5):
+    """
+    Yield events appended to the log after ``last_generation`` (or after the
+    current end of the log when None) until ``timeout`` seconds pass. Events
+    rotated out of the log are read from the rotated file; if some are gone
+    from both, a ``reset`` event takes their place, telling the client to
+    resync. Yields None on every idle poll so callers can send keep-alives.
+    """
+    deadline = time.monotonic() + timeout
+    f = None
+
+    def since_last(event):
+        nonlocal last_generation
+        if last_generation is None:
+            last_generation = event["gen"]
+            return [event]
+        if event["gen"] <= last_generation:
+            return []
+        events = [event]
+        if event["gen"] > last_generation + 1:
+            events.insert(0, {"op": "reset", "gen": event["gen"] - 1})
+        last_generation = event["gen"]
+        return events
+
+    try:
+        while time.monotonic() < deadline:
+            if f is None:
+                try:
+                    f = open(path, "rb")
+                except FileNotFoundError:
+                    time.sleep(poll_interval)
+                    yield None
+                    continue
+                if last_generation is None:
+                    f.seek(0, os.SEEK_END)
+                else:
+                    # The log was opened first, so an event rotated out since
+                    # is in one file or the other
+                    for event in read_events(path + ".1"):
+                        yield from since_last(event)
+            line = f.readline()
+            if line.endswith(b"\n"):
+                yield from since_last(json.loads(line))
+                continue
+            # At the end of the log; rewind over any partially written line
+            f.seek(-len(line), os.SEEK_CUR)
+            try:
+                rotated = os.stat(path).st_ino != os.fstat(f.fileno()).st_ino
+            except FileNotFoundError:
+                rotated = False
+            if rotated:
+                # Everything left in the old file has been read, start the new one
+                f.close()
+                f = open(path, "rb")
+                continue
+            time.sleep(poll_interval)
+            yield None
+    finally:
+        if f is not None:
+            f.close()
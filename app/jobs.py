@@ -0,0 +1,293 @@
+"""
+Background jobs.
+
+Long-running imports, exports and deletes are stored as rows of the ``jobs``
+table and executed by a pool of worker processes started with
+``flask jobs-worker``, so the request that submits them returns straight
+away and clients poll ``/api/jobs/<id>``. Workers claim jobs with a
+conditional update, so several workers (on one or more hosts) can share the
+queue. A job whose worker stops sending heartbeats is handed to another.
+
+Files a job reads are removed once it has finished or been cancelled, and
+the files it writes (exports) ``JOBS_RESULT_SECONDS`` after it succeeded,
+when the job is marked expired.
+"""
+import json
+import multiprocessing
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import and_, or_
+from sqlalchemy.exc import OperationalError
+from app import db
+from app.dataset import (
+    delete_rows,
+    export_csv,
+    holding_feed,
+    json_chunks,
+    read_csv_chunks,
+    sync_rows,
+)
+from app.models import Job
+
+# Job handlers by kind, registered with @handler
+JOB_TYPES = {}
+# Job kind -> params naming the files the job reads, and the files it writes
+JOB_INPUTS = {}
+JOB_OUTPUTS = {}
+
+
+def handler(kind, inputs=(), outputs=()):
+    def decorator(fn):
+        JOB_TYPES[kind] = fn
+        JOB_INPUTS[kind] = inputs
+        JOB_OUTPUTS[kind] = outputs
+        return fn
+
+    return decorator
+
+
+def job_path(name):
+    os.makedirs(current_app.config["JOBS_DIR"], exist_ok=True)
+    return os.path.join(current_app.config["JOBS_DIR"], name)
+
+
+def submit(kind, params, user=None):
+    """Queue a job and return it."""
+    if kind not in JOB_TYPES:
+        raise ValueError(f"unknown job kind {kind}")
+    job = Job(kind=kind, params=json.dumps(params), userId=user.id if user else None)
+    db.session.add(job)
+    db.session.commit()
+    return job
+
+
+def cancel(job):
+    """Cancel a job that has not started yet. Returns False if it has."""
+    cancelled = Job.query.filter_by(id=job.id, status="queued").update(
+        {"status": "cancelled", "finished_at": datetime.utcnow()},
+        synchronize_session=False,
+    )
+    db.session.commit()
+    if cancelled:
+        remove_files(job.params, JOB_INPUTS[job.kind])
+    return bool(cancelled)
+
+
+def remove_files(params, names):
+    params = json.loads(params)
+    for name in names:
+        try:
+            os.remove(params[name])
+        except (KeyError, FileNotFoundError):
+            pass
+
+
+def expire_results():
+    """Remove the files of jobs that succeeded over JOBS_RESULT_SECONDS ago."""
+    expiry = datetime.utcnow() - timedelta(
+        seconds=current_app.config["JOBS_RESULT_SECONDS"]
+    )
+    kinds = [kind for kind, outputs in JOB_OUTPUTS.items() if outputs]
+    expired = Job.query.filter(
+        Job.kind.in_(kinds), Job.status == "succeeded", Job.finished_at < expiry
+    )
+    for job in expired.limit(100).all():
+        # Unless another worker expired it first
+        if Job.query.filter_by(id=job.id, status="succeeded").update(
+            {"status": "expired"}, synchronize_session=False
+        ):
+            db.session.commit()
+            remove_files(job.params, JOB_OUTPUTS[job.kind])
+    db.session.commit()
+
+
+def update_job(job_id, worker, **values):
+    """
+    Update a job still held by ``worker`` on its own connection, leaving the
+    handler's transaction alone. Returns whether the job was updated. Best
+    effort: sqlite refuses while another transaction writes, and a job whose
+    heartbeats keep failing goes stale and is handed to another worker.
+    """
+    table = Job.__table__
+    try:
+        with db.engine.begin() as connection:
+            updated = connection.execute(
+                table.update()
+                .where(
+                    table.c.id == job_id,
+                    table.c.worker == worker,
+                    table.c.status == "running",
+                )
+                .values(**values)
+            ).rowcount
+    except OperationalError as e:
+        current_app.logger.warning(f"Could not update job {job_id}: {e}")
+        return False
+    return bool(updated)
+
+
+def claim(worker):
+    """Claim the oldest runnable job for ``worker``, or return None."""
+    now = datetime.utcnow()
+    stale = now - timedelta(seconds=current_app.config["JOBS_STALE_SECONDS"])
+    runnable = or_(
+        Job.status == "queued",
+        and_(Job.status == "running", Job.heartbeat_at < stale),
+    )
+    candidates = Job.query.with_entities(Job.id).filter(runnable).order_by(Job.id)
+    for (job_id,) in candidates.limit(20).all():
+        claimed = Job.query.filter(Job.id == job_id, runnable).update(
+            {
+                "status": "running",
+                "worker": worker,
+                "started_at": now,
+                "heartbeat_at": now,
+            },
+            synchronize_session=False,
+        )
+        db.session.commit()
+        if claimed:
+            return Job.query.get(job_id)
+    return None
+
+
+def run(job):
+    """Run a claimed job and record its outcome."""
+    job_id, worker, kind, params = job.id, job.worker, job.kind, job.params
+
+    def progress(done, total=None):
+        update_job(
+            job_id, worker, done=done, total=total, heartbeat_at=datetime.utcnow()
+        )
+
+    try:
+        result = JOB_TYPES[job.kind](progress=progress, **json.loads(job.params))
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.exception(f"Job {job_id} ({kind}) failed")
+        values = {"status": "failed", "error": str(e) or e.__class__.__name__}
+    else:
+        values = {"status": "succeeded", "result": json.dumps(result)}
+    # Unless the job went stale and another worker claimed it
+    recorded = Job.query.filter_by(id=job_id, worker=worker, status="running").update(
+        dict(values, finished_at=datetime.utcnow()), synchronize_session=False
+    )
+    db.session.commit()
+    if not recorded:
+        # Its inputs are left for the worker now running it
+        current_app.logger.warning(
+            f"Job {job_id} was taken over by another worker; "
+            f"the outcome of {worker} was discarded"
+        )
+        return
+    remove_files(params, JOB_INPUTS[kind])
+    if values["status"] == "failed":
+        remove_files(params, JOB_OUTPUTS[kind])
+
+
+def heartbeat(job, stop, interval):
+    app = current_app._get_current_object()
+    job_id, worker = job.id, job.worker
+
+    def beat():
+        with app.app_context():
+            while not stop.wait(interval):
+                update_job(job_id, worker, heartbeat_at=datetime.utcnow())
+
+    thread = threading.Thread(target=beat, daemon=True)
+    thread.start()
+    return thread
+
+
+def work(burst=False):
+    """Process jobs until stopped, or until the queue is empty with ``burst``."""
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    interval = current_app.config["JOBS_STALE_SECONDS"] / 5
+    expired_at = 0
+    while True:
+        job = claim(worker)
+        if job is None:
+            # Look for expired results when idle, at most once a minute
+            if time.monotonic() - expired_at > 60:
+                expire_results()
+                expired_at = time.monotonic()
+            if burst:
+                return
+            time.sleep(current_app.config["JOBS_POLL_INTERVAL"])
+            continue
+        stop = threading.Event()
+        thread = heartbeat(job, stop, interval)
+        try:
+            run(job)
+        finally:
+            stop.set()
+            thread.join()
+            db.session.remove()
+
+
+def _worker_process(config_class, burst):
+    from app import create_app
+
+    app = create_app(config_class)
+    with app.app_context():
+        work(burst=burst)
+
+
+def run_workers(processes, burst=False):
+    """Run ``processes`` worker processes, or work in this process if 1."""
+    if processes <= 1:
+        work(burst=burst)
+        return
+    # Spawned children build their own app, with this app's configuration,
+    # and their own connection pool
+    context = multiprocessing.get_context("spawn")
+    args = (current_app.config_class, burst)
+    workers = [
+        context.Process(target=_worker_process, args=args) for _ in range(processes)
+    ]
+    for process in workers:
+        process.start()
+    try:
+        for process in workers:
+            process.join()
+    finally:
+        for process in workers:
+            if process.is_alive():
+                process.terminate()
+
+
+#
+# Handlers
+#
+@handler("sync", inputs=("path",))
+def sync_job(table, path, format="csv", dry_run=False, progress=None):
+    """Sync a table with an uploaded release snapshot."""
+    if format == "json":
+        with open(path, encoding="utf-8") as f:
+            chunks = json_chunks(json.load(f))
+    else:
+        chunks = read_csv_chunks(path)
+    return sync_rows(table, chunks, dry_run=dry_run, progress=progress)
+
+
+@handler("export", outputs=("path",))
+def export_job(table, path, progress=None):
+    """Write a table to a csv that can be downloaded from the job."""
+    return {"rows": export_csv(table, path)}
+
+
+@handler("delete")
+def delete_job(table, keys, progress=None):
+    """Delete rows by primary key along with their dependent rows."""
+    with holding_feed():
+        try:
+            counts = delete_rows(table, keys)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+    return {"deleted": counts}
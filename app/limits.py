@@ -0,0 +1,180 @@
+"""
+Load shedding and statement timeouts for the API.
+
+Each class of endpoint (reads, writes, bulk endpoints and event streams) has
+a number of slots shared by all workers on a host. A slot is an exclusive ``flock`` on a
+file in ``LIMITS_DIR``, so it is released even if its worker dies. A request
+that finds no free slot waits for one in the class's queue, itself a set of
+slots, and is turned away with 503 and ``Retry-After`` when the queue is full
+or its wait runs out. The database statements of a request are cancelled
+once they run past the statement timeout of its class.
+"""
+import fcntl
+import os
+import sqlite3
+import time
+from flask import current_app, g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from werkzeug.exceptions import ServiceUnavailable
+from app import db
+
+# Endpoints in the bulk class; the others are reads (GET) or writes
+BULK_ENDPOINTS = (
+    "api.batch",
+    "api.sync_table",
+    "api.delete_collection",
+    "api.update_collection",
+)
+# Endpoints holding a worker until their stream closes
+STREAM_ENDPOINTS = ("api.stream_events",)
+# The OpenAPI document is served from memory
+UNLIMITED_ENDPOINTS = ("api.swagger_json",)
+
+# MySQL's error for a SELECT cancelled by max_execution_time
+MYSQL_QUERY_TIMEOUT = 3024
+# Virtual machine steps between checks of the SQLite deadline
+SQLITE_PROGRESS_STEPS = 10000
+
+
+class Overloaded(ServiceUnavailable):
+    description = "The server is too busy to take this request; try again later."
+
+
+class StatementTimeout(ServiceUnavailable):
+    description = "The request took too long and its database work was cancelled."
+
+
+def endpoint_class():
+    if request.endpoint in BULK_ENDPOINTS:
+        return "bulk"
+    if request.endpoint in STREAM_ENDPOINTS:
+        return "stream"
+    return "read" if request.method in ("GET", "HEAD") else "write"
+
+
+def try_slot(name, count):
+    """Lock one of ``count`` slot files; returns its fd, or None if all are held."""
+    directory = current_app.config["LIMITS_DIR"]
+    os.makedirs(directory, exist_ok=True)
+    # Start at a different slot in each worker to spread the lock attempts
+    start = os.getpid() % count
+    for i in range(count):
+        fd = os.open(
+            os.path.join(directory, f"{name}-{(start + i) % count}"),
+            os.O_RDWR | os.O_CREAT,
+            0o644,
+        )
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            continue
+        return fd
+    return None
+
+
+def acquire(kind):
+    """
+    Take a slot for a request of class ``kind``, waiting in its queue if need
+    be. Returns the slot's fd, None when the class is not limited, or raises
+    Overloaded.
+    """
+    config = current_app.config
+    concurrency = config[f"{kind.upper()}_CONCURRENCY"]
+    if not concurrency:
+        return None
+    fd = try_slot(kind, concurrency)
+    if fd is not None:
+        return fd
+    queue = config[f"{kind.upper()}_QUEUE"]
+    place = try_slot(f"{kind}-queue", queue) if queue else None
+    if place is None:
+        raise Overloaded(retry_after=config["LIMITS_RETRY_AFTER"])
+    try:
+        deadline = time.monotonic() + config["LIMITS_QUEUE_TIMEOUT"]
+        while time.monotonic() < deadline:
+            time.sleep(0.01)
+            fd = try_slot(kind, concurrency)
+            if fd is not None:
+                return fd
+    finally:
+        os.close(place)
+    raise Overloaded(retry_after=config["LIMITS_RETRY_AFTER"])
+
+
+def init_app(app, blueprints):
+    """Limit the requests to ``blueprints`` and time out their statements."""
+    names = {blueprint.name for blueprint in blueprints}
+
+    @app.before_request
+    def limit_request():
+        # Sub-requests of a batch run under the batch's own slot and timeout
+        if (
+            request.blueprint not in names
+            or request.endpoint in UNLIMITED_ENDPOINTS
+            or request.method == "OPTIONS"
+            or g.get("batch")
+        ):
+            return
+        kind = endpoint_class()
+        g.limit_slot = acquire(kind)
+        timeout = current_app.config[f"{kind.upper()}_STATEMENT_TIMEOUT"]
+        if timeout:
+            db.session.info["statement_timeout"] = timeout
+
+    @app.teardown_request
+    def release_request(exc):
+        if g.get("batch"):
+            return
+        # Closing the file releases its lock
+        fd = g.pop("limit_slot", None)
+        if fd is not None:
+            os.close(fd)
+        db.session.info.pop("statement_timeout", None)
+
+
+#
+# Statement timeouts
+#
+@event.listens_for(db.session, "after_begin")
+def set_statement_timeout(session, transaction, connection):
+    timeout = session.info.get("statement_timeout")
+    connection.info["statement_timeout"] = timeout
+    if connection.dialect.name == "mysql":
+        milliseconds = int(timeout * 1000) if timeout else 0
+        # Only when it changes, as the setting stays with the connection
+        if connection.info.get("max_execution_time", 0) != milliseconds:
+            connection.exec_driver_sql(
+                f"SET SESSION max_execution_time = {milliseconds}"
+            )
+            connection.info["max_execution_time"] = milliseconds
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def start_statement_clock(conn, cursor, statement, parameters, context, executemany):
+    if conn.dialect.name != "sqlite":
+        return
+    timeout = conn.info.get("statement_timeout")
+    if timeout:
+        deadline = time.monotonic() + timeout
+        conn.connection.dbapi_connection.set_progress_handler(
+            lambda: time.monotonic() > deadline, SQLITE_PROGRESS_STEPS
+        )
+        conn.info["progress_handler"] = True
+    elif conn.info.pop("progress_handler", False):
+        conn.connection.dbapi_connection.set_progress_handler(None, 0)
+
+
+@event.listens_for(Engine, "checkin")
+def clear_statement_timeout(dbapi_connection, connection_record):
+    connection_record.info.pop("statement_timeout", None)
+
+
+@event.listens_for(Engine, "handle_error")
+def cancelled_statement(context):
+    error = context.original_exception
+    if (
+        isinstance(error, sqlite3.OperationalError) and str(error) == "interrupted"
+    ) or (error.args and error.args[0] == MYSQL_QUERY_TIMEOUT):
+        raise StatementTimeout(retry_after=current_app.config["LIMITS_RETRY_AFTER"])
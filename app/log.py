@@ -0,0 +1,124 @@
+"""
+Non-blocking application logging.
+
+Requests only put their log records on an in-memory queue; a listener thread
+hands them to the real handlers (the log file or stdout, and error mail), so
+a slow disk or SMTP server never holds up a request. When the queue is full
+records are dropped and counted rather than waited on.
+
+Error mail is deduplicated: an error raised from the same place is mailed
+once per ``MAIL_ERRORS_INTERVAL``, and at most ``MAIL_ERRORS_LIMIT`` mails
+are sent per interval in all. The next mail about an error says how many
+like it were held back.
+"""
+import atexit
+import copy
+import queue
+import time
+import traceback
+from logging.handlers import QueueHandler, QueueListener, SMTPHandler
+from flask.logging import default_handler
+from app import metrics
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.inc("log_records_dropped_total")
+
+    def prepare(self, record):
+        # Keep exc_info for the handlers on the listener thread; the record
+        # never leaves the process, so it need not be picklable
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+class ErrorMailHandler(SMTPHandler):
+    def __init__(self, *args, interval=3600, limit=10, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.interval = interval
+        self.limit = limit
+        self.window_start = time.monotonic()
+        self.sent = 0
+        # Error key -> time it was last mailed
+        self.last_sent = {}
+        # Error key -> records held back since
+        self.held_back = {}
+
+    @staticmethod
+    def error_key(record):
+        """Where the error comes from: where its exception was raised, if any."""
+        if record.exc_info and record.exc_info[2] is not None:
+            frame = traceback.extract_tb(record.exc_info[2])[-1]
+            return (record.exc_info[0].__name__, frame.filename, frame.lineno)
+        return (record.levelname, record.pathname, record.lineno)
+
+    def emit(self, record):
+        now = time.monotonic()
+        if now - self.window_start >= self.interval:
+            self.window_start = now
+            self.sent = 0
+        key = self.error_key(record)
+        last = self.last_sent.get(key)
+        if (last is not None and now - last < self.interval) or self.sent >= self.limit:
+            self.held_back[key] = self.held_back.get(key, 0) + 1
+            return
+        self.last_sent[key] = now
+        self.sent += 1
+        held_back = self.held_back.pop(key, 0)
+        if held_back:
+            record = copy.copy(record)
+            record.held_back = held_back
+        super().emit(record)
+
+    def getSubject(self, record):
+        held_back = getattr(record, "held_back", 0)
+        if held_back:
+            return f"{self.subject} (and {held_back} more like it)"
+        return self.subject
+
+
+def init_app(app, handlers):
+    """Send ``app.logger``'s records to ``handlers`` through a queue."""
+    queue_handler = NonBlockingQueueHandler(queue.Queue(app.config["LOG_QUEUE_SIZE"]))
+    # Flask's own handler would write to stderr on the request's thread
+    app.logger.removeHandler(default_handler)
+    app.logger.addHandler(queue_handler)
+    app.extensions["log_queue"] = (queue_handler, handlers)
+    start(app)
+    # Tests stop the listener themselves
+    if not app.testing:
+        atexit.register(stop, app)
+
+
+def start(app):
+    queue_handler, handlers = app.extensions["log_queue"]
+    listener = QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    listener.start()
+    app.extensions["log_listener"] = listener
+
+
+def after_fork(app):
+    """Start a listener in a forked worker, which inherits no threads."""
+    if "log_queue" not in app.extensions:
+        return
+    queue_handler, _ = app.extensions["log_queue"]
+    # The parent's queue may have been locked by its listener when it forked
+    queue_handler.queue = queue.Queue(queue_handler.queue.maxsize)
+    start(app)
+
+
+def stop(app):
+    """Write out the queued records and stop the listener."""
+    listener = app.extensions.pop("log_listener", None)
+    if listener is not None:
+        listener.stop()
+
+
+metrics.describe(
+    "log_records_dropped_total", "counter", "Log records dropped as the queue was full"
+)
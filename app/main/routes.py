@@ -1,4 +1,8 @@
-from flask import redirect, url_for
+import hmac
+from flask import current_app, redirect, url_for
+from app import metrics
+from app.api.auth import token_auth
+from app.api.errors import error_response
 from app.main import bp
 
 
@@ -6,3 +10,22 @@ from app.main import bp
 @bp.route("/index", methods=["GET"])
 def index():
     return redirect("/api/docs")
+
+
+@bp.route("/metrics", methods=["GET"])
+def get_metrics():
+    # Scrapers send METRICS_TOKEN as a bearer token; admins may use their own
+    auth = token_auth.get_auth()
+    token = getattr(auth, "token", None)
+    if token is None:
+        return error_response(401)
+    configured = current_app.config["METRICS_TOKEN"]
+    if not (configured and hmac.compare_digest(token, configured)):
+        user = token_auth.authenticate(auth, None)
+        if not user:
+            return error_response(401)
+        if not user.is_admin:
+            return error_response(403)
+    return current_app.response_class(
+        metrics.render(), mimetype="text/plain; version=0.0.4"
+    )
@@ -0,0 +1,383 @@
+"""
+Application metrics, served in the Prometheus text format at ``/metrics``.
+
+Each process keeps its metrics in memory, and in gunicorn workers a
+background thread writes a snapshot of them to the worker's own file in
+``METRICS_DIR`` every ``METRICS_FLUSH_INTERVAL`` seconds, so the worker that
+serves ``/metrics`` can add up those of every worker on the host. Snapshots
+of workers that have exited are folded into an archive file, so their counts
+are kept. Histograms share one set of latency buckets; gauges are read from
+registered collectors when a snapshot is taken and are summed across workers
+like everything else.
+"""
+import bisect
+import fcntl
+import json
+import os
+import threading
+import time
+from flask import current_app, g, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Upper bounds of the histogram buckets, in seconds
+BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+# Metric name -> (type, help text)
+METRICS = {}
+# Callables returning (name, labels, value) gauge samples at snapshot time
+COLLECTORS = []
+
+_lock = threading.Lock()
+# (name, labels) -> bucket counts (the last one for +Inf) followed by the sum
+_histograms = {}
+# (name, labels) -> value
+_counters = {}
+# (endpoint, method, status) -> request counts by duration bucket (the last
+# one for +Inf), then the sum of durations, response bytes, SQL statements
+# and SQL seconds; expanded into labelled series when a snapshot is taken
+_requests = {}
+# The app whose metrics the flusher thread writes, and the pid it runs in
+_flusher = {"app": None, "pid": None}
+
+
+def describe(name, kind, help):
+    METRICS[name] = (kind, help)
+
+
+def collector(fn):
+    COLLECTORS.append(fn)
+    return fn
+
+
+def _observe(key, value):
+    bucket = bisect.bisect_left(BUCKETS, value)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [0] * (len(BUCKETS) + 1) + [0.0]
+        histogram[bucket] += 1
+        histogram[-1] += value
+
+
+def _inc(key, amount):
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def observe(name, value, **labels):
+    """Record ``value`` in the histogram ``name``."""
+    _observe((name, tuple(sorted(labels.items()))), value)
+
+
+def inc(name, amount=1, **labels):
+    """Add ``amount`` to the counter ``name``."""
+    _inc((name, tuple(sorted(labels.items()))), amount)
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+        _requests.clear()
+
+
+#
+# Aggregation across processes
+#
+def request_series():
+    """The per-request series as {(name, labels): value} dicts."""
+    counters = {}
+    histograms = {}
+    with _lock:
+        requests = [(key, list(values)) for key, values in _requests.items()]
+    for (endpoint, method, status), values in requests:
+        labels = (("endpoint", endpoint or "unmatched"), ("method", method))
+        buckets = values[: len(BUCKETS) + 1]
+        counters[("http_requests_total", labels + (("status", status),))] = sum(buckets)
+        histogram = histograms.get(("http_request_duration_seconds", labels))
+        histograms[("http_request_duration_seconds", labels)] = (
+            [a + b for a, b in zip(histogram, buckets + values[-4:-3])]
+            if histogram
+            else buckets + values[-4:-3]
+        )
+        for name, value in zip(
+            ("http_response_bytes_total", "sql_statements_total", "sql_seconds_total"),
+            values[-3:],
+        ):
+            if value:
+                counters[(name, labels)] = counters.get((name, labels), 0) + value
+    return counters, histograms
+
+
+def snapshot():
+    """This process's metrics as a json-serializable dict."""
+    counters, histograms = request_series()
+    with _lock:
+        counters.update(_counters)
+        histograms.update((key, list(values)) for key, values in _histograms.items())
+    gauges = [
+        [name, sorted(labels.items()), value]
+        for fn in COLLECTORS
+        for name, labels, value in fn()
+    ]
+    return {
+        "counters": [
+            [name, labels, value] for (name, labels), value in counters.items()
+        ],
+        "histograms": [
+            [name, labels, values] for (name, labels), values in histograms.items()
+        ],
+        "gauges": gauges,
+    }
+
+
+def merge(totals, data):
+    """Add a snapshot into ``totals``, a dict of kind -> {(name, labels): value}."""
+    for kind in ("counters", "histograms", "gauges"):
+        series = totals.setdefault(kind, {})
+        for name, labels, value in data.get(kind, ()):
+            key = (name, tuple(tuple(label) for label in labels))
+            if kind == "histograms":
+                current = series.get(key)
+                series[key] = (
+                    [a + b for a, b in zip(current, value)] if current else list(value)
+                )
+            else:
+                series[key] = series.get(key, 0) + value
+    return totals
+
+
+def read_snapshot(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def write_snapshot(path, data):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f, separators=(",", ":"))
+    os.replace(tmp, path)
+
+
+def flush():
+    """Write this process's snapshot for the worker serving /metrics."""
+    directory = current_app.config["METRICS_DIR"]
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        write_snapshot(os.path.join(directory, f"{os.getpid()}.json"), snapshot())
+
+
+def start_flusher(app):
+    """
+    Flush the app's metrics every METRICS_FLUSH_INTERVAL from a background
+    thread, one per process. Started in gunicorn workers only, so a preloading
+    master does not add its idle pool's gauges to theirs.
+    """
+    if not app.config["METRICS_DIR"]:
+        return
+    with _lock:
+        _flusher["app"] = app
+        if _flusher["pid"] == os.getpid():
+            return
+        _flusher["pid"] = os.getpid()
+    threading.Thread(target=_flush_forever, name="metrics-flusher", daemon=True).start()
+
+
+def _flush_forever():
+    pid = os.getpid()
+    while _flusher["pid"] == pid:
+        app = _flusher["app"]
+        time.sleep(app.config["METRICS_FLUSH_INTERVAL"])
+        try:
+            with app.app_context():
+                flush()
+        except Exception:
+            app.logger.exception("Could not flush metrics")
+
+
+def _reset_in_child():
+    # The parent's threads are gone, and one may have held the lock
+    global _lock
+    _lock = threading.Lock()
+    _flusher["pid"] = None
+
+
+os.register_at_fork(after_in_child=_reset_in_child)
+
+
+def alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def archive_exited(directory):
+    """Fold the snapshots of processes that have exited into the archive."""
+    archive_path = os.path.join(directory, "archive.json")
+    with open(os.path.join(directory, "archive.lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        exited = [
+            name
+            for name in os.listdir(directory)
+            if name.endswith(".json")
+            and name[:-5].isdigit()
+            and not alive(int(name[:-5]))
+        ]
+        if not exited:
+            return
+        totals = merge({}, read_snapshot(archive_path) or {})
+        for name in exited:
+            data = read_snapshot(os.path.join(directory, name)) or {}
+            # The gauges of an exited process no longer hold
+            data.pop("gauges", None)
+            merge(totals, data)
+        write_snapshot(
+            archive_path,
+            {
+                kind: [
+                    [name, labels, value] for (name, labels), value in series.items()
+                ]
+                for kind, series in totals.items()
+            },
+        )
+        for name in exited:
+            os.remove(os.path.join(directory, name))
+
+
+def aggregate():
+    """The metrics of every worker on the host, merged."""
+    totals = merge({}, snapshot())
+    directory = current_app.config["METRICS_DIR"]
+    if directory and os.path.isdir(directory):
+        archive_exited(directory)
+        own = f"{os.getpid()}.json"
+        for name in os.listdir(directory):
+            if name.endswith(".json") and name != own:
+                merge(totals, read_snapshot(os.path.join(directory, name)) or {})
+    return totals
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"'))
+        for k, v in labels
+    )
+    return "{" + pairs + "}"
+
+
+def render():
+    """The metrics of every worker in the Prometheus text exposition format."""
+    totals = aggregate()
+    # Family name -> (type, samples)
+    families = {}
+    for kind, type in [("counters", "counter"), ("gauges", "gauge")]:
+        for (name, labels), value in totals.get(kind, {}).items():
+            families.setdefault(name, (type, []))[1].append((name, labels, value))
+    for (name, labels), histogram in totals.get("histograms", {}).items():
+        samples = families.setdefault(name, ("histogram", []))[1]
+        cumulative = 0
+        for bound, count in zip(BUCKETS + ("+Inf",), histogram):
+            cumulative += count
+            samples.append((name + "_bucket", labels + (("le", bound),), cumulative))
+        samples.append((name + "_sum", labels, histogram[-1]))
+        samples.append((name + "_count", labels, cumulative))
+    lines = []
+    for family, (type, samples) in sorted(families.items()):
+        lines.append(f"# HELP {family} {METRICS.get(family, (type, ''))[1]}")
+        lines.append(f"# TYPE {family} {type}")
+        for name, labels, value in samples:
+            lines.append(f"{name}{format_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+#
+# Request and SQL instrumentation
+#
+def init_app(app):
+    if app.config["REQUEST_METRICS"]:
+        app.before_request(start_request)
+        app.after_request(record_request)
+
+
+def start_request():
+    # Sub-requests of a batch count towards the batch
+    values = g._get_current_object().__dict__
+    if not values.get("batch"):
+        values["request_start"] = time.perf_counter()
+        values["sql"] = [0, 0.0]
+
+
+def record_request(response):
+    # Runs on every request: adds to the series of the request's endpoint,
+    # method and status under the lock. Labels are built when a snapshot is
+    # taken, and snapshots are written by the flusher thread.
+    values = g._get_current_object().__dict__
+    if values.get("batch"):
+        return response
+    start = values.pop("request_start", None)
+    if start is None:
+        return response
+    elapsed = time.perf_counter() - start
+    statements, sql_seconds = values["sql"]
+    req = request._get_current_object()
+    key = (req.endpoint, req.method, response.status_code)
+    # Set for buffered bodies; streamed ones are not counted
+    length = int(response.headers.get("Content-Length") or 0)
+    bucket = bisect.bisect_left(BUCKETS, elapsed)
+    with _lock:
+        series = _requests.get(key)
+        if series is None:
+            series = _requests[key] = [0] * (len(BUCKETS) + 1) + [0.0, 0, 0, 0.0]
+        series[bucket] += 1
+        series[-4] += elapsed
+        series[-3] += length
+        series[-2] += statements
+        series[-1] += sql_seconds
+    return response
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def start_statement(conn, cursor, statement, parameters, context, executemany):
+    conn.info["statement_start"] = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def end_statement(conn, cursor, statement, parameters, context, executemany):
+    if has_app_context():
+        sql = g.get("sql")
+        if sql is not None:
+            sql[0] += 1
+            sql[1] += time.perf_counter() - conn.info["statement_start"]
+
+
+describe("http_requests_total", "counter", "Requests by endpoint, method and status")
+describe("http_request_duration_seconds", "histogram", "Time to handle a request")
+describe("http_response_bytes_total", "counter", "Bytes of response bodies")
+describe("sql_statements_total", "counter", "SQL statements run by requests")
+describe("sql_seconds_total", "counter", "Time requests spent in SQL statements")
+describe("cache_requests_total", "counter", "Cache lookups by cache and result")
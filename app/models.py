@@ -5,12 +5,14 @@ from time import time
 from flask import current_app, url_for
 from flask_login import UserMixin, AnonymousUserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy import event
 from sqlalchemy.sql import func
 
 # from sqlalchemy.ext.associationproxy import association_proxy
 from sqlalchemy.ext.declarative import DeclarativeMeta
 from sqlalchemy.dialects.mysql import TINYINT
 from operator import itemgetter
+import operator
 import jwt
 import json
 import os
@@ -18,14 +20,131 @@ import base64
 from app import db, login
 
 
+def parse_timestamp(value):
+    """
+    Parse an ISO-8601 timestamp with ``datetime.fromisoformat``, falling back
+    to dateutil for anything else it accepts. Datetimes pass through.
+    """
+    if isinstance(value, datetime):
+        return value
+    if value.endswith("Z"):
+        value = value[:-1] + "+00:00"
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return parser.parse(value)
+
+
 class AuditMixin(object):
     created_at = db.Column(db.DateTime(timezone=True), default=func.now(), index=True)
     modified_at = db.Column(
         db.DateTime(timezone=True), default=func.now(), onupdate=func.now(), index=True
     )
 
+    # Fields copied by from_dict as given, and timestamp fields it parses.
+    # Absent timestamps are left to the column defaults.
+    __fields__ = ()
+    __timestamps__ = ("created_at", "modified_at")
+
+    def from_dict(self, data):
+        for field in self.__fields__:
+            if field in data:
+                setattr(self, field, data[field])
+        for field in self.__timestamps__:
+            if data.get(field) is not None:
+                setattr(self, field, parse_timestamp(data[field]))
+
+
+# Comparison operators usable in collection filters, keyed by argument suffix
+FILTER_OPERATORS = {
+    "eq": operator.eq,
+    "gt": operator.gt,
+    "gte": operator.ge,
+    "lte": operator.le,
+}
+
+
+def counter_filters(*counters):
+    """Build ``<counter>_gt`` filters for the tactic count columns."""
+    return {f"{counter}_gt": (counter, "gt") for counter in counters}
+
 
 class PaginatedAPIMixin(object):
+    # Query arguments handled by the collection endpoints rather than as filters
+    RESERVED_ARGS = ("page", "per_page", "expand")
+
+    # Filter allowlist: argument name -> (attribute path, operator). Paths of
+    # the form "relationship.column" filter through a relationship EXISTS.
+    __filters__ = {}
+    # Attributes a collection may be sorted by
+    __sortable__ = ()
+
+    @classmethod
+    def parse_filters(cls, args):
+        """
+        Validate collection query arguments against the filter and sort
+        allowlists. Returns a dict of argument name -> parsed value that can
+        be passed to filter_query and carried forward in pagination links.
+        Raises ValueError on unknown arguments or malformed values.
+        """
+        filters = {}
+        for name, value in args.items():
+            if name in cls.RESERVED_ARGS or name.startswith("_"):
+                continue
+            if name == "sort":
+                for key in value.split(","):
+                    if key.lstrip("-") not in cls.__sortable__:
+                        raise ValueError(
+                            f"cannot sort by {key.lstrip('-')}; sortable fields are "
+                            f"{', '.join(cls.__sortable__)}."
+                        )
+                filters[name] = value
+                continue
+            if name not in cls.__filters__:
+                raise ValueError(
+                    f"unknown filter {name}; filterable fields are "
+                    f"{', '.join(cls.__filters__) or 'none'}."
+                )
+            column = cls._filter_column(cls.__filters__[name][0])
+            try:
+                filters[name] = column.type.python_type(value)
+            except ValueError:
+                raise ValueError(
+                    f"filter {name} expects a value of type "
+                    f"{column.type.python_type.__name__}."
+                )
+        return filters
+
+    @classmethod
+    def _filter_column(cls, path):
+        model = cls
+        *relationships, column = path.split(".")
+        for relationship in relationships:
+            model = getattr(model, relationship).property.mapper.class_
+        return getattr(model, column)
+
+    @classmethod
+    def filter_query(cls, query, filters):
+        """Apply parsed filters and sort order to ``query``."""
+        for name, value in filters.items():
+            if name == "sort":
+                continue
+            path, op = cls.__filters__[name]
+            relationship, _, column = path.rpartition(".")
+            if relationship:
+                criterion = FILTER_OPERATORS[op](cls._filter_column(path), value)
+                query = query.filter(getattr(cls, relationship).has(criterion))
+            else:
+                query = query.filter(FILTER_OPERATORS[op](getattr(cls, column), value))
+        order_by = []
+        for key in filters.get("sort", "").split(","):
+            if key:
+                column = getattr(cls, key.lstrip("-"))
+                order_by.append(column.desc() if key.startswith("-") else column)
+        # Always end with the primary key so pages are stable
+        order_by.extend(cls.__mapper__.primary_key)
+        return query.order_by(*order_by)
+
     @staticmethod
     def to_collection_dict(query, page, per_page, schema, endpoint, **kwargs):
         resources = query.paginate(page, per_page, False)
@@ -61,7 +180,7 @@ class ViolentTactics(db.Model, AuditMixin, PaginatedAPIMixin):
         db.ForeignKey("organizations.facId"),
         index=True,
     )
-    year = db.Column(db.Integer)
+    year = db.Column(db.Integer, index=True)
     againstState = db.Column(db.Integer, nullable=False, default=0)
     againstStateFatal = db.Column(db.Integer, nullable=False, default=0)
     againstOrg = db.Column(db.Integer, nullable=False, default=0)
@@ -71,13 +190,13 @@ class ViolentTactics(db.Model, AuditMixin, PaginatedAPIMixin):
     againstOutgroup = db.Column(db.Integer, nullable=False, default=0)
     againstOutgroupFatal = db.Column(db.Integer, nullable=False, default=0)
 
-    def __repr__(self):
-        return f"<Violent Tactics - org: {self.organization}, facId: {self.facId}, year: {self.year}>"
-
-    def from_dict(self, data):
-        for field in [
-            "facId",
-            "year",
+    __filters__ = {
+        "facId": ("facId", "eq"),
+        "kgcId": ("organization.kgcId", "eq"),
+        "year": ("year", "eq"),
+        "year_gte": ("year", "gte"),
+        "year_lte": ("year", "lte"),
+        **counter_filters(
             "againstState",
             "againstStateFatal",
             "againstOrg",
@@ -86,15 +205,24 @@ class ViolentTactics(db.Model, AuditMixin, PaginatedAPIMixin):
             "againstIngroupFatal",
             "againstOutgroup",
             "againstOutgroupFatal",
-        ]:
-            if field in data and field is not None:
-                setattr(self, field, data[field])
-        for field in ["created_at", "modified_at"]:
-            if field in data:
-                dtime_obj = parser.parse(data[field])
-                setattr(self, field, dtime_obj)
-            else:
-                setattr(self, field, func.now())
+        ),
+    }
+    __fields__ = (
+        "facId",
+        "year",
+        "againstState",
+        "againstStateFatal",
+        "againstOrg",
+        "againstOrgFatal",
+        "againstIngroup",
+        "againstIngroupFatal",
+        "againstOutgroup",
+        "againstOutgroupFatal",
+    )
+    __sortable__ = ("id", "facId", "year")
+
+    def __repr__(self):
+        return f"<Violent Tactics - org: {self.organization}, facId: {self.facId}, year: {self.year}>"
 
 
 class NonviolentTactics(db.Model, AuditMixin, PaginatedAPIMixin):
@@ -104,7 +232,7 @@ class NonviolentTactics(db.Model, AuditMixin, PaginatedAPIMixin):
     facId = db.Column(
         "facId", db.Integer, db.ForeignKey("organizations.facId"), index=True
     )
-    year = db.Column(db.Integer)
+    year = db.Column(db.Integer, index=True)
     economicNoncooperation = db.Column(db.Integer, nullable=False, default=0)
     protestDemonstration = db.Column(db.Integer, nullable=False, default=0)
     nonviolentIntervention = db.Column(db.Integer, nullable=False, default=0)
@@ -112,28 +240,35 @@ class NonviolentTactics(db.Model, AuditMixin, PaginatedAPIMixin):
     institutionalAction = db.Column(db.Integer, nullable=False, default=0)
     politicalNoncooperation = db.Column(db.Integer, nullable=False, default=0)
 
-    def __repr__(self):
-        return f"<Nonviolent Tactics - org: {self.organization}, facId: {self.facId}, year: {self.year}>"
-
-    def from_dict(self, data):
-        for field in [
-            "facId",
-            "year",
+    __filters__ = {
+        "facId": ("facId", "eq"),
+        "kgcId": ("organization.kgcId", "eq"),
+        "year": ("year", "eq"),
+        "year_gte": ("year", "gte"),
+        "year_lte": ("year", "lte"),
+        **counter_filters(
             "economicNoncooperation",
             "protestDemonstration",
             "nonviolentIntervention",
             "socialNoncooperation",
             "institutionalAction",
             "politicalNoncooperation",
-        ]:
-            if field in data and field is not None:
-                setattr(self, field, data[field])
-        for field in ["created_at", "modified_at"]:
-            if field in data:
-                dtime_obj = parser.parse(data[field])
-                setattr(self, field, dtime_obj)
-            else:
-                setattr(self, field, func.now())
+        ),
+    }
+    __fields__ = (
+        "facId",
+        "year",
+        "economicNoncooperation",
+        "protestDemonstration",
+        "nonviolentIntervention",
+        "socialNoncooperation",
+        "institutionalAction",
+        "politicalNoncooperation",
+    )
+    __sortable__ = ("id", "facId", "year")
+
+    def __repr__(self):
+        return f"<Nonviolent Tactics - org: {self.organization}, facId: {self.facId}, year: {self.year}>"
 
 
 class Groups(db.Model, AuditMixin, PaginatedAPIMixin):
@@ -141,32 +276,28 @@ class Groups(db.Model, AuditMixin, PaginatedAPIMixin):
 
     kgcId = db.Column(db.Integer, primary_key=True)
     groupName = db.Column(db.String(255), index=True, nullable=False)
-    country = db.Column(db.String(255), nullable=False)
-    organizations = db.relationship("Organizations", backref="Group", lazy="dynamic")
+    country = db.Column(db.String(255), index=True, nullable=False)
+    organizations = db.relationship("Organizations", backref="Group", lazy="select")
     startYear = db.Column(db.Integer, nullable=True)
     endYear = db.Column(db.Integer, nullable=True)
 
+    __filters__ = {
+        "kgcId": ("kgcId", "eq"),
+        "country": ("country", "eq"),
+    }
+    __fields__ = ("kgcId", "groupName", "country", "startYear", "endYear")
+    __sortable__ = ("kgcId", "groupName", "country")
+
     def __repr__(self):
         return f"<Group: {self.groupName}, kgcId: {self.kgcId}>"
 
-    def from_dict(self, data):
-        for field in ["kgcId", "groupName", "country", "startYear", "endYear"]:
-            if field in data and field is not None:
-                setattr(self, field, data[field])
-        for field in ["created_at", "modified_at"]:
-            if field in data:
-                dtime_obj = parser.parse(data[field])
-                setattr(self, field, dtime_obj)
-            else:
-                setattr(self, field, func.current_timestamp())
-
 
 class Organizations(db.Model, AuditMixin, PaginatedAPIMixin):
     __tablename__ = "organizations"
 
     facId = db.Column(db.Integer, nullable=False, unique=True, primary_key=True)
     kgcId = db.Column(
-        db.Integer, db.ForeignKey("groups.kgcId")
+        db.Integer, db.ForeignKey("groups.kgcId"), index=True
     )  # Might not be necessary if we can indirectly ref via the group backref
     facName = db.Column(db.String(767), nullable=False)
     startYear = db.Column(db.Integer, nullable=True)
@@ -175,30 +306,117 @@ class Organizations(db.Model, AuditMixin, PaginatedAPIMixin):
         "NonviolentTactics",
         foreign_keys=[NonviolentTactics.facId],
         backref=db.backref("organization", lazy="joined"),
-        lazy="dynamic",
+        lazy="select",
         cascade="all, delete-orphan",
     )
     violentTactics = db.relationship(
         "ViolentTactics",
         foreign_keys=[ViolentTactics.facId],
         backref=db.backref("organization", lazy="joined"),
-        lazy="dynamic",
+        lazy="select",
         cascade="all, delete-orphan",
     )
 
+    __filters__ = {
+        "facId": ("facId", "eq"),
+        "kgcId": ("kgcId", "eq"),
+        "country": ("Group.country", "eq"),
+    }
+    __fields__ = ("facId", "kgcId", "facName", "startYear", "endYear")
+    __sortable__ = ("facId", "kgcId")
+
     def __repr__(self):
         return f"<Organization: {self.facName}, facId: {self.facId}>"
 
-    def from_dict(self, data):
-        for field in ["facId", "kgcId", "facName", "startYear", "endYear"]:
-            if field in data and field is not None:
-                setattr(self, field, data[field])
-        for field in ["created_at", "modified_at"]:
-            if field in data:
-                dtime_obj = parser.parse(data[field])
-                setattr(self, field, dtime_obj)
-            else:
-                setattr(self, field, func.now())
+
+class Tombstone(db.Model):
+    """Record of a deleted data row, used to publish deletions in the change feed."""
+
+    __tablename__ = "tombstones"
+
+    id = db.Column(db.Integer, primary_key=True)
+    tableName = db.Column(db.String(64), nullable=False)
+    rowId = db.Column(db.Integer, nullable=False)
+    deleted_at = db.Column(db.DateTime(timezone=True), default=func.now(), index=True)
+
+    def __repr__(self):
+        return f"<Tombstone - table: {self.tableName}, rowId: {self.rowId}>"
+
+
+def record_tombstone(mapper, connection, target):
+    connection.execute(
+        Tombstone.__table__.insert().values(
+            tableName=mapper.local_table.name,
+            rowId=mapper.primary_key_from_instance(target)[0],
+            deleted_at=func.now(),
+        )
+    )
+
+
+for model in [Groups, Organizations, ViolentTactics, NonviolentTactics]:
+    event.listen(model, "after_delete", record_tombstone)
+
+
+class FeedHold(db.Model):
+    """
+    Start of a long write transaction that is still running. The change feed
+    does not move past it, since the rows the transaction stamps now only
+    become visible when it commits.
+    """
+
+    __tablename__ = "feed_holds"
+
+    id = db.Column(db.Integer, primary_key=True)
+    started_at = db.Column(db.DateTime(timezone=True), default=func.now(), index=True)
+
+    def __repr__(self):
+        return f"<FeedHold - started: {self.started_at}>"
+
+
+class IdempotencyKey(db.Model):
+    """
+    Response stored for a create request sent with an ``Idempotency-Key``
+    header. A null status marks a request that is still being processed.
+    """
+
+    __tablename__ = "idempotency_keys"
+    __table_args__ = (db.UniqueConstraint("scope", "key"),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    scope = db.Column(db.String(64), nullable=False)
+    key = db.Column(db.String(255), nullable=False)
+    fingerprint = db.Column(db.String(64), nullable=False)
+    status = db.Column(db.Integer)
+    body = db.Column(db.Text(16777215))
+    location = db.Column(db.String(255))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+    def __repr__(self):
+        return f"<IdempotencyKey - scope: {self.scope}, key: {self.key}>"
+
+
+class Job(PaginatedAPIMixin, db.Model):
+    """Unit of background work, run by the ``flask jobs-worker`` processes."""
+
+    __tablename__ = "jobs"
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(64), nullable=False)
+    status = db.Column(db.String(16), default="queued", nullable=False, index=True)
+    params = db.Column(db.Text)
+    result = db.Column(db.Text(16777215))
+    error = db.Column(db.Text)
+    done = db.Column(db.Integer, default=0)
+    total = db.Column(db.Integer)
+    userId = db.Column(db.Integer, db.ForeignKey("user.id"), index=True)
+    worker = db.Column(db.String(128))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    heartbeat_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return f"<Job {self.id} - kind: {self.kind}, status: {self.status}>"
 
 
 class User(UserMixin, PaginatedAPIMixin, AuditMixin, db.Model):
@@ -213,6 +431,9 @@ class User(UserMixin, PaginatedAPIMixin, AuditMixin, db.Model):
     token_expiration = db.Column(db.DateTime)
     is_admin = db.Column(db.Boolean, default=False)
 
+    __fields__ = ("id", "username", "name", "email", "about_me")
+    __timestamps__ = ("last_seen", "created_at", "modified_at")
+
     def __init__(self, **kwargs):
         super(User, self).__init__(**kwargs)
         if self.email and self.email in current_app.config["ADMIN_EMAIL"]:
@@ -245,17 +466,7 @@ class User(UserMixin, PaginatedAPIMixin, AuditMixin, db.Model):
         return User.query.get(id)
 
     def from_dict(self, data, new_user=False):
-        if "id" in data:
-            setattr(self, "id", data["id"])
-        for field in ["username", "name", "email", "about_me"]:
-            if field in data and field is not None:
-                setattr(self, field, data[field])
-        for field in ["last_seen", "created_at", "modified_at"]:
-            if field in data:
-                dtime_obj = parser.parse(data[field])
-                setattr(self, field, dtime_obj)
-            else:
-                setattr(self, field, func.now())
+        super().from_dict(data)
         if new_user:
             if "password" in data:
                 self.set_password(data["password"])
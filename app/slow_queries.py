@@ -0,0 +1,136 @@
+"""
+Slow-query log.
+
+SQL statements that take longer than ``SLOW_QUERY_SECONDS`` are written as
+JSON lines to ``SLOW_QUERY_LOG``, a rotating file (or stdout with
+``LOG_TO_STDOUT``), with the endpoint that ran them, the shape of their
+bound parameters (their types, not their values) and, for reads, updates
+and deletes on MySQL and SQLite, the database's EXPLAIN of the statement.
+Plans are captured once per ``SLOW_QUERY_EXPLAIN_INTERVAL`` for statements
+of the same shape and repeated in the entries in between.
+"""
+import json
+import logging
+import os
+import re
+import threading
+from datetime import datetime, timezone
+from logging.handlers import RotatingFileHandler
+from time import monotonic, perf_counter
+from flask import current_app, has_app_context, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Statements the databases can EXPLAIN without running them
+EXPLAINABLE = ("SELECT", "WITH", "UPDATE", "DELETE")
+# Lists of placeholders, such as those of an expanded IN, of any length
+PLACEHOLDER_LIST = re.compile(
+    r"\((?:\s*(?:\?|%s|%\(\w+\)s)\s*,)+\s*(?:\?|%s|%\(\w+\)s)\s*\)"
+)
+# Normalized statements whose plans are kept
+MAX_PLANS = 1000
+
+_lock = threading.Lock()
+# Normalized statement -> (time explained, plan or error)
+_plans = {}
+
+
+def init_app(app):
+    logger = logging.Logger("slow_queries")
+    logger.propagate = False
+    if app.config["LOG_TO_STDOUT"] and not os.environ.get("SLOW_QUERY_LOG"):
+        handler = logging.StreamHandler()
+    else:
+        path = app.config["SLOW_QUERY_LOG"]
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        handler = RotatingFileHandler(
+            path,
+            maxBytes=app.config["SLOW_QUERY_LOG_MAX_BYTES"],
+            backupCount=app.config["SLOW_QUERY_LOG_BACKUPS"],
+            delay=True,
+        )
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    app.extensions["slow_queries"] = logger
+
+
+def parameter_shape(parameters):
+    """The types of bound parameters, which unlike their values are safe to log."""
+    if isinstance(parameters, dict):
+        return {key: type(value).__name__ for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [parameter_shape(value) for value in parameters]
+    return type(parameters).__name__
+
+
+def explain(conn, statement, parameters):
+    """The database's plan for ``statement`` as a list of row dicts, or None."""
+    dialect = conn.dialect.name
+    if dialect == "sqlite":
+        sql = "EXPLAIN QUERY PLAN " + statement
+    elif dialect == "mysql":
+        sql = "EXPLAIN " + statement
+    else:
+        return None
+    # A cursor of its own, so the statement's results are left alone
+    cursor = conn.connection.dbapi_connection.cursor()
+    try:
+        cursor.execute(sql, parameters)
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+
+def normalize(statement):
+    """The statement with whitespace collapsed and placeholder lists shortened."""
+    return PLACEHOLDER_LIST.sub("(?)", " ".join(statement.split()))
+
+
+def cached_plan(conn, statement, parameters):
+    """
+    The plan of ``statement``, explained at most once per
+    ``SLOW_QUERY_EXPLAIN_INTERVAL`` for statements of the same shape, so a
+    slow database is not sent an EXPLAIN for every slow statement.
+    """
+    key = normalize(statement)
+    now = monotonic()
+    with _lock:
+        cached = _plans.get(key)
+    if cached and now - cached[0] < current_app.config["SLOW_QUERY_EXPLAIN_INTERVAL"]:
+        return cached[1]
+    try:
+        plan = {"explain": explain(conn, statement, parameters)}
+    except Exception as e:
+        plan = {"explain_error": str(e)}
+    with _lock:
+        if len(_plans) >= MAX_PLANS:
+            _plans.clear()
+        _plans[key] = (now, plan)
+    return plan
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def log_slow_statement(conn, cursor, statement, parameters, context, executemany):
+    if not has_app_context():
+        return
+    # Timed from the clock started by the metrics listener
+    seconds = perf_counter() - conn.info["statement_start"]
+    logger = current_app.extensions.get("slow_queries")
+    if logger is None or seconds < current_app.config["SLOW_QUERY_SECONDS"]:
+        return
+    entry = {
+        "time": datetime.now(timezone.utc).isoformat(),
+        "seconds": round(seconds, 6),
+        "endpoint": request.endpoint if has_request_context() else None,
+        "method": request.method if has_request_context() else None,
+        "database": conn.dialect.name,
+        "statement": statement,
+        "parameters": parameter_shape(
+            parameters[0] if executemany and parameters else parameters
+        ),
+        "executemany": len(parameters) if executemany else None,
+    }
+    if not executemany and statement.lstrip().upper().startswith(EXPLAINABLE):
+        entry.update(cached_plan(conn, statement, parameters))
+    logger.warning(json.dumps(entry, default=str))
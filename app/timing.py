@@ -0,0 +1,118 @@
+"""
+Per-request timings, sent in a ``Server-Timing`` header.
+
+A request's time is broken into ``auth`` (verifying its credentials), ``db``
+(running SQL statements, counted by the metrics listeners), ``serialize``
+(dumping schemas and encoding JSON) and ``total``. The parts overlap where
+one runs inside another, e.g. the statements that load a user while
+verifying a token count towards both ``auth`` and ``db``.
+
+In debug mode, requests that run more than ``QUERY_BUDGET`` statements are
+logged with the statements they repeat most, to find N+1 queries.
+"""
+import time
+from collections import Counter
+from contextlib import contextmanager
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+try:
+    from flask.json.provider import DefaultJSONProvider
+except ImportError:  # Flask < 2.2 encodes with app.json_encoder
+    from flask.json import JSONEncoder
+
+    DefaultJSONProvider = None
+
+
+@contextmanager
+def timed(name):
+    """Add the time spent in the block to the request's ``name`` timing."""
+    timings = g.get("timings") if has_request_context() else None
+    # Nested blocks, such as the dumps of nested schemas, are counted once
+    if timings is None or name in timings["running"]:
+        yield
+        return
+    timings["running"].add(name)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = timings.get(name, 0.0) + time.perf_counter() - start
+        timings["running"].discard(name)
+
+
+class TimedDump:
+    """Schema mixin counting dumps towards the ``serialize`` timing."""
+
+    def dump(self, obj, *, many=None):
+        with timed("serialize"):
+            return super().dump(obj, many=many)
+
+
+if DefaultJSONProvider is not None:
+
+    class TimedJSONProvider(DefaultJSONProvider):
+        def dumps(self, obj, **kwargs):
+            with timed("serialize"):
+                return super().dumps(obj, **kwargs)
+
+else:
+
+    class TimedJSONEncoder(JSONEncoder):
+        def encode(self, o):
+            with timed("serialize"):
+                return super().encode(o)
+
+
+def init_app(app):
+    """Register after ``metrics.init_app``, whose request clock and SQL counts it reads."""
+    if DefaultJSONProvider is not None:
+        app.json = TimedJSONProvider(app)
+    else:
+        app.json_encoder = TimedJSONEncoder
+    app.before_request(start_timings)
+    app.after_request(server_timing)
+
+
+def start_timings():
+    # Sub-requests of a batch count towards the batch
+    if not g.get("batch"):
+        g.timings = {"running": set()}
+        if current_app.debug:
+            g.statements = Counter()
+
+
+def server_timing(response):
+    if g.get("batch") or "request_start" not in g:
+        return response
+    total = time.perf_counter() - g.request_start
+    timings = g.pop("timings", {})
+    statements, sql_seconds = g.sql
+    parts = [
+        f"auth;dur={timings.get('auth', 0.0) * 1000:.1f}",
+        f'db;dur={sql_seconds * 1000:.1f};desc="{statements} statements"',
+        f"serialize;dur={timings.get('serialize', 0.0) * 1000:.1f}",
+        f"total;dur={total * 1000:.1f}",
+    ]
+    response.headers["Server-Timing"] = ", ".join(parts)
+    repeated = g.pop("statements", None)
+    if repeated is not None and statements > current_app.config["QUERY_BUDGET"]:
+        current_app.logger.warning(
+            "%s %s ran %d statements (budget %d) in %.1f ms; most repeated:\n%s",
+            request.method,
+            request.full_path,
+            statements,
+            current_app.config["QUERY_BUDGET"],
+            sql_seconds * 1000,
+            "\n".join(f"{n} x {sql}" for sql, n in repeated.most_common(3)),
+        )
+    return response
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def count_statement(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        repeated = g.get("statements")
+        if repeated is not None:
+            repeated[statement] += 1
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+"""
+Benchmark model hydration with ``from_dict``.
+
+Hydrates ``--rows`` violent tactics dicts (100k by default) with ISO-8601
+timestamps, without timestamps, and with timestamps in a format only dateutil
+understands, then optionally inserts the timestamp-free rows into an in-memory
+sqlite database to time the flush.
+
+    python benchmarks/hydrate.py --rows 100000 --insert
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+os.environ.setdefault("ADMIN_EMAILS", '"admin@example.com"')
+
+from app import create_app, db  # noqa: E402
+from app.models import ViolentTactics  # noqa: E402
+from config import Config  # noqa: E402
+
+
+class BenchConfig(Config):
+    SQLALCHEMY_DATABASE_URI = "sqlite://"
+    LOG_TO_STDOUT = True
+
+
+def rows(n, timestamps=None):
+    for i in range(n):
+        row = {
+            "facId": i // 30,
+            "year": 1970 + i % 30,
+            "againstState": i % 7,
+            "againstStateFatal": i % 3,
+            "againstOrg": 0,
+            "againstOrgFatal": 0,
+            "againstIngroup": 1,
+            "againstIngroupFatal": 0,
+            "againstOutgroup": 0,
+            "againstOutgroupFatal": 0,
+        }
+        if timestamps:
+            row["created_at"] = row["modified_at"] = timestamps
+        yield row
+
+
+def hydrate(data):
+    objects = []
+    for row in data:
+        vt = ViolentTactics()
+        vt.from_dict(row)
+        objects.append(vt)
+    return objects
+
+
+def timed(label, fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {elapsed:8.3f}s")
+    return result
+
+
+def main():
+    argp = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    argp.add_argument("--rows", type=int, default=100000)
+    argp.add_argument("--insert", action="store_true", help="also time the insert")
+    args = argp.parse_args()
+
+    app = create_app(BenchConfig)
+    with app.app_context():
+        iso = list(rows(args.rows, "2021-06-01T12:30:00Z"))
+        plain = list(rows(args.rows))
+        fallback = list(rows(args.rows, "June 1, 2021 12:30 PM"))
+        print(f"Hydrating {args.rows} rows")
+        timed("iso-8601 timestamps", hydrate, iso)
+        objects = timed("no timestamps", hydrate, plain)
+        timed("dateutil fallback", hydrate, fallback)
+        if args.insert:
+            db.create_all()
+            db.session.add_all(objects)
+            timed("insert (no timestamps)", db.session.commit)
+            db.drop_all()
+
+
+if __name__ == "__main__":
+    main()
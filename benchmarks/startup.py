@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+"""
+Benchmark worker startup.
+
+Reports the import time of the heaviest modules pulled in by ``srdp`` (from
+``python -X importtime``) and the time from interpreter start to the first
+response, with and without LAZY_EXTENSIONS. Each measurement runs in a fresh
+interpreter, as a restarted or recycled gunicorn worker would.
+
+    python benchmarks/startup.py --repeat 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+
+FIRST_REQUEST = """
+import json, time
+start = time.perf_counter()
+import srdp
+imported = time.perf_counter()
+response = srdp.app.test_client().get("/api/groups")
+served = time.perf_counter()
+print(json.dumps({"import": imported - start, "first_request": served - start}))
+"""
+
+
+def environ(lazy):
+    env = dict(os.environ)
+    env.setdefault("ADMIN_EMAILS", '"admin@example.com"')
+    env.setdefault("DATABASE_URL", "sqlite://")
+    env["LOG_TO_STDOUT"] = "1"
+    env.pop("FLASK_RUN_FROM_CLI", None)
+    if lazy:
+        env["LAZY_EXTENSIONS"] = "1"
+    else:
+        env.pop("LAZY_EXTENSIONS", None)
+    return env
+
+
+def import_times(lazy, depth):
+    """Cumulative import time in ms of modules up to ``depth`` levels deep."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import srdp"],
+        cwd=ROOT,
+        env=environ(lazy),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        level = (len(name) - len(name.lstrip())) // 2
+        if level <= depth:
+            times.append((int(cumulative) / 1000, level, name.strip()))
+    return sorted(times, reverse=True)
+
+
+def first_request(lazy):
+    result = subprocess.run(
+        [sys.executable, "-c", FIRST_REQUEST],
+        cwd=ROOT,
+        env=environ(lazy),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    argp = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    argp.add_argument("--repeat", type=int, default=5)
+    argp.add_argument("--top", type=int, default=15, help="modules to list")
+    argp.add_argument("--depth", type=int, default=3, help="import nesting shown")
+    args = argp.parse_args()
+
+    for lazy in (False, True):
+        mode = "lazy" if lazy else "eager"
+        print(f"\n== {mode} extensions ==")
+        for ms, level, name in import_times(lazy, args.depth)[: args.top]:
+            print(f"{ms:9.1f} ms  {'  ' * level}{name}")
+        runs = [first_request(lazy) for _ in range(args.repeat)]
+        for key in ("import", "first_request"):
+            median = statistics.median(run[key] for run in runs)
+            print(f"{key:<14} median {median * 1000:7.1f} ms over {args.repeat} runs")
+
+
+if __name__ == "__main__":
+    main()
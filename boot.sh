@@ -21,4 +21,5 @@ done
 # Create default admin
 flask create-admin
 
-exec gunicorn --workers 8 -b :5000 --access-logfile - --error-logfile - srdp:app
+# Workers, bind address and preloading are set in gunicorn.conf.py
+exec gunicorn srdp:app
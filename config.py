@@ -1,5 +1,6 @@
 import os
 import json
+import tempfile
 from dotenv import load_dotenv
 
 
@@ -20,19 +21,169 @@ class Config(object):
     # CORS
     CORS_HEADERS = "Content-Type"
 
+    # Set up migrations, flask-login and mail on first use rather than at
+    # startup, which shortens worker boot (see benchmarks/startup.py)
+    LAZY_EXTENSIONS = os.environ.get("LAZY_EXTENSIONS") is not None
+
     # Database
     SQLALCHEMY_DATABASE_URI = os.environ.get(
         "DATABASE_URL"
     ) or "sqlite:///" + os.path.join(basedir, "srdp.db")
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Connection pool. Connections are recycled before MySQL's wait_timeout
+    # closes them; size, overflow and checkout timeout keep SQLAlchemy's
+    # defaults unless set. Each gunicorn worker has its own pool, so the
+    # server sees up to workers * (size + overflow) connections.
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        "pool_pre_ping": os.environ.get("DB_POOL_PRE_PING") != "0",
+        "pool_recycle": int(os.environ.get("DB_POOL_RECYCLE") or 1800),
+        **{
+            option: int(os.environ[name])
+            for option, name in [
+                ("pool_size", "DB_POOL_SIZE"),
+                ("max_overflow", "DB_POOL_MAX_OVERFLOW"),
+                ("pool_timeout", "DB_POOL_TIMEOUT"),
+            ]
+            if os.environ.get(name)
+        },
+    }
+    # Optional read replica: GET requests to the API read the data tables
+    # from it. Keep CHANGE_FEED_SETTLE_SECONDS above the replication lag.
+    SQLALCHEMY_BINDS = (
+        {"replica": os.environ["DATABASE_REPLICA_URL"]}
+        if os.environ.get("DATABASE_REPLICA_URL")
+        else None
+    )
+
+    # Load shedding and statement timeouts for the four classes of API
+    # endpoint: reads (GET), writes, bulk endpoints (batch, sync and bulk
+    # collection updates and deletes) and event streams, which hold a worker
+    # for EVENTS_STREAM_TIMEOUT. At most _CONCURRENCY requests of a class run
+    # at once across the workers of a host. Up to _QUEUE more wait
+    # LIMITS_QUEUE_TIMEOUT seconds for a turn, and the rest get 503 with
+    # Retry-After. 0 turns a limit off. Statement timeouts cancel SELECTs on
+    # MySQL and any statement on SQLite.
+    READ_CONCURRENCY = int(os.environ.get("READ_CONCURRENCY") or 6)
+    READ_QUEUE = int(os.environ.get("READ_QUEUE") or 4)
+    READ_STATEMENT_TIMEOUT = float(os.environ.get("READ_STATEMENT_TIMEOUT") or 5)
+    WRITE_CONCURRENCY = int(os.environ.get("WRITE_CONCURRENCY") or 4)
+    WRITE_QUEUE = int(os.environ.get("WRITE_QUEUE") or 2)
+    WRITE_STATEMENT_TIMEOUT = float(os.environ.get("WRITE_STATEMENT_TIMEOUT") or 10)
+    BULK_CONCURRENCY = int(os.environ.get("BULK_CONCURRENCY") or 2)
+    BULK_QUEUE = int(os.environ.get("BULK_QUEUE") or 0)
+    BULK_STATEMENT_TIMEOUT = float(os.environ.get("BULK_STATEMENT_TIMEOUT") or 25)
+    STREAM_CONCURRENCY = int(os.environ.get("STREAM_CONCURRENCY") or 2)
+    STREAM_QUEUE = int(os.environ.get("STREAM_QUEUE") or 0)
+    STREAM_STATEMENT_TIMEOUT = float(os.environ.get("STREAM_STATEMENT_TIMEOUT") or 5)
+    LIMITS_QUEUE_TIMEOUT = float(os.environ.get("LIMITS_QUEUE_TIMEOUT") or 1)
+    LIMITS_RETRY_AFTER = int(os.environ.get("LIMITS_RETRY_AFTER") or 2)
+    # Lock files counting requests in flight; shared by the workers of a host
+    LIMITS_DIR = os.environ.get("LIMITS_DIR") or os.path.join(
+        tempfile.gettempdir(), "srdp-limits"
+    )
+
+    # Metrics; each worker writes a snapshot of its own to METRICS_DIR at most
+    # every METRICS_FLUSH_INTERVAL seconds for /metrics to add up. Set
+    # METRICS_DIR to an empty string to serve only the answering worker's.
+    # Set NO_REQUEST_METRICS to skip recording requests, which takes a few
+    # microseconds each, and the Server-Timing header built from them.
+    REQUEST_METRICS = os.environ.get("NO_REQUEST_METRICS") is None
+    METRICS_DIR = os.environ.get(
+        "METRICS_DIR", os.path.join(tempfile.gettempdir(), "srdp-metrics")
+    )
+    METRICS_FLUSH_INTERVAL = float(os.environ.get("METRICS_FLUSH_INTERVAL") or 5)
+    # Bearer token for scraping /metrics, which otherwise needs an admin's token
+    METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+
+    # In debug mode, requests running more SQL statements than this are logged
+    QUERY_BUDGET = int(os.environ.get("QUERY_BUDGET") or 20)
+
+    # SQL statements slower than this are written with their EXPLAIN output to
+    # the slow-query log, as JSON lines (to stdout with LOG_TO_STDOUT unless
+    # SLOW_QUERY_LOG is set)
+    SLOW_QUERY_SECONDS = float(os.environ.get("SLOW_QUERY_SECONDS") or 0.5)
+    SLOW_QUERY_LOG = os.environ.get("SLOW_QUERY_LOG") or os.path.join(
+        "logs", "slow-queries.log"
+    )
+    SLOW_QUERY_LOG_MAX_BYTES = int(
+        os.environ.get("SLOW_QUERY_LOG_MAX_BYTES") or 10485760
+    )
+    SLOW_QUERY_LOG_BACKUPS = int(os.environ.get("SLOW_QUERY_LOG_BACKUPS") or 5)
+    # Seconds a captured plan is reused for statements of the same shape
+    SLOW_QUERY_EXPLAIN_INTERVAL = float(
+        os.environ.get("SLOW_QUERY_EXPLAIN_INTERVAL") or 300
+    )
+
+    # Maximum number of sub-requests in one /api/batch call
+    BATCH_MAX_REQUESTS = int(os.environ.get("BATCH_MAX_REQUESTS") or 250)
+
+    # How long responses to requests sent with an Idempotency-Key are kept
+    IDEMPOTENCY_KEY_TTL = int(os.environ.get("IDEMPOTENCY_KEY_TTL") or 86400)
+    # A key reserved for longer than this without a response belongs to a
+    # request whose worker died, and is handed to the next retry; keep it
+    # above the longest a request can run (the gunicorn timeout)
+    IDEMPOTENCY_INFLIGHT_TIMEOUT = int(
+        os.environ.get("IDEMPOTENCY_INFLIGHT_TIMEOUT") or 60
+    )
+
+    # Background jobs; the directory must be shared by the web and worker hosts
+    JOBS_DIR = os.environ.get("JOBS_DIR") or os.path.join(
+        tempfile.gettempdir(), "srdp-jobs"
+    )
+    JOBS_POLL_INTERVAL = float(os.environ.get("JOBS_POLL_INTERVAL") or 1)
+    # Running jobs without a heartbeat for this long are handed to another worker
+    JOBS_STALE_SECONDS = int(os.environ.get("JOBS_STALE_SECONDS") or 300)
+    # Export files are removed this long after their job succeeded
+    JOBS_RESULT_SECONDS = int(os.environ.get("JOBS_RESULT_SECONDS") or 7 * 86400)
+
+    # OpenAPI document written at build time with `flask openapi`; built on
+    # the first request to /api/swagger.json when unset or missing
+    OPENAPI_JSON = os.environ.get("OPENAPI_JSON")
+
+    # Change feed. Rows stamped in the last CHANGE_FEED_SETTLE_SECONDS are
+    # held back, so it must cover the longest write transaction of a request,
+    # which gunicorn ends after GUNICORN_TIMEOUT. Bulk loads, syncs and delete
+    # jobs hold the feed back themselves while they run, for up to
+    # CHANGE_FEED_HOLD_SECONDS; the rows of a longer one can be missed by
+    # clients that read the feed meanwhile. A writer that is killed leaves
+    # its hold in feed_holds, holding the feed back until it expires.
+    CHANGE_FEED_SETTLE_SECONDS = int(
+        os.environ.get("CHANGE_FEED_SETTLE_SECONDS")
+        or os.environ.get("GUNICORN_TIMEOUT")
+        or 30
+    )
+    CHANGE_FEED_HOLD_SECONDS = int(os.environ.get("CHANGE_FEED_HOLD_SECONDS") or 86400)
+
+    # Change events, shared by all workers through an append-only log file
+    EVENTS_LOG = os.environ.get("EVENTS_LOG") or os.path.join(
+        tempfile.gettempdir(), "srdp-events.log"
+    )
+    EVENTS_LOG_MAX_BYTES = int(os.environ.get("EVENTS_LOG_MAX_BYTES") or 1048576)
+    EVENTS_STREAM_TIMEOUT = float(os.environ.get("EVENTS_STREAM_TIMEOUT") or 25)
+    EVENTS_POLL_INTERVAL = float(os.environ.get("EVENTS_POLL_INTERVAL") or 0.5)
 
     # Email Logging Parameters
     LOG_TO_STDOUT = os.environ.get("LOG_TO_STDOUT")
+    LOG_MAX_BYTES = int(os.environ.get("LOG_MAX_BYTES") or 10485760)
+    LOG_BACKUPS = int(os.environ.get("LOG_BACKUPS") or 10)
+    # Records waiting for the log listener thread; more are dropped
+    LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE") or 10000)
+    # An error is mailed once per interval, and at most MAIL_ERRORS_LIMIT
+    # error mails are sent per interval
+    MAIL_ERRORS_INTERVAL = float(os.environ.get("MAIL_ERRORS_INTERVAL") or 3600)
+    MAIL_ERRORS_LIMIT = int(os.environ.get("MAIL_ERRORS_LIMIT") or 10)
     MAIL_SERVER = os.environ.get("MAIL_SERVER")
     MAIL_PORT = int(os.environ.get("MAIL_PORT") or 25)
     MAIL_USE_TLS = os.environ.get("MAIL_USE_TLS") is not None
     MAIL_USERNAME = os.environ.get("MAIL_USERNAME")
     MAIL_PASSWORD = os.environ.get("MAIL_PASSWORD")
+    # Background mail sending: threads per process, messages waiting (more
+    # are dropped), messages sent per batch and seconds before an idle SMTP
+    # connection is closed
+    MAIL_WORKERS = int(os.environ.get("MAIL_WORKERS") or 2)
+    MAIL_QUEUE_SIZE = int(os.environ.get("MAIL_QUEUE_SIZE") or 1000)
+    MAIL_BATCH_SIZE = int(os.environ.get("MAIL_BATCH_SIZE") or 20)
+    MAIL_IDLE_TIMEOUT = float(os.environ.get("MAIL_IDLE_TIMEOUT") or 30)
     ADMIN_USERNAME = os.environ.get("ADMIN_USERNAME") or "admin"
     ADMIN_EMAIL = json.loads(os.environ.get("ADMIN_EMAILS"))
     ADMIN_PASSWORD = os.environ.get("ADMIN_PASSWORD")
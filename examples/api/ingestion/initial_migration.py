@@ -1,8 +1,34 @@
+"""
+Initial migration of the SRDP csv files into the API.
+
+Each csv is streamed in chunks and uploaded in batches by a pool of threads
+sharing one pooled ``requests.Session``. Failed batches (5xx responses and
+connection errors) are retried with exponential backoff, the token is
+refreshed before it expires, and completed rows are checkpointed to a local
+file so an interrupted run resumes where it stopped. The batch size adapts to
+the observed request latency. Retries reuse the batch's ``Idempotency-Key``
+so a batch whose response was lost is never created twice. Every file is
+validated up front (see ``validation.py``) so bad rows are reported before
+anything is sent.
+
+Usage:
+
+    $ python initial_migration.py --env ../../../.env --workers 4
+"""
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
 from dotenv import load_dotenv
-import requests
-import pandas as pd
-import math
+import argparse
+import json
 import os
+import random
+import threading
+import time
+import uuid
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+from validation import print_report, validate_files
 
 
 #
@@ -14,8 +40,19 @@ def create_path(fname):
     return os.path.join(current_dir, data_dir, fname)
 
 
+def to_records(df):
+    """Convert a chunk to JSON-ready records, mapping NaN to None."""
+    records = df.astype(object).where(pd.notnull(df), None).to_dict(orient="records")
+    for record in records:
+        for key, value in record.items():
+            # Integer columns with missing values are parsed as floats
+            if isinstance(value, float) and value.is_integer():
+                record[key] = int(value)
+    return records
+
+
 class Config:
-    def __init__(self, path_to_env="./.env"):
+    def __init__(self, path_to_env="./.env", base_url=None, pool_size=10, timeout=60):
         # Source environment file
         load_dotenv(path_to_env)
 
@@ -24,7 +61,23 @@ class Config:
         self.password = os.environ.get("ADMIN_PASSWORD")
 
         # API info
-        self.base_url = "https://srdp.ea-jones.com/api/"
+        self.base_url = (
+            base_url
+            or os.environ.get("SRDP_API_URL")
+            or "https://srdp.ea-jones.com/api/"
+        )
+
+        # One keep-alive connection pool shared by all upload threads
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        # Seconds to connect, and to wait for a response, before retrying
+        self.timeout = (10, timeout)
+
+        self.token = None
+        self.expiration = 0
+        self._token_lock = threading.Lock()
 
         # Get initial token
         self.get_token()
@@ -33,29 +86,165 @@ class Config:
         assert (
             self.password is not None
         ), "Env file is missing or path to env is mis-specified"
-        # TODO: Add auto refresh function by storing token as property
-        r = requests.post(self.base_url + "tokens", auth=(self.username, self.password))
+        r = self.session.post(
+            self.base_url + "tokens",
+            auth=(self.username, self.password),
+            timeout=self.timeout,
+        )
+        r.raise_for_status()
+        payload = r.json()
+        self.token = payload["token"]
+        # Expiration is reported in ms since the Unix epoch
+        self.expiration = payload["expiration"] / 1000
+
+    def auth_header(self, margin=120):
+        """Return the bearer header, refreshing the token shortly before expiry."""
+        with self._token_lock:
+            if time.time() > self.expiration - margin:
+                self.get_token()
+            return {"Authorization": f"Bearer {self.token}"}
+
+
+class Checkpoint:
+    """Rows already uploaded, per file, persisted as merged [start, end) ranges."""
+
+    def __init__(self, path, reset=False):
+        self.path = path
+        self.done = {}
+        self._lock = threading.Lock()
+        if not reset and os.path.exists(path):
+            with open(path) as f:
+                self.done = json.load(f)
+
+    def is_done(self, key, row):
+        return any(start <= row < end for start, end in self.done.get(key, []))
+
+    def mark(self, key, start, end):
+        with self._lock:
+            ranges = sorted(self.done.get(key, []) + [[start, end]])
+            merged = [ranges[0]]
+            for lo, hi in ranges[1:]:
+                if lo <= merged[-1][1]:
+                    merged[-1][1] = max(merged[-1][1], hi)
+                else:
+                    merged.append([lo, hi])
+            self.done[key] = merged
+            tmp = self.path + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(self.done, f)
+            os.replace(tmp, self.path)
+
+
+class BatchSizer:
+    """Grow the batch while requests are fast, halve it when they are slow."""
+
+    def __init__(self, initial=250, minimum=25, maximum=2000, target_latency=2.0):
+        self.size = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency = target_latency
+        self._lock = threading.Lock()
+
+    def observe(self, latency):
+        with self._lock:
+            if latency > self.target_latency:
+                self.size = max(self.minimum, self.size // 2)
+            elif latency < self.target_latency / 2:
+                self.size = min(self.maximum, int(self.size * 1.25) + 1)
+
+
+def send_to_api(endpoint, payload, cfg, retries=5, backoff=1.0):
+    """
+    Post a batch, retrying server errors and timeouts with exponential backoff
+    and jitter. Every attempt carries the same idempotency key.
+    """
+    key = str(uuid.uuid4())
+    for attempt in range(retries + 1):
         try:
-            self.token = r.json()["token"]
-        except Exception as e:
-            self.token = None
-            raise e
+            headers = dict(cfg.auth_header(), **{"Idempotency-Key": key})
+            r = cfg.session.post(
+                cfg.base_url + endpoint,
+                json=payload,
+                headers=headers,
+                timeout=cfg.timeout,
+            )
+            if r.status_code == 401:
+                # Token revoked or expired early; force a refresh and retry
+                cfg.expiration = 0
+            elif r.status_code < 500 and r.status_code != 409:
+                # 409 means an earlier attempt is still being processed
+                return r
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt == retries:
+                raise
+        if attempt < retries:
+            time.sleep(backoff * 2**attempt * random.uniform(0.5, 1.5))
+    return r
+
+
+def iter_batches(file_path, key, checkpoint, sizer, chunksize=5000):
+    """Stream ``file_path`` and yield (start, end, records) for rows not yet uploaded."""
+    batch, start, row = [], None, 0
+    for chunk in pd.read_csv(file_path, chunksize=chunksize):
+        for record in to_records(chunk):
+            if checkpoint.is_done(key, row):
+                if batch:
+                    yield start, row, batch
+                    batch = []
+            else:
+                if not batch:
+                    start = row
+                batch.append(record)
+                if len(batch) >= sizer.size:
+                    yield start, row + 1, batch
+                    batch = []
+            row += 1
+    if batch:
+        yield start, row, batch
+
 
+def upload(file_path, endpoint, cfg, checkpoint, sizer, workers):
+    """Upload every pending batch of one file with up to ``workers`` in flight."""
+    key = os.path.basename(file_path)
+    counts = {"uploaded": 0, "failed": 0}
 
-def send_to_api(endpoint, payload, cfg):
-    # Make post request
-    assert cfg.token, "Config did not succesfully fetch authorization token."
-    headers = {"Authorization": f"Bearer {cfg.token}"}
-    r = requests.post(cfg.base_url + endpoint, json=payload, headers=headers)
+    def post(start, end, records):
+        began = time.monotonic()
+        r = send_to_api(endpoint, records, cfg)
+        sizer.observe(time.monotonic() - began)
+        return start, end, r
 
-    # Return status code
-    print(r.status_code)
+    def collect(futures):
+        for future in futures:
+            start, end, r = future.result()
+            if r.status_code < 300:
+                checkpoint.mark(key, start, end)
+                counts["uploaded"] += end - start
+            else:
+                counts["failed"] += end - start
+                print(f"{key} rows {start}-{end - 1} rejected ({r.status_code})")
+                print(r.text[:500])
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        for start, end, records in iter_batches(file_path, key, checkpoint, sizer):
+            if len(pending) >= workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+            pending.add(executor.submit(post, start, end, records))
+        collect(wait(pending).done)
+    print(
+        f"{datetime.now():%H:%M:%S} {key}: {counts['uploaded']} rows uploaded, "
+        f"{counts['failed']} failed"
+    )
+    return counts["failed"]
 
 
 #
 # Constants
 #
 
+# Files are loaded in dependency order: groups > organizations > tactics
 data_and_endpoint_pairs = [
     (create_path("groups.csv"), "groups"),
     (create_path("orgs.csv"), "organizations"),
@@ -63,38 +252,63 @@ data_and_endpoint_pairs = [
     (create_path("violent_tactics.csv"), "violent_tactics"),
 ]
 
+
 #
 # Main
 #
-def main():
-    # Instantiate API auth config
-    cfg = Config()
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--env", default="./.env", help="path to the .env file")
+    parser.add_argument("--base-url", help="API root, e.g. http://localhost:5000/api/")
+    parser.add_argument("--workers", type=int, default=4, help="concurrent uploads")
+    parser.add_argument("--batch-size", type=int, default=250, help="initial size")
+    parser.add_argument(
+        "--target-latency", type=float, default=2.0, help="seconds per batch"
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=60, help="seconds to wait for a response"
+    )
+    parser.add_argument(
+        "--checkpoint",
+        default=create_path(".migration_checkpoint.json"),
+        help="progress file used to resume interrupted runs",
+    )
+    parser.add_argument(
+        "--reset", action="store_true", help="ignore and overwrite the checkpoint"
+    )
+    parser.add_argument(
+        "--validate-only", action="store_true", help="check the files and exit"
+    )
+    return parser.parse_args()
 
-    # Set constant batch size
-    batch_size = 250
 
-    # Iterate through data and endpoints
-    for file_path, endpoint in data_and_endpoint_pairs:
-        # Read in data and convert NaNs to None
-        df = pd.read_csv(file_path)
-        payload = df.where(pd.notnull(df), None).to_dict(orient="records")
+def main():
+    args = parse_args()
 
-        # Batch large payloads
-        payload_size = len(payload)
+    # Reject bad data before it costs a round trip
+    report = validate_files([file_path for file_path, _ in data_and_endpoint_pairs])
+    if report:
+        print_report(report)
+        print("Validation failed; nothing was uploaded.")
+        return 1
+    if args.validate_only:
+        print("All files are valid.")
+        return 0
 
-        if payload_size > batch_size:
-            n_batches = math.ceil(payload_size / batch_size)
+    # Instantiate API auth config
+    cfg = Config(
+        args.env, base_url=args.base_url, pool_size=args.workers, timeout=args.timeout
+    )
+    checkpoint = Checkpoint(args.checkpoint, reset=args.reset)
+    sizer = BatchSizer(initial=args.batch_size, target_latency=args.target_latency)
 
-            # Iterate through batches and send to api
-            for i in range(n_batches):
-                batch = payload[
-                    i * batch_size : min(i * batch_size + batch_size, payload_size)
-                ]
-                # TODO: Add cariage return progress tracker
-                send_to_api(endpoint, batch, cfg)
-        else:
-            send_to_api(endpoint, payload, cfg)
+    # Later files reference earlier ones, so stop at the first file with failures
+    for file_path, endpoint in data_and_endpoint_pairs:
+        if upload(file_path, endpoint, cfg, checkpoint, sizer, args.workers):
+            print("Stopping; fix the rejected rows and rerun to resume.")
+            return 1
+    return 0
 
 
 if __name__ == "__main__":
-    main()
+    raise SystemExit(main())
@@ -0,0 +1,176 @@
+"""
+Vectorized pre-validation of the SRDP csv files.
+
+Checks a whole file with pandas before anything is uploaded, using the same
+rules as the ``*InputSchema`` classes in ``app/api_spec.py``: required fields,
+integer fields, no duplicate keys, no orphan references, and
+``startYear <= endYear``. Problems are reported with their csv line numbers
+(the header is line 1). The tests check that these rules and the schemas
+reject the same rows; only fractional integers, which the schemas truncate,
+are rejected here alone.
+
+Usage:
+
+    $ python validation.py
+"""
+from dataclasses import dataclass, field
+import os
+import sys
+import pandas as pd
+
+
+@dataclass
+class Rules:
+    """Validation rules for one csv, mirroring its input schema."""
+
+    required: tuple
+    integers: tuple
+    unique: tuple
+    # Referencing column -> (referenced file key, referenced column)
+    references: dict = field(default_factory=dict)
+    year_range: bool = False
+
+
+_TACTIC_RULES = dict(required=("facId", "year"), unique=("facId", "year"))
+
+# Keyed by csv file name
+RULES = {
+    "groups.csv": Rules(
+        required=("kgcId", "groupName", "country"),
+        integers=("kgcId", "startYear", "endYear"),
+        unique=("kgcId",),
+        year_range=True,
+    ),
+    "orgs.csv": Rules(
+        required=("facId", "kgcId", "facName"),
+        integers=("facId", "kgcId", "startYear", "endYear"),
+        unique=("facId",),
+        references={"kgcId": ("groups.csv", "kgcId")},
+        year_range=True,
+    ),
+    "violent_tactics.csv": Rules(
+        integers=(
+            "facId",
+            "year",
+            "againstState",
+            "againstStateFatal",
+            "againstOrg",
+            "againstOrgFatal",
+            "againstIngroup",
+            "againstIngroupFatal",
+            "againstOutgroup",
+            "againstOutgroupFatal",
+        ),
+        references={"facId": ("orgs.csv", "facId")},
+        **_TACTIC_RULES,
+    ),
+    "nonviolent_tactics.csv": Rules(
+        integers=(
+            "facId",
+            "year",
+            "economicNoncooperation",
+            "protestDemonstration",
+            "nonviolentIntervention",
+            "socialNoncooperation",
+            "institutionalAction",
+            "politicalNoncooperation",
+        ),
+        references={"facId": ("orgs.csv", "facId")},
+        **_TACTIC_RULES,
+    ),
+}
+
+
+def read_frame(file_path):
+    """Read a csv as strings so no value is silently coerced."""
+    return pd.read_csv(file_path, dtype=str, keep_default_na=False, na_values=[""])
+
+
+def to_integers(series):
+    """Parse a column as nullable integers; returns (values, invalid mask)."""
+    numbers = pd.to_numeric(series, errors="coerce")
+    invalid = series.notna() & (numbers.isna() | (numbers % 1 != 0))
+    return numbers.where(~invalid).astype("Int64"), invalid
+
+
+def _lines(mask, limit=10):
+    lines = [str(i + 2) for i in mask[mask].index[:limit]]
+    more = int(mask.sum()) - len(lines)
+    return ", ".join(lines) + (f" and {more} more" if more > 0 else "")
+
+
+def validate_frame(df, rules, referenced=None):
+    """
+    Check ``df`` against ``rules``. ``referenced`` maps file keys to the
+    frames they were read into, for the orphan checks. Returns a list of
+    problem descriptions, empty when the frame is valid.
+    """
+    referenced = referenced or {}
+    problems = []
+
+    missing = [column for column in rules.required if column not in df.columns]
+    if missing:
+        return [f"missing required columns {', '.join(missing)}"]
+    for column in rules.required:
+        mask = df[column].isna()
+        if mask.any():
+            problems.append(f"{column} is required (lines {_lines(mask)})")
+
+    values = {}
+    for column in rules.integers:
+        if column not in df.columns:
+            continue
+        values[column], mask = to_integers(df[column])
+        if mask.any():
+            problems.append(f"{column} must be an integer (lines {_lines(mask)})")
+
+    mask = df.duplicated(subset=list(rules.unique), keep="first")
+    mask &= df[list(rules.unique)].notna().all(axis=1)
+    if mask.any():
+        key = ", ".join(rules.unique)
+        problems.append(f"duplicate ({key}) (lines {_lines(mask)})")
+
+    for column, (file_key, target) in rules.references.items():
+        if file_key not in referenced:
+            continue
+        known = to_integers(referenced[file_key][target])[0].dropna()
+        mask = values[column].notna() & ~values[column].isin(known)
+        if mask.any():
+            problems.append(
+                f"{column} not found in {file_key} (lines {_lines(mask.fillna(False))})"
+            )
+
+    if rules.year_range and {"startYear", "endYear"} <= set(values):
+        mask = (values["startYear"] > values["endYear"]).fillna(False)
+        if mask.any():
+            problems.append(f"startYear after endYear (lines {_lines(mask)})")
+    return problems
+
+
+def validate_files(file_paths):
+    """
+    Validate csv files together, so references are checked against the other
+    files. Returns {file name: [problems]} for the files with problems.
+    """
+    frames = {os.path.basename(path): read_frame(path) for path in file_paths}
+    report = {}
+    for key, df in frames.items():
+        problems = validate_frame(df, RULES[key], referenced=frames)
+        if problems:
+            report[key] = problems
+    return report
+
+
+def print_report(report):
+    for key, problems in report.items():
+        print(f"{key}:")
+        for problem in problems:
+            print(f"  {problem}")
+
+
+if __name__ == "__main__":
+    from initial_migration import data_and_endpoint_pairs
+
+    report = validate_files([path for path, _ in data_and_endpoint_pairs])
+    print_report(report)
+    sys.exit(1 if report else 0)
@@ -0,0 +1,56 @@
+"""
+Gunicorn settings, read from the working directory by ``gunicorn srdp:app``.
+
+By default the app is loaded once in the master and the workers are forked
+from it (``preload_app``), so they share its code, models and OpenAPI document
+copy-on-write instead of each building their own. Each worker then drops the
+database connections it inherited and opens its own.
+"""
+import gc
+import os
+
+bind = os.environ.get("GUNICORN_BIND") or ":5000"
+workers = int(os.environ.get("GUNICORN_WORKERS") or 8)
+timeout = int(os.environ.get("GUNICORN_TIMEOUT") or 30)
+preload_app = os.environ.get("GUNICORN_NO_PRELOAD") is None
+accesslog = "-"
+errorlog = "-"
+
+
+def when_ready(server):
+    if not server.cfg.preload_app:
+        return
+    from app import warm_up
+
+    warm_up(server.app.wsgi())
+    # Keep the collector from touching (and so copying) the shared objects
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    if not server.cfg.preload_app:
+        return
+    from app import after_fork
+
+    after_fork(server.app.wsgi())
+
+
+def post_worker_init(worker):
+    # Workers only: a preloading master has no requests of its own to report
+    from app import metrics
+
+    metrics.start_flusher(worker.wsgi)
+
+
+def worker_exit(server, worker):
+    # Leave the last counts of the worker for /metrics to archive and write
+    # out its queued log records and mail
+    from app import log, metrics
+    from app.email import stop_sender
+
+    app = getattr(worker, "wsgi", None)
+    if hasattr(app, "app_context"):
+        with app.app_context():
+            metrics.flush()
+        stop_sender(app)
+        log.stop(app)
@@ -1,14 +1,31 @@
 #!/usr/bin/env python
-from cgi import test
 from datetime import datetime, timedelta
-from email import header
+import email
 import unittest
 import os
 import json
+import random
+import shutil
+import socketserver
+import sys
+import tempfile
+import threading
+import time
 from base64 import b64encode
-from wsgiref import headers
-from app import create_app, db
-from app.models import User, ViolentTactics, NonviolentTactics, Groups, Organizations
+from types import SimpleNamespace
+from sqlalchemy import event
+from app import create_app, db, ensure_extension
+from app.models import (
+    User,
+    FeedHold,
+    ViolentTactics,
+    NonviolentTactics,
+    Groups,
+    IdempotencyKey,
+    Job,
+    Organizations,
+    Tombstone,
+)
 from config import Config
 from config import basedir
 
@@ -83,6 +100,55 @@ def create_token_header(token):
     return {"Authorization": f"Bearer {token}"}
 
 
+class SMTPStandIn(socketserver.ThreadingTCPServer):
+    """A local SMTP server keeping the messages it receives."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), SMTPSession)
+        self.messages = []
+        self.connections = 0
+        self.refuse_recipients = False
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+
+
+class SMTPSession(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode() + b"\r\n")
+
+    def handle(self):
+        self.server.connections += 1
+        self.reply("220 localhost SMTP stand-in")
+        for line in self.rfile:
+            command = line.decode().strip().upper()
+            if command.startswith("DATA"):
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                data = []
+                for line in self.rfile:
+                    if line == b".\r\n":
+                        break
+                    data.append(line)
+                self.server.messages.append(email.message_from_bytes(b"".join(data)))
+                self.reply("250 OK")
+            elif command.startswith("RCPT") and self.server.refuse_recipients:
+                self.reply("550 No such user")
+            elif command.startswith("QUIT"):
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("250 OK")
+
+
 def prep_call(testInstance, data=None):
     token = fetch_auth_token(testInstance=testInstance).json["token"]
     header = create_token_header(token=token)
@@ -98,6 +164,10 @@ def prep_call(testInstance, data=None):
 # Tests #
 # ===== #
 test_db_path = os.path.join(basedir, "test.db")
+test_events_path = os.path.join(basedir, "test-events.log")
+test_jobs_dir = os.path.join(basedir, "test-jobs")
+test_metrics_dir = os.path.join(basedir, "test-metrics")
+test_slow_queries_path = os.path.join(basedir, "test-slow-queries.log")
 
 
 class TestConfig(Config):
@@ -106,6 +176,13 @@ class TestConfig(Config):
     SQLALCHEMY_DATABASE_URI = "sqlite:///" + test_db_path
     ELASTICSEARCH_URL = None
     ADMIN_EMAIL = "testadmin@gmail.com"
+    CHANGE_FEED_SETTLE_SECONDS = 0
+    EVENTS_LOG = test_events_path
+    EVENTS_STREAM_TIMEOUT = 0.2
+    EVENTS_POLL_INTERVAL = 0.05
+    JOBS_DIR = test_jobs_dir
+    METRICS_DIR = test_metrics_dir
+    SLOW_QUERY_LOG = test_slow_queries_path
 
 
 class UserModelCase(unittest.TestCase):
@@ -203,6 +280,27 @@ class UserModelCase(unittest.TestCase):
         self.assertEqual(org.startYear, 1999)
         self.assertEqual(org.endYear, 2000)
 
+    def test_from_dict_timestamps(self):
+        group = Groups()
+        group.from_dict(
+            data=dict(
+                groupData,
+                created_at="2021-06-01T12:30:00Z",
+                modified_at="June 2, 2021 08:00",
+            )
+        )
+        self.assertEqual(group.created_at.isoformat(), "2021-06-01T12:30:00+00:00")
+        self.assertEqual(group.modified_at, datetime(2021, 6, 2, 8, 0))
+
+        # Absent timestamps are filled in by the column defaults on insert
+        org = Organizations()
+        org.from_dict(data=orgData)
+        self.assertIsNone(org.created_at)
+        db.session.add(org)
+        db.session.commit()
+        self.assertIsNotNone(org.created_at)
+        self.assertIsNotNone(org.modified_at)
+
     # API route tests
     def test_token_GET(self):
         # When
@@ -318,11 +416,1290 @@ class UserModelCase(unittest.TestCase):
         # Then
         self.assertEqual(204, response.status_code, f"{response.data}")
 
+    def test_group_GET_expand(self):
+        # Given
+        header, _ = prep_call(self)
+        header["Content-type"] = "application/json"
+        for endpoint, data in [
+            ("api/groups", groupData),
+            ("api/organizations", orgData),
+            ("api/violent_tactics", [vtData, dict(vtData, year=2000)]),
+            ("api/nonviolent_tactics", nvtData),
+        ]:
+            self.client.post(endpoint, headers=header, data=json.dumps(data))
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        event.listen(db.engine, "before_cursor_execute", listener)
+
+        # When
+        expand = "organizations.violentTactics,organizations.nonviolentTactics"
+        response = self.client.get(f"api/groups/123456?expand={expand}", headers=header)
+        event.remove(db.engine, "before_cursor_execute", listener)
+
+        # Then
+        self.assertEqual(200, response.status_code, f"{response.data}")
+        organizations = response.json["organizations"]
+        self.assertEqual(1, len(organizations))
+        self.assertEqual(2, len(organizations[0]["violentTactics"]))
+        self.assertEqual(1, len(organizations[0]["nonviolentTactics"]))
+        # token check, group, organizations, violent and nonviolent tactics
+        self.assertEqual(5, len(statements), statements)
+
+    def test_group_GET_expand_unknown(self):
+        # Given
+        header, _ = prep_call(self)
+
+        # When
+        response = self.client.get("api/groups/1?expand=users", headers=header)
+
+        # Then
+        self.assertEqual(400, response.status_code, f"{response.data}")
+
+    def test_violent_tactics_GET_filters(self):
+        # Given
+        header, _ = prep_call(self)
+        header["Content-type"] = "application/json"
+        self.client.post("api/groups", headers=header, data=json.dumps(groupData))
+        self.client.post("api/organizations", headers=header, data=json.dumps(orgData))
+        tactics = [
+            dict(vtData, year=year, againstState=year % 2) for year in range(1990, 2000)
+        ]
+        self.client.post(
+            "api/violent_tactics", headers=header, data=json.dumps(tactics)
+        )
+
+        # When
+        response = self.client.get(
+            "api/violent_tactics?kgcId=123456&year_gte=1992&year_lte=1997"
+            "&againstState_gt=0&sort=-year&per_page=2",
+            headers=header,
+        )
+
+        # Then
+        self.assertEqual(200, response.status_code, f"{response.data}")
+        self.assertEqual([1997, 1995], [r["year"] for r in response.json["results"]])
+        self.assertEqual(3, response.json["_meta"]["total_items"])
+        self.assertIn("year_gte=1992", response.json["_links"]["next"])
+        self.assertIn("sort=-year", response.json["_links"]["next"])
+
+    def test_violent_tactics_GET_bad_filter(self):
+        # Given
+        header, _ = prep_call(self)
+
+        # When
+        unknown = self.client.get("api/violent_tactics?against=1", headers=header)
+        malformed = self.client.get("api/violent_tactics?year_gte=x", headers=header)
+        unsortable = self.client.get(
+            "api/violent_tactics?sort=againstOrg", headers=header
+        )
+
+        # Then
+        self.assertEqual(400, unknown.status_code, f"{unknown.data}")
+        self.assertEqual(400, malformed.status_code, f"{malformed.data}")
+        self.assertEqual(400, unsortable.status_code, f"{unsortable.data}")
+
+    def test_changes_GET(self):
+        # Given
+        header, _ = prep_call(self)
+        header["Content-type"] = "application/json"
+        self.client.post("api/groups", headers=header, data=json.dumps(groupData))
+        self.client.post("api/organizations", headers=header, data=json.dumps(orgData))
+        self.client.post("api/violent_tactics", headers=header, data=json.dumps(vtData))
+
+        # When
+        first = self.client.get("api/changes?limit=2", headers=header)
+        second = self.client.get(first.json["_links"]["next"], headers=header)
+        self.client.delete("api/violent_tactics/1", headers=header)
+        third = self.client.get(second.json["_links"]["next"], headers=header)
+
+        # Then
+        self.assertEqual(200, first.status_code, f"{first.data}")
+        self.assertTrue(first.json["_meta"]["has_more"])
+        changes = first.json["changes"] + second.json["changes"]
+        self.assertEqual(
+            ["groups", "organizations", "violence"], [c["table"] for c in changes]
+        )
+        self.assertFalse(second.json["_meta"]["has_more"])
+        self.assertEqual(
+            [{"table": "violence", "operation": "delete", "key": 1}],
+            [
+                {k: c[k] for k in ("table", "operation", "key")}
+                for c in third.json["changes"]
+            ],
+        )
+
+    def test_changes_GET_held(self):
+        # Given a long write transaction that started before the group's
+        header, payload = prep_call(self, groupData)
+        hold = FeedHold(started_at=datetime.utcnow() - timedelta(seconds=5))
+        db.session.add(hold)
+        db.session.commit()
+        self.client.post("api/groups", headers=header, data=payload)
+
+        # When
+        held = self.client.get("api/changes", headers=header)
+        db.session.delete(hold)
+        db.session.commit()
+        released = self.client.get(held.json["_links"]["next"], headers=header)
+
+        # Then
+        self.assertEqual(200, held.status_code, f"{held.data}")
+        self.assertEqual([], held.json["changes"])
+        self.assertEqual(["groups"], [c["table"] for c in released.json["changes"]])
+
+    def test_events_GET(self):
+        # Given
+        header, payload = prep_call(self, groupData)
+        self.client.post("api/groups", headers=header, data=payload)
+        self.client.delete("api/groups/123456", headers=header)
+
+        # When
+        header["Last-Event-ID"] = "0"
+        response = self.client.get("api/events", headers=header)
+
+        # Then
+        self.assertEqual(200, response.status_code, f"{response.data}")
+        self.assertEqual("text/event-stream", response.mimetype)
+        events = [
+            json.loads(line[len("data: ") :])
+            for line in response.get_data(as_text=True).splitlines()
+            if line.startswith("data: ")
+        ]
+        self.assertEqual(
+            [
+                {"table": "groups", "key": 123456, "op": "insert", "gen": 1},
+                {"table": "groups", "key": 123456, "op": "delete", "gen": 2},
+            ],
+            events,
+        )
+
+    def test_batch_POST(self):
+        # Given
+        header, payload = prep_call(
+            self,
+            [
+                {"method": "POST", "path": "/api/groups", "body": groupData},
+                {"method": "POST", "path": "/api/organizations", "body": orgData},
+                {"method": "GET", "path": "/api/organizations/123456?expand=group"},
+            ],
+        )
+
+        # When
+        response = self.client.post("api/batch", headers=header, data=payload)
+
+        # Then
+        self.assertEqual(200, response.status_code, f"{response.data}")
+        responses = response.json["responses"]
+        self.assertEqual([201, 201, 200], [r["status"] for r in responses])
+        self.assertEqual("testName", responses[2]["body"]["group"]["groupName"])
+
+    def test_batch_POST_atomic(self):
+        # Given
+        header, payload = prep_call(
+            self,
+            {
+                "atomic": True,
+                "requests": [
+                    {"method": "POST", "path": "/api/groups", "body": groupData},
+                    {"method": "GET", "path": "/api/groups/1?expand=users"},
+                ],
+            },
+        )
+
+        # When
+        response = self.client.post("api/batch", headers=header, data=payload)
+
+        # Then
+        self.assertEqual(200, response.status_code, f"{response.data}")
+        self.assertFalse(response.json["committed"])
+        self.assertEqual([201, 400], [r["status"] for r in response.json["responses"]])
+        self.assertIsNone(Groups.query.get(123456))
+
+    def test_violent_tactics_POST_idempotent(self):
+        # Given
+        header, payload = prep_call(self, [vtData, vtData])
+        header["Idempotency-Key"] = "batch-1"
+
+        # When
+        first = self.client.post("api/violent_tactics", headers=header, data=payload)
+        retry = self.client.post("api/violent_tactics", headers=header, data=payload)
+        reused = self.client.post(
+            "api/violent_tactics", headers=header, data=json.dumps([vtData])
+        )
+
+        # Then
+        self.assertEqual(201, first.status_code, f"{first.data}")
+        self.assertEqual(201, retry.status_code, f"{retry.data}")
+        self.assertEqual(first.json, retry.json)
+        self.assertEqual("true", retry.headers["Idempotent-Replayed"])
+        self.assertEqual(2, ViolentTactics.query.count())
+        self.assertEqual(422, reused.status_code)
+
+    def test_idempotency_key_abandoned(self):
+        # Given a key left reserved by a worker that died mid-request
+        from app.api.idempotency import fingerprint
+
+        header, payload = prep_call(self, [vtData])
+        header["Idempotency-Key"] = "batch-1"
+        with self.app.test_request_context(
+            "/api/violent_tactics", method="POST", data=payload
+        ):
+            digest = fingerprint()
+        admin = User.query.filter_by(username=Config.ADMIN_USERNAME).first()
+        record = IdempotencyKey(
+            scope=f"user:{admin.id}", key="batch-1", fingerprint=digest
+        )
+        db.session.add(record)
+        db.session.commit()
+        blocked = self.client.post("api/violent_tactics", headers=header, data=payload)
+        record.created_at = datetime.utcnow() - timedelta(minutes=5)
+        db.session.commit()
+
+        # When
+        retry = self.client.post("api/violent_tactics", headers=header, data=payload)
+
+        # Then
+        self.assertEqual(409, blocked.status_code)
+        self.assertEqual(201, retry.status_code, f"{retry.data}")
+        self.assertEqual(1, ViolentTactics.query.count())
+        self.assertEqual(201, IdempotencyKey.query.get(record.id).status)
+
+    def test_idempotency_key_race_in_atomic_batch(self):
+        # Given a concurrent request that claims the key between the lookup
+        # and the insert, and has already completed
+        from app.api import idempotency
+
+        def claim(name, **labels):
+            if labels.get("result") == "miss":
+                db.session.execute(
+                    IdempotencyKey.__table__.insert().values(
+                        scope=f"user:{admin.id}",
+                        key="raced",
+                        fingerprint=idempotency.fingerprint(),
+                        status=201,
+                        body="[]",
+                        created_at=datetime.utcnow(),
+                    )
+                )
+
+        admin = User.query.filter_by(username=Config.ADMIN_USERNAME).first()
+        self.addCleanup(setattr, idempotency, "metrics", idempotency.metrics)
+        idempotency.metrics = SimpleNamespace(inc=claim)
+        header, payload = prep_call(
+            self,
+            {
+                "atomic": True,
+                "requests": [
+                    {"method": "POST", "path": "/api/groups", "body": groupData},
+                    {
+                        "method": "POST",
+                        "path": "/api/violent_tactics",
+                        "body": [vtData],
+                        "headers": {"Idempotency-Key": "raced"},
+                    },
+                ],
+            },
+        )
+
+        # When
+        response = self.client.post("api/batch", headers=header, data=payload)
+
+        # Then
+        self.assertEqual(200, response.status_code, f"{response.data}")
+        self.assertEqual([201, 201], [r["status"] for r in response.json["responses"]])
+        self.assertTrue(response.json["committed"])
+        self.assertIsNotNone(Groups.query.get(123456))
+        self.assertEqual(0, ViolentTactics.query.count())
+
+    def test_load_csv(self):
+        # Given
+        path = os.path.join(basedir, "test-groups.csv")
+        with open(path, "w") as f:
+            f.write("kgcId,groupName,country,startYear,endYear\n")
+            f.write("1,groupOne,countryOne,1990,2000\n")
+            f.write("2,groupTwo,countryTwo,1995,\n")
+        self.addCleanup(os.remove, path)
+
+        # When
+        result = self.runner.invoke(args=["load-csv", "groups", path])
+
+        # Then
+        self.assertEqual(0, result.exit_code, result.output)
+        self.assertIn("Loaded 2 rows", result.output)
+        self.assertIsNone(Groups.query.get(2).endYear)
+        self.assertIsNotNone(Groups.query.get(2).created_at)
+        self.assertEqual(0, FeedHold.query.count())
+
+    def test_load_csv_invalid(self):
+        # Given
+        path = os.path.join(basedir, "test-groups.csv")
+        with open(path, "w") as f:
+            f.write("kgcId,groupName,country,startYear\n")
+            f.write("1,groupOne,countryOne,1990\n")
+            f.write("notAnId,groupTwo,countryTwo,1995\n")
+        self.addCleanup(os.remove, path)
+
+        # When
+        result = self.runner.invoke(args=["load-csv", "groups", path])
+
+        # Then
+        self.assertNotEqual(0, result.exit_code)
+        self.assertIn("line 3", result.output)
+        self.assertEqual(0, Groups.query.count())
+
+    def test_load_csv_invalid_late_row(self):
+        # Given
+        path = os.path.join(basedir, "test-groups.csv")
+        with open(path, "w") as f:
+            f.write("kgcId,groupName,country\n")
+            f.writelines(f"{i},group{i},country\n" for i in range(1, 5))
+            f.write("notAnId,groupFive,country\n")
+        self.addCleanup(os.remove, path)
+
+        # When
+        result = self.runner.invoke(
+            args=["load-csv", "groups", path, "--chunk-size", "2"]
+        )
+
+        # Then
+        self.assertNotEqual(0, result.exit_code)
+        self.assertIn("line 6", result.output)
+        self.assertEqual(0, Groups.query.count())
+
+    def test_load_csv_infile_unknown_column(self):
+        # Given
+        path = os.path.join(basedir, "test-groups.csv")
+        with open(path, "w") as f:
+            f.write("kgcId,groupName,country,population\n")
+            f.write("1,groupOne,countryOne,\n")
+        self.addCleanup(os.remove, path)
+
+        # When
+        result = self.runner.invoke(args=["load-csv", "groups", path, "--local-infile"])
+
+        # Then
+        self.assertNotEqual(0, result.exit_code)
+        self.assertIn("unknown columns population", result.output)
+
+    def test_sync_POST(self):
+        # Given
+        for kgcId in [1, 2, 3]:
+            group = Groups()
+            group.from_dict(dict(groupData, kgcId=kgcId))
+            db.session.add(group)
+        db.session.commit()
+        unchanged = Groups.query.get(1).modified_at
+        release = [
+            dict(groupData, kgcId=1),
+            dict(groupData, kgcId=2, groupName="renamed"),
+            dict(groupData, kgcId=4),
+        ]
+        header, payload = prep_call(self, release)
+
+        # When
+        response = self.client.post("api/sync/groups", headers=header, data=payload)
+
+        # Then
+        self.assertEqual(200, response.status_code, f"{response.data}")
+        report = response.json
+        self.assertEqual(
+            [1, 1, 1, 1],
+            [report[k] for k in ["inserted", "updated", "deleted", "unchanged"]],
+        )
+        self.assertEqual([3], report["changes"]["deleted"])
+        self.assertEqual("renamed", Groups.query.get(2).groupName)
+        self.assertIsNone(Groups.query.get(3))
+        self.assertIsNotNone(Groups.query.get(4))
+        self.assertEqual(unchanged, Groups.query.get(1).modified_at)
+
+    def test_sync_csv_dry_run(self):
+        # Given
+        path = os.path.join(basedir, "test-groups.csv")
+        with open(path, "w") as f:
+            f.write("kgcId,groupName,country,startYear,endYear\n")
+            f.write("1,groupOne,countryOne,1990,2000\n")
+        self.addCleanup(os.remove, path)
+
+        # When
+        result = self.runner.invoke(args=["sync-csv", "groups", path, "--dry-run"])
+
+        # Then
+        self.assertEqual(0, result.exit_code, result.output)
+        self.assertIn("Would apply 1 inserts", result.output)
+        self.assertEqual(0, Groups.query.count())
+
+    def test_group_DELETE_cascade(self):
+        # Given
+        for model, data in [
+            (Groups, groupData),
+            (Organizations, orgData),
+            (ViolentTactics, vtData),
+            (ViolentTactics, dict(vtData, year=2000)),
+            (NonviolentTactics, nvtData),
+        ]:
+            instance = model()
+            instance.from_dict(data)
+            db.session.add(instance)
+        db.session.commit()
+        header, _ = prep_call(self)
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        event.listen(db.engine, "before_cursor_execute", listener)
+
+        # When
+        response = self.client.delete("api/groups/123456", headers=header)
+        event.remove(db.engine, "before_cursor_execute", listener)
+
+        # Then
+        self.assertEqual(204, response.status_code, f"{response.data}")
+        deletes = [s for s in statements if s.startswith("DELETE")]
+        self.assertEqual(4, len(deletes), deletes)
+        for model in [Groups, Organizations, ViolentTactics, NonviolentTactics]:
+            self.assertEqual(0, model.query.count())
+        self.assertEqual(5, Tombstone.query.count())
+
+    def test_violent_tactics_DELETE_bulk(self):
+        # Given
+        for year in [1998, 1999, 2000]:
+            tactic = ViolentTactics()
+            tactic.from_dict(dict(vtData, year=year))
+            db.session.add(tactic)
+        db.session.commit()
+        header, _ = prep_call(self)
+
+        # When
+        by_filter = self.client.delete(
+            "api/violent_tactics?year_lte=1999", headers=header
+        )
+        by_ids = self.client.delete(
+            "api/violent_tactics", headers=header, json={"ids": [3]}
+        )
+        bare = self.client.delete("api/violent_tactics", headers=header)
+
+        # Then
+        self.assertEqual({"violent_tactics": 2}, by_filter.json["deleted"])
+        self.assertEqual({"violent_tactics": 1}, by_ids.json["deleted"])
+        self.assertEqual(400, bare.status_code)
+        self.assertEqual(0, ViolentTactics.query.count())
+
+    def test_violent_tactics_PATCH_bulk(self):
+        # Given
+        for year in [1998, 1999, 2000]:
+            tactic = ViolentTactics()
+            tactic.from_dict(dict(vtData, year=year))
+            db.session.add(tactic)
+        db.session.commit()
+        header, _ = prep_call(self)
+
+        # When
+        each = self.client.patch(
+            "api/violent_tactics",
+            headers=header,
+            json=[
+                {"id": 1, "changes": {"againstState": 1}},
+                {"facId": 123456, "year": 1999, "changes": {"againstState": 1}},
+            ],
+        )
+        by_filter = self.client.patch(
+            "api/violent_tactics?year_gte=1999",
+            headers=header,
+            json={"changes": {"againstOrg": 2}},
+        )
+        locked = self.client.patch(
+            "api/violent_tactics",
+            headers=header,
+            json={"ids": [1], "changes": {"year": 1}},
+        )
+
+        # Then
+        self.assertEqual({"updated": 2}, each.json)
+        self.assertEqual({"updated": 2}, by_filter.json)
+        self.assertEqual(400, locked.status_code)
+        db.session.remove()
+        tactics = ViolentTactics.query.order_by(ViolentTactics.year).all()
+        self.assertEqual([1, 1, 0], [t.againstState for t in tactics])
+        self.assertEqual([0, 2, 2], [t.againstOrg for t in tactics])
+
+    def test_replica_reads(self):
+        # Given a replica that has a group the primary does not
+        # In a directory removed after tearDown, whose drop_all reconnects
+        replica_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, replica_dir)
+        replica_path = os.path.join(replica_dir, "test-replica.db")
+        self.app.config["SQLALCHEMY_BINDS"] = {"replica": "sqlite:///" + replica_path}
+        replica = db.get_engine(bind="replica")
+        db.Model.metadata.create_all(bind=replica)
+        replica.execute(
+            Groups.__table__.insert(), dict(groupData, kgcId=1, groupName="replica")
+        )
+        header, payload = prep_call(self, data=dict(groupData, kgcId=2))
+        try:
+            # When
+            created = self.client.post("api/groups", headers=header, data=payload)
+            response = self.client.get("api/groups", headers=header)
+            batch = self.client.post(
+                "api/batch",
+                headers=header,
+                data=json.dumps([{"method": "GET", "path": "/api/groups"}]),
+            )
+        finally:
+            replica.dispose()
+
+        # Then writes go to the primary and reads to the replica, except
+        # inside a batch
+        self.assertEqual(201, created.status_code, f"{created.data}")
+        self.assertEqual(
+            ["replica"], [g["groupName"] for g in response.json["results"]]
+        )
+        self.assertEqual(1, Groups.query.count())
+        body = batch.json["responses"][0]["body"]
+        self.assertEqual([2], [g["kgcId"] for g in body["results"]])
+
+    def test_events_follow_rotated(self):
+        from app.events import follow, publish
+
+        # Given a log rotated on every write, so the first event is gone
+        self.app.config["EVENTS_LOG_MAX_BYTES"] = 1
+        for key in [1, 2, 3]:
+            publish([{"table": "groups", "key": key, "op": "insert"}])
+
+        # When
+        def resume(last_generation):
+            events = follow(test_events_path, last_generation, timeout=0.1)
+            return [(e["op"], e["gen"]) for e in events if e is not None]
+
+        # Then
+        self.assertEqual([("insert", 2), ("insert", 3)], resume(1))
+        self.assertEqual([("reset", 1), ("insert", 2), ("insert", 3)], resume(0))
+
+    def test_events_GET_limited(self):
+        from app.limits import try_slot
+
+        # Given every stream slot taken
+        self.app.config.update(STREAM_CONCURRENCY=1, STREAM_QUEUE=0)
+        header, _ = prep_call(self)
+        slot = try_slot("stream", 1)
+        self.assertIsNotNone(slot)
+
+        # When
+        try:
+            response = self.client.get("api/events", headers=header)
+        finally:
+            os.close(slot)
+
+        # Then
+        self.assertEqual(503, response.status_code, f"{response.data}")
+        response = self.client.get("api/events", headers=header)
+        self.assertEqual(200, response.status_code)
+        open_slot = try_slot("stream", 1)
+        response.close()
+        closed_slot = try_slot("stream", 1)
+        self.assertIsNone(open_slot)
+        self.assertIsNotNone(closed_slot)
+        os.close(closed_slot)
+
+    def test_load_shedding(self):
+        from app.limits import try_slot
+
+        # Given every read slot taken
+        self.app.config.update(READ_CONCURRENCY=1, READ_QUEUE=0)
+        header, _ = prep_call(self)
+        slot = try_slot("read", 1)
+        self.assertIsNotNone(slot)
+
+        # When
+        try:
+            response = self.client.get("api/groups", headers=header)
+        finally:
+            os.close(slot)
+
+        # Then
+        self.assertEqual(503, response.status_code, f"{response.data}")
+        self.assertEqual("2", response.headers["Retry-After"])
+        response = self.client.get("api/groups", headers=header)
+        self.assertEqual(200, response.status_code, f"{response.data}")
+
+    def test_statement_timeout(self):
+        from app.limits import StatementTimeout
+
+        db.session.info["statement_timeout"] = 0.01
+        slow = (
+            "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n "
+            "WHERE i < 100000000) SELECT count(*) FROM n"
+        )
+        with self.assertRaises(StatementTimeout):
+            db.session.execute(db.text(slow))
+        db.session.rollback()
+        db.session.info.pop("statement_timeout")
+        self.assertEqual(1, db.session.execute(db.text("SELECT 1")).scalar())
+
+    def test_metrics(self):
+        import subprocess
+        from app import metrics
+
+        # Given snapshots left by a live and an exited worker
+        metrics.reset()
+        labels = [["endpoint", "api.get_groups"], ["method", "GET"]]
+        snapshot = {"counters": [["sql_statements_total", labels, 5]]}
+        exited = subprocess.Popen(["true"])
+        exited.wait()
+        os.makedirs(test_metrics_dir, exist_ok=True)
+        for pid in [os.getppid(), exited.pid]:
+            with open(os.path.join(test_metrics_dir, f"{pid}.json"), "w") as f:
+                json.dump(snapshot, f)
+        header, _ = prep_call(self)
+        self.client.get("api/groups", headers=header)
+        metrics.observe("db_pool_checkout_seconds", 0.003, pool="primary")
+
+        self.app.config["METRICS_TOKEN"] = "scraper-token"
+
+        # When
+        response = self.client.get("/metrics", headers=header)
+        scraper = self.client.get(
+            "/metrics", headers=create_token_header("scraper-token")
+        )
+        anonymous = self.client.get("/metrics")
+
+        # Then
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(200, scraper.status_code)
+        self.assertEqual(401, anonymous.status_code)
+        text = response.get_data(as_text=True)
+        self.assertIn("# TYPE db_pool_checkout_seconds histogram", text)
+        self.assertIn(
+            'db_pool_checkout_seconds_bucket{pool="primary",le="0.005"} 1', text
+        )
+        self.assertIn('db_pool_checkout_seconds_count{pool="primary"} 1', text)
+        get_groups = 'endpoint="api.get_groups",method="GET"'
+        self.assertIn(f'http_requests_total{{{get_groups},status="200"}} 1', text)
+        self.assertIn(f"http_request_duration_seconds_count{{{get_groups}}} 1", text)
+        # Our own statements plus 5 from each snapshot
+        statements = [
+            line
+            for line in text.splitlines()
+            if line.startswith(f"sql_statements_total{{{get_groups}}}")
+        ]
+        self.assertGreater(float(statements[0].split()[-1]), 10)
+        # The exited worker's snapshot was archived
+        self.assertTrue(os.path.exists(os.path.join(test_metrics_dir, "archive.json")))
+        metrics.reset()
+
+    def test_server_timing(self):
+        # Given
+        header, _ = prep_call(self)
+        self.app.debug = True
+        self.app.config["QUERY_BUDGET"] = 0
+
+        # When
+        with self.assertLogs(self.app.logger, "WARNING") as logs:
+            response = self.client.get("api/groups", headers=header)
+
+        # Then
+        self.assertEqual(200, response.status_code)
+        timings = dict(
+            part.split(";", 1) for part in response.headers["Server-Timing"].split(", ")
+        )
+        self.assertEqual(["auth", "db", "serialize", "total"], list(timings))
+        self.assertRegex(timings["db"], r'dur=[\d.]+;desc="\d+ statements"')
+        self.assertIn("GET /api/groups? ran", logs.output[0])
+        self.assertIn("SELECT", logs.output[0])
+
+    def test_profile(self):
+        # Given
+        header, _ = prep_call(self)
+        user = User(username="susan", email="susan@example.com")
+        db.session.add(user)
+        db.session.commit()
+        user_header = create_token_header(user.get_token())
+        db.session.commit()
+
+        # When
+        response = self.client.get("api/groups?_profile=1", headers=header)
+        not_admin = self.client.get("api/groups?_profile=1", headers=user_header)
+
+        # Then
+        self.assertEqual(200, response.status_code)
+        self.assertEqual("text/plain", response.mimetype)
+        report = response.get_data(as_text=True)
+        self.assertIn("GET /api/groups?_profile=1 -> 200 OK", report)
+        self.assertIn("function calls", report)
+        self.assertRegex(report, r"\d+ SQL statements in")
+        self.assertIn("SELECT", report)
+        self.assertEqual(200, not_admin.status_code)
+        self.assertIn("_meta", not_admin.json)
+
+    def test_slow_query_log(self):
+        # Given
+        from app import slow_queries
+
+        header, _ = prep_call(self)
+        self.app.config["SLOW_QUERY_SECONDS"] = 0
+
+        slow_queries._plans.clear()
+
+        # When
+        self.client.get("api/groups/123", headers=header)
+        # Mark the captured plan to see whether it is reused
+        for key, (explained_at, plan) in slow_queries._plans.items():
+            if "FROM groups" in key:
+                slow_queries._plans[key] = (explained_at, {"explain": "reused"})
+        self.client.get("api/groups/124", headers=header)
+
+        # Then
+        with open(test_slow_queries_path) as f:
+            entries = [json.loads(line) for line in f]
+        groups = [e for e in entries if "FROM groups" in e["statement"]]
+        # Both logged, the plan captured once
+        self.assertEqual(2, len(groups))
+        self.assertEqual("reused", groups[1]["explain"])
+        entry = groups[0]
+        self.assertEqual("api.get_group", entry["endpoint"])
+        self.assertEqual("GET", entry["method"])
+        self.assertEqual("sqlite", entry["database"])
+        self.assertNotIn("123", json.dumps(entry["parameters"]))
+        self.assertIn("int", json.dumps(entry["parameters"]))
+        self.assertIn("detail", entry["explain"][0])
+
+    def test_error_mail(self):
+        # Given
+        from flask.logging import default_handler
+        from app import log
+
+        smtp = SMTPStandIn()
+        mail_handler = log.ErrorMailHandler(
+            mailhost=("127.0.0.1", smtp.port),
+            fromaddr="no-reply@localhost",
+            toaddrs=["admin@localhost"],
+            subject="SRDP Database Failure",
+            limit=2,
+        )
+
+        def fail(error):
+            try:
+                raise error
+            except Exception:
+                self.app.logger.exception("Request failed")
+
+        # When
+        log.init_app(self.app, [mail_handler])
+        queue_handler, _ = self.app.extensions["log_queue"]
+        try:
+            for _ in range(3):
+                fail(ZeroDivisionError())
+            fail(KeyError())
+            fail(ValueError())
+            log.stop(self.app)
+            mailed = [message["Subject"] for message in smtp.messages]
+            # An interval later
+            mail_handler.window_start -= 3600
+            for key in mail_handler.last_sent:
+                mail_handler.last_sent[key] -= 3600
+            log.start(self.app)
+            fail(ZeroDivisionError())
+            log.stop(self.app)
+        finally:
+            self.app.logger.removeHandler(queue_handler)
+            self.app.logger.addHandler(default_handler)
+            smtp.close()
+
+        # Then
+        self.assertEqual(["SRDP Database Failure"] * 2, mailed)
+        self.assertEqual(
+            "SRDP Database Failure (and 2 more like it)", smtp.messages[2]["Subject"]
+        )
+        self.assertIn("ZeroDivisionError", smtp.messages[2].get_payload())
+
+    def test_send_email(self):
+        # Given
+        from app import mail
+        from app.email import get_sender, send_email, stop_sender
+
+        smtp = SMTPStandIn()
+        self.app.config.update(
+            MAIL_SERVER="127.0.0.1",
+            MAIL_PORT=smtp.port,
+            MAIL_SUPPRESS_SEND=False,
+            MAIL_WORKERS=1,
+        )
+        mail.init_app(self.app)
+
+        # When
+        try:
+            for i in range(5):
+                send_email(
+                    f"Message {i}",
+                    sender="no-reply@localhost",
+                    recipients=[f"user{i}@localhost"],
+                    text_body="text",
+                    html_body="<p>html</p>",
+                )
+            get_sender().join()
+            threads = [
+                thread
+                for thread in threading.enumerate()
+                if thread.name.startswith("mail-sender")
+            ]
+        finally:
+            stop_sender(self.app)
+            smtp.close()
+
+        # Then
+        self.assertEqual(
+            [f"Message {i}" for i in range(5)],
+            [message["Subject"] for message in smtp.messages],
+        )
+        # One thread, over one kept connection
+        self.assertEqual(1, len(threads))
+        self.assertEqual(1, smtp.connections)
+
+    def test_send_email_refused(self):
+        # Given a server refusing the recipient
+        from app import mail
+        from app.email import get_sender, send_email, stop_sender
+
+        smtp = SMTPStandIn()
+        smtp.refuse_recipients = True
+        self.app.config.update(
+            MAIL_SERVER="127.0.0.1", MAIL_PORT=smtp.port, MAIL_SUPPRESS_SEND=False
+        )
+        mail.init_app(self.app)
+
+        # When
+        try:
+            with self.assertLogs(self.app.logger, "ERROR") as logs:
+                send_email(
+                    "Message",
+                    sender="no-reply@localhost",
+                    recipients=["nobody@localhost"],
+                    text_body="text",
+                    html_body="<p>html</p>",
+                )
+                get_sender().join()
+        finally:
+            stop_sender(self.app)
+            smtp.close()
+
+        # Then the SMTP error's traceback is logged
+        self.assertEqual([], smtp.messages)
+        self.assertIn("Failed to send mail to nobody@localhost", logs.output[0])
+        self.assertIn("SMTPRecipientsRefused", logs.output[0])
+
+    def test_lazy_extensions(self):
+        class LazyConfig(TestConfig):
+            LAZY_EXTENSIONS = True
+
+        app = create_app(LazyConfig)
+        self.assertNotIn("migrate", app.extensions)
+        self.assertNotIn("mail", app.extensions)
+        with app.app_context():
+            ensure_extension("mail")
+        self.assertIn("mail", app.extensions)
+
+        # Eager by default
+        self.assertIn("migrate", self.app.extensions)
+
+    def test_swagger_json(self):
+        response = self.client.get("api/swagger.json")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("/api/groups", response.json["paths"])
+        self.assertNotIn("/api/swagger.json", response.json["paths"])
+        etag = response.headers["ETag"]
+
+        # Served from the cache and revalidated by ETag
+        response = self.client.get("api/swagger.json", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+
+    def test_jobs_export(self):
+        # Given
+        group = Groups()
+        group.from_dict(groupData)
+        db.session.add(group)
+        db.session.commit()
+        header, payload = prep_call(
+            self, {"kind": "export", "params": {"table": "groups"}}
+        )
+
+        # When
+        response = self.client.post("api/jobs", headers=header, data=payload)
+        result = self.runner.invoke(args=["jobs-worker", "--processes", "1", "--burst"])
+        job = self.client.get(response.headers["Location"], headers=header)
+        download = self.client.get(job.json["_links"]["download"], headers=header)
+
+        # Then
+        self.assertEqual(202, response.status_code, f"{response.data}")
+        self.assertEqual(0, result.exit_code, result.output)
+        self.assertEqual("succeeded", job.json["status"], job.json["error"])
+        self.assertEqual({"rows": 1}, job.json["result"])
+        lines = download.get_data(as_text=True).splitlines()
+        download.close()
+        self.assertEqual("kgcId,groupName,country,startYear,endYear", lines[0])
+        self.assertEqual(2, len(lines))
+
+    def test_job_taken_over(self):
+        # Given a job that went stale and was claimed by a second worker
+        from app.jobs import claim, run, submit
+
+        submit("delete", {"table": "groups", "keys": [123456]})
+        job = claim("first")
+        # The first worker's copy of the job
+        db.session.expunge(job)
+        Job.query.filter_by(id=job.id).update({"worker": "second"})
+        db.session.commit()
+
+        # When the first worker finishes
+        with self.assertLogs(self.app.logger, "WARNING") as logs:
+            run(job)
+
+        # Then the second worker's claim stands
+        job = Job.query.get(job.id)
+        self.assertEqual("running", job.status)
+        self.assertEqual("second", job.worker)
+        self.assertIsNone(job.result)
+        self.assertIn("taken over", logs.output[0])
+
+    def test_jobs_export_expired(self):
+        # Given an export that finished longer ago than JOBS_RESULT_SECONDS
+        from app.jobs import expire_results, job_path
+
+        path = job_path("export-old.csv")
+        with open(path, "w") as f:
+            f.write("kgcId,groupName,country,startYear,endYear\n")
+        job = Job(
+            kind="export",
+            params=json.dumps({"table": "groups", "path": path}),
+            status="succeeded",
+            finished_at=datetime.utcnow() - timedelta(days=30),
+        )
+        db.session.add(job)
+        db.session.commit()
+        header, _ = prep_call(self)
+
+        # When
+        expire_results()
+        response = self.client.get(f"api/jobs/{job.id}/download", headers=header)
+
+        # Then
+        self.assertEqual("expired", Job.query.get(job.id).status)
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(404, response.status_code)
+
+    def test_job_input_kept_when_taken_over(self):
+        # Given a sync job that went stale and was claimed by a second worker
+        from app.jobs import claim, job_path, run, submit
+
+        path = job_path("sync-taken-over.csv")
+        with open(path, "w") as f:
+            f.write("kgcId,groupName,country,startYear,endYear\n")
+            f.write("1,groupOne,countryOne,1990,2000\n")
+        submit("sync", {"table": "groups", "path": path})
+        job = claim("first")
+        db.session.expunge(job)
+        Job.query.filter_by(id=job.id).update({"worker": "second"})
+        db.session.commit()
+
+        # When the first worker finishes
+        with self.assertLogs(self.app.logger, "WARNING"):
+            run(job)
+
+        # Then the second worker can still read the upload
+        self.assertTrue(os.path.exists(path))
+        run(Job.query.get(job.id))
+        self.assertEqual("succeeded", Job.query.get(job.id).status)
+        self.assertFalse(os.path.exists(path))
+
+    def test_organization_DELETE_async(self):
+        # Given
+        for model, data in [(Groups, groupData), (Organizations, orgData)]:
+            instance = model()
+            instance.from_dict(data)
+            db.session.add(instance)
+        db.session.commit()
+        header, _ = prep_call(self)
+        header["Prefer"] = "respond-async"
+
+        # When
+        response = self.client.delete("api/organizations/123456", headers=header)
+        queued = Organizations.query.get(123456)
+        self.runner.invoke(args=["jobs-worker", "--processes", "1", "--burst"])
+
+        # Then
+        self.assertEqual(202, response.status_code, f"{response.data}")
+        self.assertEqual("queued", response.json["status"])
+        self.assertIsNotNone(queued)
+        db.session.remove()
+        self.assertIsNone(Organizations.query.get(123456))
+
     def tearDown(self):
         db.session.remove()
         db.drop_all()
         self.app_context.pop()
         os.remove(test_db_path)
+        for path in [
+            test_events_path,
+            test_events_path + ".gen",
+            test_events_path + ".1",
+            test_slow_queries_path,
+        ]:
+            if os.path.exists(path):
+                os.remove(path)
+        shutil.rmtree(test_jobs_dir, ignore_errors=True)
+        shutil.rmtree(test_metrics_dir, ignore_errors=True)
+
+
+# The ingestion examples import each other as top-level modules
+sys.path.insert(0, os.path.join(basedir, "examples", "api", "ingestion"))
+
+
+class APIStandIn:
+    """A session and config for ``send_to_api``, answering with ``statuses``."""
+
+    base_url = "http://localhost/api/"
+    timeout = (10, 60)
+
+    def __init__(self, *statuses):
+        self.statuses = list(statuses)
+        self.session = self
+        self.posts = []
+        self.timeouts = []
+        self.expiration = 1
+
+    def auth_header(self):
+        return {"Authorization": "Bearer token"}
+
+    def post(self, url, json=None, headers=None, timeout=None):
+        self.posts.append((url, headers))
+        self.timeouts.append(timeout)
+        status = self.statuses.pop(0)
+        if isinstance(status, Exception):
+            raise status
+        response = type("Response", (), {})()
+        response.status_code = status
+        return response
+
+
+class IngestionCase(unittest.TestCase):
+    def setUp(self):
+        import initial_migration
+
+        self.migration = initial_migration
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        # Record backoffs instead of sleeping, without jitter
+        self.sleeps = []
+        initial_migration.time = SimpleNamespace(sleep=self.sleeps.append)
+        initial_migration.random = SimpleNamespace(uniform=lambda a, b: 1.0)
+
+    def test_checkpoint_resume(self):
+        # Given
+        path = os.path.join(self.dir, "checkpoint.json")
+        csv_path = os.path.join(self.dir, "groups.csv")
+        with open(csv_path, "w") as f:
+            f.write("kgcId,groupName\n")
+            f.writelines(f"{i},group{i}\n" for i in range(8))
+        checkpoint = self.migration.Checkpoint(path)
+        checkpoint.mark("groups.csv", 0, 2)
+        checkpoint.mark("groups.csv", 5, 6)
+        checkpoint.mark("groups.csv", 2, 3)
+        sizer = self.migration.BatchSizer(initial=2)
+
+        # When
+        resumed = self.migration.Checkpoint(path)
+        batches = list(
+            self.migration.iter_batches(csv_path, "groups.csv", resumed, sizer)
+        )
+
+        # Then
+        self.assertEqual({"groups.csv": [[0, 3], [5, 6]]}, resumed.done)
+        self.assertEqual(
+            [(3, 5, [3, 4]), (6, 8, [6, 7])],
+            [(start, end, [r["kgcId"] for r in rows]) for start, end, rows in batches],
+        )
+        self.assertEqual({}, self.migration.Checkpoint(path, reset=True).done)
+
+    def test_send_to_api_retries_server_errors(self):
+        # Given
+        cfg = APIStandIn(503, self.migration.requests.ConnectionError(), 502, 201)
+
+        # When
+        response = self.migration.send_to_api("groups", [], cfg, backoff=0.5)
+
+        # Then
+        self.assertEqual(201, response.status_code)
+        self.assertEqual([0.5, 1.0, 2.0], self.sleeps)
+        keys = {headers["Idempotency-Key"] for _, headers in cfg.posts}
+        self.assertEqual(4, len(cfg.posts))
+        self.assertEqual(1, len(keys))
+
+    def test_send_to_api_timeout(self):
+        # Given
+        cfg = APIStandIn(self.migration.requests.ReadTimeout(), 201)
+
+        # When
+        response = self.migration.send_to_api("groups", [], cfg)
+
+        # Then
+        self.assertEqual(201, response.status_code)
+        self.assertEqual([(10, 60), (10, 60)], cfg.timeouts)
+        self.assertEqual(1, len(self.sleeps))
+
+    def test_send_to_api_gives_up(self):
+        # Given
+        cfg = APIStandIn(500, 500, 500, 400)
+
+        # When
+        response = self.migration.send_to_api("groups", [], cfg, retries=2)
+
+        # Then
+        self.assertEqual(500, response.status_code)
+        self.assertEqual(3, len(cfg.posts))
+        self.assertEqual([1.0, 2.0], self.sleeps)
+
+    def test_send_to_api_client_error(self):
+        # Given
+        cfg = APIStandIn(400)
+
+        # When
+        response = self.migration.send_to_api("groups", [], cfg)
+
+        # Then
+        self.assertEqual(400, response.status_code)
+        self.assertEqual([], self.sleeps)
+
+    def test_batch_sizer(self):
+        # Given
+        sizer = self.migration.BatchSizer(
+            initial=100, minimum=30, maximum=150, target_latency=2.0
+        )
+
+        # When
+        sizer.observe(1.5)
+        steady = sizer.size
+        sizer.observe(3.0)
+        halved = sizer.size
+        sizer.observe(3.0)
+        floored = sizer.size
+        for _ in range(10):
+            sizer.observe(0.1)
+
+        # Then
+        self.assertEqual(100, steady)
+        self.assertEqual(50, halved)
+        self.assertEqual(30, floored)
+        self.assertEqual(150, sizer.size)
+
+    def test_validation_rules_match_schemas(self):
+        # Given
+        import validation
+        from marshmallow import fields
+        from app.api_spec import (
+            GroupInputSchema,
+            NonviolentTacticsInputSchema,
+            OrganizationInputSchema,
+            ViolentTacticsInputSchema,
+        )
+
+        schemas = {
+            "groups.csv": GroupInputSchema,
+            "orgs.csv": OrganizationInputSchema,
+            "violent_tactics.csv": ViolentTacticsInputSchema,
+            "nonviolent_tactics.csv": NonviolentTacticsInputSchema,
+        }
+
+        # When
+        for key, schema in schemas.items():
+            rules = validation.RULES[key]
+            schema_fields = schema().fields
+
+            # Then
+            self.assertEqual(
+                {name for name, field in schema_fields.items() if field.required},
+                set(rules.required),
+                key,
+            )
+            self.assertEqual(
+                {
+                    name
+                    for name, field in schema_fields.items()
+                    if isinstance(field, fields.Integer)
+                },
+                set(rules.integers),
+                key,
+            )
+
+    def test_validation_agrees_with_schemas(self):
+        # Given
+        import re
+        import pandas as pd
+        import validation
+        from app.api_spec import GroupInputSchema, ViolentTacticsInputSchema
+
+        files = {
+            "groups.csv": (
+                GroupInputSchema,
+                "kgcId,groupName,country,startYear,endYear\n"
+                "1,valid,x,1990,2000\n"
+                "2,no years,x,,\n"
+                "3,,no name,1990,2000\n"
+                "x,bad kgcId,x,1990,2000\n"
+                "5,backwards,x,2001,2000\n"
+                "6,same year,x,2000,2000\n"
+                "7,no start,x,,1990\n",
+            ),
+            "violent_tactics.csv": (
+                ViolentTacticsInputSchema,
+                "facId,year,againstState,againstOrgFatal\n"
+                "1,1990,0,\n"
+                "1,,0,0\n"
+                "1,1991,some,0\n"
+                ",1993,0,0\n"
+                "1,1994,,3\n",
+            ),
+        }
+
+        for key, (schema, rows) in files.items():
+            path = os.path.join(self.dir, key)
+            with open(path, "w") as f:
+                f.write(rows)
+
+            # When
+            problems = validation.validate_frame(
+                validation.read_frame(path), validation.RULES[key]
+            )
+            flagged = {
+                int(line)
+                for problem in problems
+                for line in re.findall(r"\d+", problem.split("(lines ")[1])
+            }
+            # The rows as the migration posts them, with missing values left out
+            rejected = {
+                line
+                for line, record in enumerate(
+                    self.migration.to_records(pd.read_csv(path)), start=2
+                )
+                if schema().validate(
+                    {name: value for name, value in record.items() if value is not None}
+                )
+            }
+
+            # Then
+            self.assertTrue(flagged, key)
+            self.assertEqual(rejected, flagged, key)
+
+        # Unlike the schemas, which truncate them, fractions are rejected
+        fraction = pd.DataFrame({"facId": ["1"], "year": ["1990.5"]})
+        self.assertEqual(
+            {}, ViolentTacticsInputSchema().validate({"facId": 1, "year": 1990.5})
+        )
+        self.assertEqual(
+            ["year must be an integer (lines 2)"],
+            validation.validate_frame(
+                fraction, validation.RULES["violent_tactics.csv"]
+            ),
+        )
+
+    def tearDown(self):
+        self.migration.time = time
+        self.migration.random = random
 
 
 if __name__ == "__main__":